@@ -0,0 +1,139 @@
+"""Generators for synthetic benchmark data: styles, documents, outputs and ASTs"""
+
+import os
+from os.path import join
+
+import panflute as pf
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do".split()
+
+
+def styles(count=200, depth=20, keys=20, filters=10):
+    """
+    Return a style file as a dictionary. The styles form chains of depth styles,
+    each inheriting the one before. Every style has keys settings for all formats,
+    a filter list, replace items and nested metadata for html and latex.
+    """
+    result = {"All": {"all": {"lang": "en", "pdf-engine": "xelatex"}}}
+    for i in range(count):
+        style = {
+            "all": {f"key-{i}-{k}": f"value {k}" for k in range(keys)},
+            "html": {
+                "toc": True,
+                "filter": [f"~/filter_{i}_{n}.py" for n in range(filters)],
+                "replace-in-output": [
+                    {"pattern": f"(<h{n}>)", "replacement-text": f"<hr>\\1 {i}"}
+                    for n in range(1, 4)
+                ],
+                "metadata": {"nested": {"numbers": list(range(10)), "style": i}},
+            },
+            "latex": {
+                "filter": [f"~/filter_{i}_{n}.py" for n in range(filters)],
+                "variables": {f"var-{k}": k for k in range(keys)},
+                "add-to-template": [f"\\usepackage{{package{i}}}"],
+            },
+        }
+        if i % depth:
+            style["inherits"] = [f"Style-{i - 1}"]
+        result[f"Style-{i}"] = style
+    return result
+
+
+def last_style(count=200):
+    """Return the name of the last style, which ends the last inheritance chain"""
+    return f"Style-{count - 1}"
+
+
+def front_matter(keys=500, style="Style-19"):
+    """Return a metadata block with many keys and a style definition"""
+    lines = ["---", "title: Benchmark", "formats: [html, pdf]", f"style: {style}"]
+    lines.append("style-definition:")
+    lines.append(f"  inherits: {style}")
+    lines.append("  all:")
+    lines.extend(f"    doc-key-{k}: {k}" for k in range(keys // 10))
+    lines.extend(f"key-{k}: value of key {k}" for k in range(keys))
+    lines.append("authors:")
+    for k in range(50):
+        lines.extend([f"  - name: Author {k}", f"    mail: author{k}@example.com"])
+    lines.append("---")
+    return "\n".join(lines) + "\n"
+
+
+def markdown(paragraphs=200, metadata_keys=50, style="Default"):
+    """Return a markdown document with a metadata block"""
+    body = "\n\n".join(
+        " ".join(WORDS[(p + w) % len(WORDS)] for w in range(60))
+        for p in range(paragraphs)
+    )
+    return front_matter(metadata_keys, style) + "\n" + body + "\n"
+
+
+def document(number, paragraphs=20, style="Default"):
+    """Return a small markdown document, as found in a folder of many documents"""
+    body = "\n\n".join(
+        " ".join(WORDS[(number + p + w) % len(WORDS)] for w in range(60))
+        for p in range(paragraphs)
+    )
+    return (
+        f"---\ntitle: Document {number}\nauthor: Benchmark\nstyle: {style}\n---\n"
+        f"\n# Document {number}\n\n{body}\n"
+    )
+
+
+def html_output(size=4 * 1024 * 1024):
+    """Return an html document of about size characters"""
+    paragraph = "<p>" + " ".join(WORDS * 8) + "</p>\n"
+    head = "<html>\n<head>\n<title>Benchmark</title>\n</head>\n<body>\n"
+    parts = [head]
+    length = len(head)
+    number = 0
+    while length < size:
+        if number % 20 == 0:
+            heading = f"<h2>Chapter {number // 20}</h2>\n"
+            parts.append(heading)
+            length += len(heading)
+        parts.append(paragraph)
+        length += len(paragraph)
+        number += 1
+    parts.append("</body>\n</html>\n")
+    return "".join(parts)
+
+
+def panflute_doc(paragraphs=2000, words=50, div_every=10, fmt="latex"):
+    """
+    Return a document with many Str and Space elements. Every div_every paragraph
+    is wrapped in a div with the class "noindent".
+    """
+    blocks = []
+    for p in range(paragraphs):
+        inlines = []
+        for w in range(words):
+            if w:
+                inlines.append(pf.Space())
+            inlines.append(pf.Str(WORDS[(p + w) % len(WORDS)]))
+        para = pf.Para(*inlines)
+        if p % div_every == 0:
+            para = pf.Div(para, classes=["noindent"])
+        blocks.append(para)
+    return pf.Doc(*blocks, format=fmt, api_version=(1, 23))
+
+
+def config_dir(home, style_file_content, filters=20):
+    """
+    Create a configuration folder of pandoc_styles in home, with the style file,
+    some filters and a stylepack "pack". Return the path of the folder.
+    """
+    # pandoc_styles finds its configuration folder on import, after HOME is set
+    from pandoc_styles.utils import file_write, yaml_dump
+
+    pack_file = join(home, "pandoc_styles", "styles", "pack", "pack.yaml")
+    folder = join(home, "pandoc_styles")
+    for sub in ["filter", "misc", join("styles", "pack", "filter")]:
+        os.makedirs(join(folder, sub), exist_ok=True)
+    file_write(join(folder, "config.yaml"), "pandoc-path:\n")
+    yaml_dump(style_file_content, join(folder, "styles.yaml"))
+    yaml_dump({"Default": {"all": {"lang": "en"}}}, pack_file)
+    for n in range(filters):
+        file_write(join(folder, "filter", f"filter_{n}.py"), "")
+        file_write(join(folder, "styles", "pack", "filter", f"filter_{n}.py"), "")
+    return folder
@@ -0,0 +1,309 @@
+"""
+End-to-end benchmark of pandoc_styles with a stub pandoc. A small script named
+pandoc is put first on the PATH: it answers --version, -D and
+--print-default-data-file and writes a fake output of a fixed size, so a build
+measures everything pandoc_styles does per document (the style, the cfg, sass,
+templates, the yaml and json files, flight scripts and starting the processes),
+but not the cost of pandoc itself.
+
+    python benchmarks/e2e.py                           # 10, 100 and 1000 documents
+    python benchmarks/e2e.py --documents 10 10000 --mode individual
+    python benchmarks/e2e.py --args "--jobs 4 --cache" --save e2e.json
+
+The modes are:
+
+    folder      all documents of the folder converted together (--folder)
+    individual  every document converted on its own (--folder --individual)
+    formats     every document on its own, to html, pdf and docx
+
+For every run the documents per second, the calls of the stub and the overhead
+per document are shown. The overhead is the wall time minus the time the stub
+needs to start, per document. The marginal cost of a document is the difference
+of the wall time between the smallest and the largest run, per document.
+"""
+
+import json
+import os
+import shlex
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join
+
+import data
+
+ROOT = dirname(dirname(abspath(__file__)))
+RESULTS_VERSION = 1
+MODES = {
+    "folder": ["--folder"],
+    "individual": ["--folder", "--individual"],
+    "formats": ["--folder", "--individual", "--to", "html", "pdf", "docx"],
+}
+
+# -S: the stub starts faster without the site packages
+STUB = '''#!{python} -S
+"""Stand-in for pandoc, that writes a fake output of PANDOC_STUB_SIZE bytes"""
+import os
+import sys
+
+args = sys.argv[1:]
+with open(os.environ["PANDOC_STUB_LOG"], "a") as f:
+    f.write("call\\n")
+if "--version" in args:
+    print("pandoc 3.1.9\\nFeatures: +server +lua\\nScripting engine: Lua 5.4")
+    sys.exit()
+if "-D" in args:
+    print("<html><head>$for(css)$<link href=\\"$css$\\">$endfor$</head>")
+    print("<body>$body$</body></html>")
+    sys.exit()
+if any(arg.startswith("--print-default-data-file") for arg in args):
+    print("/* default data file */")
+    sys.exit()
+
+output = None
+for i, arg in enumerate(args):
+    if arg == "-o" and i + 1 < len(args):
+        output = args[i + 1]
+    elif arg.startswith("--output="):
+        output = arg.split("=", 1)[1]
+to = None
+for i, arg in enumerate(args):
+    if arg in ("-t", "--to") and i + 1 < len(args):
+        to = args[i + 1]
+    elif arg.startswith("--to="):
+        to = arg.split("=", 1)[1]
+
+if to == "json":
+    import json
+
+    text = json.dumps(
+        {{"pandoc-api-version": [1, 23, 1], "meta": {{}}, "blocks": []}}
+    )
+elif output is None:
+    # conversions of filters read stdin
+    text = sys.stdin.read()
+else:
+    size = int(os.environ.get("PANDOC_STUB_SIZE", "0"))
+    paragraph = "<p>" + "lorem ipsum dolor sit amet " * 8 + "</p>\\n"
+    text = "<html><head><title>stub</title></head><body>\\n"
+    text += paragraph * (size // len(paragraph)) + "</body></html>\\n"
+if output is None:
+    sys.stdout.write(text)
+else:
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(text)
+'''
+
+
+class Environment:
+    """A temporary home with the default configuration and the stub pandoc"""
+
+    def __init__(self, output_size):
+        self.home = tempfile.mkdtemp(prefix="pandoc_styles_e2e_")
+        self.bin = join(self.home, "bin")
+        os.makedirs(self.bin)
+        self.stub = join(self.bin, "pandoc")
+        with open(self.stub, "w", encoding="utf-8") as f:
+            f.write(STUB.format(python=sys.executable))
+        os.chmod(self.stub, os.stat(self.stub).st_mode | stat.S_IEXEC)
+        self.log = join(self.home, "calls.log")
+
+        self.env = dict(os.environ)
+        self.env.update(
+            {
+                "HOME": self.home,
+                "USERPROFILE": self.home,
+                "PATH": self.bin + os.pathsep + self.env.get("PATH", ""),
+                "PYTHONPATH": ROOT,
+                "PANDOC_STUB_LOG": self.log,
+                "PANDOC_STUB_SIZE": str(output_size),
+            }
+        )
+        self.pandoc_styles(["--init"], self.home)
+
+    def pandoc_styles(self, args, cwd):
+        """Run pandoc_styles, return the wall time and the calls of the stub"""
+        if os.path.exists(self.log):
+            os.remove(self.log)
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-m", "pandoc_styles.main", "--quiet"] + args,
+            cwd=cwd,
+            env=self.env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        wall = time.perf_counter() - start
+        if process.returncode:
+            sys.exit(f"pandoc_styles {' '.join(args)} failed:\n{process.stdout}")
+        return wall, self.calls()
+
+    def calls(self):
+        try:
+            with open(self.log, encoding="utf-8") as f:
+                return sum(1 for _ in f)
+        except FileNotFoundError:
+            return 0
+
+    def stub_time(self, repeat=20):
+        """Return the mean wall time of one call of the stub"""
+        args = [self.stub, "-t", "html", "-o", join(self.home, "stub.html"), "x.md"]
+        subprocess.run(args, env=self.env, check=True)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            subprocess.run(args, env=self.env, check=True)
+        return (time.perf_counter() - start) / repeat
+
+    def warm_up(self, args):
+        """
+        Fill the caches of pandoc_styles: the compiled styles and, if args has
+        --cache, the pandoc version, templates, ...
+        """
+        folder = self.documents(1, 1)
+        self.pandoc_styles(MODES["formats"] + args, folder)
+        shutil.rmtree(folder, ignore_errors=True)
+
+    def documents(self, count, paragraphs):
+        """Return a new folder with count documents"""
+        folder = tempfile.mkdtemp(prefix=f"docs_{count}_", dir=self.home)
+        for number in range(count):
+            path = join(folder, f"document_{number:05}.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(data.document(number, paragraphs))
+        return folder
+
+    def remove(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+
+def run(env, mode, count, args, stub_time):
+    folder = env.documents(count, args.paragraphs)
+    try:
+        wall, calls = env.pandoc_styles(MODES[mode] + shlex.split(args.args), folder)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    overhead = max(wall - calls * stub_time, 0) / count
+    return {
+        "mode": mode,
+        "documents": count,
+        "wall": round(wall, 6),
+        "documents_per_second": round(count / wall, 3),
+        "pandoc_calls": calls,
+        "overhead_per_document": round(overhead, 6),
+    }
+
+
+def marginal_costs(results):
+    """Return the cost of one more document of each mode, from its runs"""
+    costs = {}
+    for mode in MODES:
+        runs = sorted(
+            (r for r in results if r["mode"] == mode), key=lambda r: r["documents"]
+        )
+        if len(runs) > 1 and runs[-1]["documents"] > runs[0]["documents"]:
+            first, last = runs[0], runs[-1]
+            costs[mode] = round(
+                (last["wall"] - first["wall"])
+                / (last["documents"] - first["documents"]),
+                6,
+            )
+    return costs
+
+
+def main():
+    parser = ArgumentParser(description="End-to-end benchmark with a stub pandoc")
+    parser.add_argument(
+        "--documents",
+        nargs="+",
+        type=int,
+        default=[10, 100, 1000],
+        metavar="N",
+        help="The numbers of documents to convert (10 to 10000).",
+    )
+    parser.add_argument(
+        "--mode",
+        nargs="+",
+        choices=list(MODES),
+        default=list(MODES),
+        help="The modes to run.",
+    )
+    parser.add_argument(
+        "--paragraphs",
+        type=int,
+        default=20,
+        help="The paragraphs of every document.",
+    )
+    parser.add_argument(
+        "--output-size",
+        type=int,
+        default=64 * 1024,
+        metavar="BYTES",
+        help="The size of every output the stub writes.",
+    )
+    parser.add_argument(
+        "--args",
+        default="",
+        help='More arguments for pandoc_styles, e.g. "--jobs 4 --cache".',
+    )
+    parser.add_argument("--save", metavar="FILE", help="Save the results as json.")
+    args = parser.parse_args()
+
+    for count in args.documents:
+        if not 10 <= count <= 10000:
+            parser.error(f"--documents must be between 10 and 10000, not {count}")
+    save = abspath(args.save) if args.save else None
+
+    env = Environment(args.output_size)
+    results = []
+    try:
+        stub_time = env.stub_time()
+        env.warm_up(shlex.split(args.args))
+        print(f"One call of the stub pandoc takes {stub_time * 1000:.1f} ms\n")
+        print(
+            f"{'mode':<12} {'docs':>6} {'wall':>9} {'docs/s':>8} "
+            f"{'calls':>6} {'overhead/doc':>13}"
+        )
+        for mode in args.mode:
+            for count in sorted(args.documents):
+                result = run(env, mode, count, args, stub_time)
+                results.append(result)
+                print(
+                    f"{mode:<12} {count:>6} {result['wall']:>8.2f}s "
+                    f"{result['documents_per_second']:>8.1f} "
+                    f"{result['pandoc_calls']:>6} "
+                    f"{result['overhead_per_document'] * 1000:>10.1f} ms",
+                    flush=True,
+                )
+    finally:
+        env.remove()
+
+    costs = marginal_costs(results)
+    if costs:
+        print("\nCost of one more document:")
+        for mode, cost in costs.items():
+            print(f"{mode:<12} {cost * 1000:>8.1f} ms")
+
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": RESULTS_VERSION,
+                    "args": args.args,
+                    "output_size": args.output_size,
+                    "stub_time": round(stub_time, 6),
+                    "results": results,
+                    "marginal_cost": costs,
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nSaved the results to {save}")
+
+
+if __name__ == "__main__":
+    main()
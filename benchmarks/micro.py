@@ -0,0 +1,381 @@
+"""
+Microbenchmarks of the pure python hot paths of pandoc_styles. pandoc is not
+needed: everything runs on generated data in a temporary home folder, so the real
+configuration folder is never touched.
+
+    python benchmarks/micro.py                    # run all benchmarks
+    python benchmarks/micro.py -k style -k walk   # only the matching ones
+    python benchmarks/micro.py --save baseline.json
+    python benchmarks/micro.py --compare baseline.json --threshold 1.2
+
+--compare exits with 1, if a benchmark got slower than the threshold allows, so
+it can be used to catch regressions before an upgrade.
+"""
+
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from copy import deepcopy
+from os.path import abspath, dirname, join
+
+import data
+
+# benchmark the checkout, not an installed version
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+RESULTS_VERSION = 1
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The function gets the context and returns the function
+    to time, a setup function (or None), whose result is passed to it and is not
+    timed, and how often to call it per measurement.
+    """
+
+    def register(factory):
+        BENCHMARKS[name] = factory
+        return factory
+
+    return register
+
+
+class Context:
+    """The generated data, shared by all benchmarks"""
+
+    def __init__(self, quick=False):
+        self.quick = quick
+        self.home = tempfile.mkdtemp(prefix="pandoc_styles_bench_")
+        os.environ["HOME"] = os.environ["USERPROFILE"] = self.home
+        self.work = join(self.home, "work")
+        os.makedirs(self.work)
+        os.chdir(self.work)
+
+        count = 40 if quick else 200
+        self.styles = data.styles(count=count)
+        self.style_name = data.last_style(count)
+        self.config_dir = data.config_dir(self.home, self.styles)
+        self.style_file = join(self.config_dir, "styles.yaml")
+
+        self.markdown_file = join(self.work, "doc.md")
+        with open(self.markdown_file, "w", encoding="utf-8") as f:
+            f.write(
+                data.markdown(
+                    metadata_keys=100 if quick else 500, style=self.style_name
+                )
+            )
+        self.front_matter_file = join(self.work, "front_matter.md")
+        with open(self.front_matter_file, "w", encoding="utf-8") as f:
+            f.write(
+                data.markdown(
+                    metadata_keys=500 if quick else 5000, style=self.style_name
+                )
+            )
+
+        self.html = data.html_output((1 if quick else 4) * 1024 * 1024)
+        self.paragraphs = 500 if quick else 5000
+
+    def pandoc_styles(self):
+        from pandoc_styles.main import PandocStyles
+
+        ps = PandocStyles([self.markdown_file], use_styles=[self.style_name])
+        ps.formats = ["html"]
+        return ps
+
+
+@benchmark("style_table.get")
+def bench_style_table(ctx):
+    from pandoc_styles.style_table import StyleTable
+
+    return lambda: StyleTable(ctx.style_file).get(ctx.style_name), None, 1
+
+
+@benchmark("PandocStyles.__init__")
+def bench_init(ctx):
+    return ctx.pandoc_styles, None, 1
+
+
+@benchmark("build_style")
+def bench_build_style(ctx):
+    ps = ctx.pandoc_styles()
+    return ps.build_style, None, 10
+
+
+@benchmark("_get_style")
+def bench_get_style(ctx):
+    ps = ctx.pandoc_styles()
+    style = {"inherits": [ctx.style_name], "all": {"key": "value"}}
+    return ps._get_style, lambda: (deepcopy(style),), 1
+
+
+@benchmark("update_dict")
+def bench_update_dict(ctx):
+    from pandoc_styles.utils import update_dict
+
+    styles = list(ctx.styles.values())
+
+    def run(base):
+        for style in styles:
+            update_dict(base, style)
+
+    return run, lambda: ({},), 1
+
+
+@benchmark("_get_cfg")
+def bench_get_cfg(ctx):
+    ps = ctx.pandoc_styles()
+    return lambda: ps._get_cfg("html"), None, 10
+
+
+@benchmark("_get_pandoc_args")
+def bench_get_pandoc_args(ctx):
+    ps = ctx.pandoc_styles()
+
+    def setup():
+        ps.cfg = ps._get_cfg("html")
+        return ()
+
+    return ps._get_pandoc_args, setup, 1
+
+
+@benchmark("get_pandoc_metadata")
+def bench_get_pandoc_metadata(ctx):
+    ps = ctx.pandoc_styles()
+    path = ctx.front_matter_file
+    return lambda: ps.get_pandoc_metadata(path, [path]), None, 1
+
+
+def _replace_items(ctx):
+    return ctx.styles["Style-0"]["html"]["replace-in-output"] + [
+        {"pattern": "(</head>)", "add": True, "count": 1, "replacement-text": "<x>"}
+    ]
+
+
+@benchmark("replace_in_output.memory")
+def bench_replace_memory(ctx):
+    from pandoc_styles.output_replace import OutputReplacer
+
+    replacer = OutputReplacer(_replace_items(ctx))
+
+    def run():
+        text = ctx.html
+        for replacement in replacer.replacements:
+            text = replacement.sub(text)
+
+    return run, None, 1
+
+
+def _output_file(ctx):
+    path = join(ctx.work, "output.html")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(ctx.html)
+    return path
+
+
+@benchmark("replace_in_output.file")
+def bench_replace_file(ctx):
+    from pandoc_styles.output_replace import OutputReplacer
+
+    items = _replace_items(ctx)
+
+    def run(path):
+        OutputReplacer(items).apply(path)
+
+    return run, lambda: (_output_file(ctx),), 1
+
+
+@benchmark("replace_in_output.stream")
+def bench_replace_stream(ctx):
+    from pandoc_styles import output_replace
+
+    items = _replace_items(ctx)
+
+    def run(path):
+        stream_size = output_replace.STREAM_SIZE
+        output_replace.STREAM_SIZE = 0
+        try:
+            output_replace.OutputReplacer(items).apply(path)
+        finally:
+            output_replace.STREAM_SIZE = stream_size
+
+    return run, lambda: (_output_file(ctx),), 1
+
+
+@benchmark("expand_directories")
+def bench_expand_directories(ctx):
+    from pandoc_styles.utils import expand_directories
+
+    items = []
+    for n in range(250):
+        items.extend(
+            [f"~/filter_{n % 20}.py", f"pack@filter_{n % 20}.py", "plain", "~/no.py"]
+        )
+
+    def run():
+        for item in items:
+            expand_directories(item, "filter")
+
+    return run, None, 1
+
+
+def _run_filter(pandoc_filter, doc):
+    from pandoc_styles import filter_host
+
+    filter_host.hosted_doc = doc
+    try:
+        pandoc_filter.run()
+    finally:
+        filter_host.hosted_doc = None
+
+
+@benchmark("filter.walk")
+def bench_filter_walk(ctx):
+    from pandoc_styles.filter import TransformFilter
+
+    def run(doc):
+        pandoc_filter = TransformFilter(["noindent"], latex=["\\noindent", "text"])
+        _run_filter(pandoc_filter, doc)
+
+    return run, lambda: (data.panflute_doc(ctx.paragraphs),), 1
+
+
+@benchmark("filter.walk_no_match")
+def bench_filter_walk_no_match(ctx):
+    from pandoc_styles.filter import PandocStylesFilter
+
+    def run(doc):
+        _run_filter(PandocStylesFilter(lambda self: "", None, "missing"), doc)
+
+    return run, lambda: (data.panflute_doc(ctx.paragraphs),), 1
+
+
+@benchmark("panflute.walk")
+def bench_panflute_walk(ctx):
+    # the walk itself, to compare the filters with
+    return (
+        lambda doc: doc.walk(lambda elem, doc: None),
+        lambda: (data.panflute_doc(ctx.paragraphs),),
+        1,
+    )
+
+
+def measure(run, setup, number, repeat):
+    """Return the min and median time of one call in seconds"""
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        for _ in range(number):
+            run(*args)
+        times.append((time.perf_counter() - start) / number)
+    return {"min": min(times), "median": statistics.median(times), "repeat": repeat}
+
+
+def run_benchmarks(names, repeat, quick):
+    cwd = os.getcwd()
+    ctx = Context(quick)
+    results = {}
+    try:
+        for name in names:
+            run, setup, number = BENCHMARKS[name](ctx)
+            # warm up caches and imports, like in a real build
+            run(*(setup() if setup else ()))
+            results[name] = measure(run, setup, number, repeat)
+            print(f"{name:<28} {results[name]['median'] * 1000:10.3f} ms", flush=True)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(ctx.home, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the results next to the baseline. Return the names of regressions."""
+    regressions = []
+    print(f"\n{'benchmark':<28} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<28} {'-':>12} {result['median'] * 1000:9.3f} ms")
+            continue
+        ratio = result["median"] / old["median"] if old["median"] else 0
+        mark = ""
+        if ratio > threshold:
+            mark = "  slower"
+            regressions.append(name)
+        print(
+            f"{name:<28} {old['median'] * 1000:9.3f} ms "
+            f"{result['median'] * 1000:9.3f} ms {ratio:6.2f}x{mark}"
+        )
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Microbenchmarks of pandoc_styles")
+    parser.add_argument(
+        "-k",
+        "--select",
+        action="append",
+        metavar="TEXT",
+        help="Run only the benchmarks, whose name contains TEXT.",
+    )
+    parser.add_argument("--repeat", type=int, default=10, metavar="N")
+    parser.add_argument(
+        "--quick", action="store_true", help="Use smaller data and fewer repeats."
+    )
+    parser.add_argument("--save", metavar="FILE", help="Save the results as json.")
+    parser.add_argument(
+        "--compare", metavar="FILE", help="Compare with results saved earlier."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="Ratio to the baseline, from which a benchmark counts as slower.",
+    )
+    args = parser.parse_args()
+
+    names = [
+        name
+        for name in BENCHMARKS
+        if not args.select or any(text in name for text in args.select)
+    ]
+    repeat = min(args.repeat, 3) if args.quick else args.repeat
+    # paths given on the command line are relative to where it was called
+    save = abspath(args.save) if args.save else None
+    baseline_file = abspath(args.compare) if args.compare else None
+
+    results = run_benchmarks(names, repeat, args.quick)
+
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": RESULTS_VERSION,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "quick": args.quick,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nSaved the results to {save}")
+
+    if baseline_file:
+        with open(baseline_file, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("quick") != args.quick:
+            print("The baseline was run with other data (--quick), ratios are off.")
+        if compare(results, baseline["results"], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,4 +10,7 @@ from panflute import (  # pylint: disable=unused-import
     Superscript, Subscript, SmallCaps, Span, RawBlock, RawInline, Math,
     CodeBlock, Link, Image, BulletList, OrderedList, DefinitionList,
     LineBlock, Header, Quoted, Cite, Table, ListContainer, TableCell, Block,
-    convert_text, Element, run_filter)
\ No newline at end of file
+    Element, run_filter)
+# not the convert_text of panflute: this one converts every snippet only once and
+# uses the pandoc server, if one runs. It takes the same arguments.
+from .filter import convert_text
\ No newline at end of file
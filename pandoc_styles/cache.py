@@ -0,0 +1,193 @@
+"""A size bounded, content addressed store for build artifacts"""
+
+import hashlib
+import logging
+import os
+import shutil
+from os.path import isdir, isfile, join
+from tempfile import NamedTemporaryFile
+
+from .constants import (
+    CACHE_ENV,
+    CACHE_SIZE,
+    CFG_CACHE_SIZE,
+    CFG_FILE,
+    CONFIG_DIR,
+    PATH_CACHE,
+)
+from .utils import copy_file, yaml_load
+
+
+def hash_parts(*parts):
+    """Return a hex digest over all parts. Parts can be strings or bytes."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def file_digest(path, *normalize):
+    """
+    Return a hex digest of the content of the file. Strings given in normalize are
+    removed from the content before hashing. Use it for paths that change from run
+    to run, like the temp dir.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    for item in normalize:
+        content = content.replace(item.encode("utf-8"), b"")
+    return hashlib.sha256(content).hexdigest()
+
+
+def cache_size_limit():
+    """Return the maximal size of a cache in MB as set in the config file"""
+    try:
+        config = yaml_load(join(CONFIG_DIR, CFG_FILE)) or {}
+    except FileNotFoundError:
+        return CACHE_SIZE
+    return config.get(CFG_CACHE_SIZE) or CACHE_SIZE
+
+
+def disk_cache(name, max_size=None):
+    """
+    Return the cache with the name, if pandoc-styles runs with --cache (also in
+    its filters and flight scripts), else None.
+    """
+    return FileCache(name, max_size) if os.environ.get(CACHE_ENV) else None
+
+
+class FileCache:
+    """
+    Stores files under a hash key in a subfolder of the cache directory. Every hit
+    marks the entry as recently used, pruning removes the least recently used
+    entries until the cache fits into its size limit.
+    """
+
+    def __init__(self, name, max_size=None):
+        self.name = name
+        self.path = join(CONFIG_DIR, PATH_CACHE, name)
+        self.max_size = max_size
+
+    @classmethod
+    def all(cls):
+        """Return all caches found in the cache directory"""
+        cache_dir = join(CONFIG_DIR, PATH_CACHE)
+        if not isdir(cache_dir):
+            return []
+        return [
+            cls(name)
+            for name in sorted(os.listdir(cache_dir))
+            if isdir(join(cache_dir, name))
+        ]
+
+    def _entry(self, key):
+        return join(self.path, key[:2], key)
+
+    def _touch(self, entry):
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+    def get_file(self, key, target):
+        """
+        Put a copy of the file stored under key at target (a reflink, where the
+        filesystem supports it). Return True on a hit.
+        """
+        entry = self._entry(key)
+        if not isfile(entry):
+            return False
+        if isfile(target):
+            os.remove(target)
+        copy_file(entry, target)
+        self._touch(entry)
+        return True
+
+    def put_file(self, key, source):
+        """Store a copy of the source file under key"""
+        try:
+            os.makedirs(join(self.path, key[:2]), exist_ok=True)
+            # copy to a temporary name first, so that other processes never see
+            # half written entries
+            with NamedTemporaryFile(dir=join(self.path, key[:2]), delete=False) as f:
+                temp_name = f.name
+            copy_file(source, temp_name)
+            os.replace(temp_name, self._entry(key))
+        except OSError as e:
+            logging.debug(f"Could not write to the {self.name} cache: {e}")
+
+    def get(self, key):
+        """Return the text stored under key or None"""
+        entry = self._entry(key)
+        try:
+            with open(entry, encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            return None
+        self._touch(entry)
+        return text
+
+    def put(self, key, text):
+        """Store the text under key. A cache, that can't be written, is skipped."""
+        try:
+            os.makedirs(join(self.path, key[:2]), exist_ok=True)
+            with NamedTemporaryFile(
+                "w", encoding="utf-8", dir=join(self.path, key[:2]), delete=False
+            ) as f:
+                f.write(text)
+            os.replace(f.name, self._entry(key))
+        except OSError as e:
+            logging.debug(f"Could not write to the {self.name} cache: {e}")
+
+    def _entries(self):
+        """Return (last use, size, path) of all entries"""
+        entries = []
+        if not isdir(self.path):
+            return entries
+        for folder, _, files in os.walk(self.path):
+            for name in files:
+                path = join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def stats(self):
+        """Return the number of entries and their size in bytes"""
+        entries = self._entries()
+        return len(entries), sum(size for _, size, _ in entries)
+
+    def prune(self, max_size=None):
+        """
+        Remove the least recently used entries until the cache is smaller than
+        max_size (in MB). Return the number of removed entries.
+        """
+        max_size = max_size if max_size is not None else self.max_size
+        if max_size is None:
+            max_size = cache_size_limit()
+        max_bytes = max_size * 1024 * 1024
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, entry_size, path in entries:
+            if size <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            removed += 1
+        if removed:
+            logging.debug(f"Removed {removed} entries from the {self.name} cache")
+        return removed
+
+    def clear(self):
+        """Remove all entries"""
+        if isdir(self.path):
+            shutil.rmtree(self.path)
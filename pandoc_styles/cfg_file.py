@@ -0,0 +1,114 @@
+"""
+The file, through which the cfg of a format is handed to filters and flight
+scripts. It is a plain json cfg, so filters can read it with any json or yaml
+reader. Its format version and a generation, that grows with every write, are
+kept in a small file next to it (cfg.json.gen):
+
+    {"version": 1, "generation": 3}
+
+A file is only rewritten, if the cfg changed, and a reader parses it only again,
+if its generation changed. yaml files are read and written as plain cfgs.
+
+json has no dates and only strings as keys: a cfg, that went through the file,
+has dates as strings ("2024-01-31") and keys like 1 as "1".
+"""
+
+import json
+import os
+from copy import deepcopy
+
+from .utils import file_read, file_write, has_extension, json_dump, yaml_dump, yaml_load
+
+CFG_FORMAT_VERSION = 1
+GENERATION_SUFFIX = ".gen"
+
+# cfg files read or written by this process by path:
+# (signature of the file, generation, text of the cfg, cfg)
+_files = {}
+
+
+def _signature(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _is_json(path):
+    return has_extension(path, "json")
+
+
+def _header(path):
+    """Return the version and the generation of a json cfg file, or None"""
+    try:
+        header = json.loads(file_read(f"{path}{GENERATION_SUFFIX}"))
+    except (FileNotFoundError, ValueError):
+        return None, None
+    return header.get("version"), header.get("generation")
+
+
+def _parse(path):
+    """Return the generation, the text of the cfg and the cfg in the file"""
+    text = file_read(path)
+    if not _is_json(path):
+        return None, None, yaml_load(text, True)
+    version, generation = _header(path)
+    if version is not None and version > CFG_FORMAT_VERSION:
+        raise ValueError(
+            f"{path} has the cfg format {version}, "
+            f"this version of pandoc_styles reads up to {CFG_FORMAT_VERSION}"
+        )
+    return generation, text, json.loads(text)
+
+
+def _fresh(cached, path):
+    """Return True if the file still holds the cached cfg"""
+    if cached is None or cached[0] != _signature(path):
+        return False
+    # a rewrite within the resolution of the mtime may keep the size, too
+    return cached[1] is None or cached[1] == _header(path)[1]
+
+
+def load_cfg(path):
+    """
+    Return the cfg in the file (json or yaml). The file is parsed only once per
+    process, as long as its generation doesn't change. Every call returns a copy,
+    which can be changed freely.
+    """
+    cached = _files.get(path)
+    if not _fresh(cached, path):
+        signature = _signature(path)
+        cached = _files[path] = (signature, *_parse(path))
+    return deepcopy(cached[3])
+
+
+def cfg_generation(path):
+    """Return the generation of the cfg file, 0 if it wasn't written yet"""
+    return _header(path)[1] or 0
+
+
+def save_cfg(cfg, path):
+    """
+    Write the cfg to the file, unless the file already holds it. Return True if
+    it was written.
+    """
+    if path is None:
+        return False
+    if not _is_json(path):
+        yaml_dump(cfg, path)
+        _files.pop(path, None)
+        return True
+    text = json_dump(cfg)
+    cached = _files.get(path)
+    try:
+        if cached is not None and cached[2] == text and _fresh(cached, path):
+            return False
+    except FileNotFoundError:
+        pass
+    generation = cfg_generation(path) + 1
+    file_write(path, text)
+    # the generation is written last, a reader that sees it sees the new cfg
+    json_dump(
+        {"version": CFG_FORMAT_VERSION, "generation": generation},
+        f"{path}{GENERATION_SUFFIX}",
+    )
+    _files[path] = (_signature(path), generation, text, deepcopy(cfg))
+    return True
@@ -0,0 +1,21 @@
+from .cache import FileCache
+
+
+def cache_tool(args):
+    caches = FileCache.all()
+    if args.name:
+        caches = [cache for cache in caches if cache.name == args.name]
+
+    if args.action == "stats":
+        if not caches:
+            print("The cache is empty.")
+        for cache in caches:
+            entries, size = cache.stats()
+            print(f"{cache.name}: {entries} entries, {size / 1024 / 1024:.1f} MB")
+    elif args.action == "prune":
+        for cache in caches:
+            removed = cache.prune(args.size)
+            print(f"{cache.name}: removed {removed} entries")
+    elif args.action == "clear":
+        for cache in caches:
+            cache.clear()
@@ -46,10 +46,11 @@ def import_style_pack(args):
             copy_tree(path.join(tmpdir, stylepack_name), CONFIG_DIR)
 
             styles = yaml_load(
-                path.join(tmpdir, stylepack_name, f"{stylepack_name}.yaml")
+                path.join(tmpdir, stylepack_name, f"{stylepack_name}.yaml"),
+                round_trip=True,
             )
             del styles[DEFAULT_STYLE]
-            global_styles = yaml_load(STYLE_FILE)
+            global_styles = yaml_load(STYLE_FILE, round_trip=True)
             for k, v in styles.items():
                 global_styles[k] = v
             yaml_dump(global_styles, STYLE_FILE)
@@ -1,5 +1,6 @@
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
 
+from .cl_cache import cache_tool
 from .cl_stylepacks import import_style_pack, remove_style_pack
 from .constants import *  # noqa F403
 
@@ -49,6 +50,26 @@ def main():
     premove.add_argument("packname", help="The stylepack to remove")
     premove.set_defaults(func=remove_style_pack)
 
+    # Cache
+    # ----------------------------------------------------------------------------------
+    pcache = subparsers.add_parser(
+        "cache",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+        help="Show statistics of the caches, prune or clear them",
+    )
+    pcache.add_argument("action", choices=["stats", "prune", "clear"])
+    pcache.add_argument(
+        "--name", "-n", default=None, help="Only use the cache with this name."
+    )
+    pcache.add_argument(
+        "--size",
+        "-s",
+        type=int,
+        default=None,
+        help="Prune to this size in MB. Defaults to cache-size in the config file.",
+    )
+    pcache.set_defaults(func=cache_tool)
+
     # Run tool
     # ----------------------------------------------------------------------------------
     args = parser.parse_args()
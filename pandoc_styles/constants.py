@@ -9,6 +9,7 @@ FMT = "fmt"
 TO_FMT = "to_fmt"
 OUTPUT_FILE = "output_file"
 CFG_TEMP_FILE = "cfg.yaml"
+CFG_FILTER_FILE = "cfg.json"
 ALL_STYLE = "All"
 DEFAULT_STYLE = "Default"
 USER_DIR_PREFIX = "~/"
@@ -18,6 +19,20 @@ PATH_SASS = "sass"
 PATH_CSS = "css"
 PATH_STYLE = "styles"
 MODIFIED_FILES = "modified_files"
+PATH_CACHE = "cache"
+BUILD_CACHE = "build"
+STYLE_CACHE = "styles"
+SASS_CACHE = "sass"
+PANDOC_CACHE = "pandoc"
+TEMPLATE_CACHE = "templates"
+SNIPPET_CACHE = "snippets"
+SNIPPET_CACHE_SIZE = 64
+SERVER_ENV = "PANDOC_STYLES_SERVER"
+CACHE_ENV = "PANDOC_STYLES_CACHE"
+FILTER_STATS_ENV = "PANDOC_STYLES_FILTER_STATS"
+FILTER_STATS_DIR = "filter_stats"
+PROFILE_FILE = "pandoc_styles_profile.json"
+CACHE_SIZE = 1024
 
 # Metadata fields constants
 MD_VERBATIM_VARIABLES = "verbatim-variables"
@@ -38,7 +53,9 @@ MD_TEMP_DIR = "temp-dir"
 MD_CFG_DIR = "config-dir"
 MD_PANDOC_STYLES_MD = "pandoc_styles_"
 MD_PREFLIGHT = "preflight"
+MD_PREFLIGHT_SHARED = "preflight-shared"
 MD_POSTFLIGHT = "postflight"
+MD_FLIGHT_SUBPROCESS = "flight-subprocess"
 MD_SASS = "sass"
 MD_SASS_OUTPUT_PATH = "output-path"
 MD_SASS_NAME = "stylesheet-name"
@@ -57,6 +74,7 @@ MD_REPL_IN_OUTPUT = "replace-in-output"
 # Configuartion constants
 CFG_FILE = "config.yaml"
 CFG_PANDOC_PATH = "pandoc-path"
+CFG_CACHE_SIZE = "cache-size"
 
 # Some formats:
 ALL_FMTS = "all"
@@ -73,3 +91,6 @@ FIL_CHECK = "check"
 
 # Latex formats
 LATEX_FORMATS = [LATEX, PDF, "beamer"]
+
+# cfg of a format, that names the format or its output and so differs between formats
+PREFLIGHT_FORMAT_KEYS = [FMT, TO_FMT, OUTPUT_FILE, MD_TEMP_DIR]
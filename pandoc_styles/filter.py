@@ -1,15 +1,26 @@
+import io
+import json
+import logging
+import time
+from os.path import dirname
+
 import panflute as pf
 from panflute import (  # pylint: disable=unused-import
+    Block,
     Div,
+    Doc,
     Element,
     ListContainer,
     Plain,
     RawBlock,
     RawInline,
-    convert_text,
     run_filter,
 )
+from panflute.elements import from_json
+from panflute.io import dump
 
+from . import filter_host, filter_stats, pandoc_server
+from .cfg_file import load_cfg, save_cfg
 from .constants import (
     EPUB,
     FIL_ALL,
@@ -20,8 +31,30 @@ from .constants import (
     LATEX_FORMATS,
     MD_PANDOC_STYLES_MD,
 )
+from .snippet_cache import SnippetCache
+from .snippets import TEXT_FORMATS, SnippetBatch
 from .utils import make_list, yaml_dump, yaml_load
 
+__all__ = [
+    "PandocStylesFilter",
+    "TransformFilter",
+    "convert_text",
+    "is_pandoc_element",
+    "raw",
+    "run_pandoc_styles_filter",
+    "run_transform_filter",
+    "stringify",
+    "strip_html_tag",
+    "yaml_dump",
+    "yaml_load",
+]
+
+RAW_FORMATS = ["tex", "latex", "html", "context"]
+
+# api version of the pandoc behind the server, asked for only once
+_api_version = None
+snippet_cache = SnippetCache()
+
 
 class PandocStylesFilter:
     """
@@ -29,22 +62,88 @@ class PandocStylesFilter:
     run them.
     """
 
-    def __init__(self, func, filter_types=None, tags=None):
+    # convert the snippets of all elements together at the end of the run
+    batch_conversions = False
+    # the state of a run, set here as well for subclasses, that don't call __init__
+    _text = None
+    _dispatch_doc = None
+    snippets = None
+    stats = None
+
+    def __init__(self, func, filter_types=None, tags=None, batch_conversions=None):
         self._add_method(func, "func")
         self.filter_types = make_list(filter_types or [])
         self.tags = make_list(tags or [])
+        if batch_conversions is not None:
+            self.batch_conversions = batch_conversions
         self._text = None
 
     def run(self):
-        run_filter(self._pandoc_filter)
+        hooks = {"prepare": self._prepare, "finalize": self._finalize}
+        if filter_host.hosted_doc is None:
+            run_filter(self._pandoc_filter, **hooks)
+        else:
+            filter_host.hosted_doc = run_filter(
+                self._pandoc_filter, doc=filter_host.hosted_doc, **hooks
+            )
+
+    def _prepare(self, doc):
+        if filter_stats.enabled():
+            self.stats = filter_stats.current = filter_stats.FilterStats(doc.format)
+        if self.batch_conversions:
+            self.snippets = SnippetBatch(convert_text, doc.api_version, snippet_cache)
+
+    def _finalize(self, doc):
+        if self.snippets is not None:
+            self.snippets.patch(doc)
+            self.snippets = None
+        if self.stats is not None:
+            self.stats.stop()
+            cfg_file = doc.get_metadata(MD_PANDOC_STYLES_MD)
+            if cfg_file:
+                self.stats.write(dirname(cfg_file))
+            self.stats = filter_stats.current = None
 
     def _pandoc_filter(self, elem, doc):
+        if doc is not self._dispatch_doc:
+            self._prepare_dispatch(doc)
+        if self.stats is not None:
+            self.stats.visited += 1
+        if not self._accepts(elem):
+            return
         self._init_filter(elem, doc)
-        if not self.check():
+        if not self._default_check and not self.check():
             return
+        if self.stats is not None:
+            self.stats.matched += 1
         self.new_text = self.func()  # pylint: disable=assignment-from-none
         return self._return_filter()
 
+    def _prepare_dispatch(self, doc):
+        """
+        Work out everything, that is the same for all elements of the document, so
+        most elements are rejected by _accepts before any state is built.
+        """
+        self._dispatch_doc = doc
+        self.doc = doc
+        self._get_format()
+        self._types = tuple(getattr(self, "filter_types", None) or ())
+        self._tags = set(getattr(self, "tags", None) or ())
+        self._default_check = (
+            "check" not in self.__dict__
+            and type(self).check is PandocStylesFilter.check
+        )
+
+    def _accepts(self, elem):
+        """The default check for any element. Accepts all with a custom check."""
+        if not self._default_check:
+            return True
+        if self._types and not isinstance(elem, self._types):
+            return False
+        return not self._tags or not self._tags.isdisjoint(
+            getattr(elem, "classes", None) or ()
+        )
+
     @property
     def text(self):
         if self._text:
@@ -59,12 +158,13 @@ class PandocStylesFilter:
         self.elem = elem
         self.doc = doc
         self.cfg = dict()
-        self._get_format()
-        self.classes = elem.classes if hasattr(elem, "classes") else None
-        self.attributes = elem.attributes if hasattr(elem, "attributes") else None
-        self.identifier = elem.identifier if hasattr(elem, "identifier") else None
-        self._text = elem.text if hasattr(elem, "text") else None
-        self.content = elem.content if hasattr(elem, "content") else None
+        if doc is not self._dispatch_doc:
+            self._prepare_dispatch(doc)
+        self.classes = getattr(elem, "classes", None)
+        self.attributes = getattr(elem, "attributes", None)
+        self.identifier = getattr(elem, "identifier", None)
+        self._text = getattr(elem, "text", None)
+        self.content = getattr(elem, "content", None)
 
     def _return_filter(self):
         if self.new_text is None:
@@ -75,7 +175,7 @@ class PandocStylesFilter:
             new = []
             for x in self.new_text:  # pylint: disable=not-an-iterable
                 if isinstance(x, str):
-                    x = convert_text(x)
+                    x = self._elements(x)
                 if isinstance(x, ListContainer):
                     new.extend(x)
                 elif isinstance(x, list):
@@ -83,7 +183,28 @@ class PandocStylesFilter:
                 else:
                     new.append(x)
             return new
-        return convert_text(self.new_text)
+        return self._elements(self.new_text)
+
+    def _can_defer(self):
+        """
+        Check if conversions for this element can wait for the end of the run. Not
+        if the filter may still look at the result, because the element is inside
+        another element the filter works on.
+        """
+        if self.snippets is None:
+            return False
+        parent = self.elem.parent
+        while parent is not None and not isinstance(parent, Doc):
+            if self._accepts(parent):
+                return False
+            parent = parent.parent
+        return True
+
+    def _elements(self, text):
+        """Convert markdown to elements, at the end of the run if possible"""
+        if self._can_defer():
+            return self.snippets.elements(text)
+        return convert_text(text)
 
     def _get_format(self):
         self.fmt = self.doc.format
@@ -116,14 +237,14 @@ class PandocStylesFilter:
     def get_pandoc_styles_metadata(self):
         """Return the pandoc_styles cfg as a dictionary"""
         try:
-            self.cfg = yaml_load(self.get_metadata(MD_PANDOC_STYLES_MD))
+            self.cfg = load_cfg(self.get_metadata(MD_PANDOC_STYLES_MD))
         except FileNotFoundError:
             self.cfg = {}
         return self.cfg
 
     def save_pandoc_styles_metadata(self):
-        """Save the given cfg in the cfg-file"""
-        yaml_dump(self.cfg, self.get_metadata(MD_PANDOC_STYLES_MD))
+        """Save the given cfg in the cfg-file, if it was changed"""
+        save_cfg(self.cfg, self.get_metadata(MD_PANDOC_STYLES_MD))
 
     def stringify(self, elem=None):
         """Stringify an element"""
@@ -167,18 +288,23 @@ class PandocStylesFilter:
         return convert_text(elem, "panflute", output_fmt, False, extra_args)
 
 
-def run_pandoc_styles_filter(func, filter_types=None, tags=None):
+def run_pandoc_styles_filter(
+    func, filter_types=None, tags=None, batch_conversions=None
+):
     """
     Run a filter with the given func. The function is now a method to a filter object
     and you can access its contents through self.
 
+    batch_conversions: Convert the markdown the filter returns for all elements
+    in as few pandoc calls as possible at the end of the run.
+
     Your filter can return:
     > None:   do nothing
     > string: convert the string from markdown to panflute elements
     > list:   The list can contain Panflute Elements or strings. Strings are converted
               like above.
     """
-    PandocStylesFilter(func, filter_types, tags).run()
+    PandocStylesFilter(func, filter_types, tags, batch_conversions).run()
 
 
 class TransformFilter(PandocStylesFilter):
@@ -195,6 +321,7 @@ class TransformFilter(PandocStylesFilter):
         other=None,
         filter_types=None,
         check=None,
+        batch_conversions=None,
         **kwargs,
     ):
         self.tags = make_list(tags or [])
@@ -204,21 +331,43 @@ class TransformFilter(PandocStylesFilter):
         self._add_method(other, FIL_OTHER)
         self._add_method(check, FIL_CHECK)
         self.funcs = kwargs
+        self._text = None
+        if check is not None:
+            # a custom check may look at anything, even at converted results
+            self.batch_conversions = False
+        elif batch_conversions is not None:
+            self.batch_conversions = batch_conversions
 
     def _pandoc_filter(self, elem, doc):
+        if doc is not self._dispatch_doc:
+            self._prepare_dispatch(doc)
+        if self.stats is not None:
+            self.stats.visited += 1
+        if not self._accepts(elem):
+            return
         self._init_filter(elem, doc)
-        if not self.check():
+        if not self._default_check and not self.check():
             return
-        for key, func in self.funcs.items():
-            self._add_method(func, key)
+        if self.stats is not None:
+            self.stats.matched += 1
 
         self.all_formats()
         self._call_filter()
         return self._return_filter()
 
+    def _prepare_dispatch(self, doc):
+        super()._prepare_dispatch(doc)
+        for key, func in self.funcs.items():
+            self._add_method(func, key)
+        self._format_method = getattr(self, self.fmt, None)
+
     def _call_filter(self):
+        if self._format_method is None:
+            # pylint: disable=assignment-from-none
+            self.new_text = self.other()
+            return
         try:
-            self.new_text = getattr(self, self.fmt)()
+            self.new_text = self._format_method()
         except AttributeError:
             # pylint: disable=assignment-from-none
             self.new_text = self.other()
@@ -232,7 +381,7 @@ class TransformFilter(PandocStylesFilter):
             new = []
             for x in self.new_text:
                 if isinstance(x, str):
-                    x = raw(self.fmt, x)
+                    x = self._raw(x)
                 if isinstance(x, ListContainer):
                     new.extend(x)
                 elif isinstance(x, list):
@@ -240,7 +389,13 @@ class TransformFilter(PandocStylesFilter):
                 else:
                     new.append(x)
             return new
-        return self.raw_block(self.new_text)
+        return self._raw(self.new_text)
+
+    def _raw(self, text):
+        """raw_block, that converts at the end of the run if possible"""
+        if self.fmt in RAW_FORMATS:
+            return RawBlock(text, self.fmt)
+        return self._elements(text)
 
     def all_formats(self):
         return
@@ -251,7 +406,7 @@ class TransformFilter(PandocStylesFilter):
     def _add_method(self, var, name):
         if var is not None:
             if isinstance(var, str):
-                setattr(self, name, lambda: var.format(text=self.convert_to_fmt()))
+                setattr(self, name, lambda: var.format(text=self._text_in_fmt()))
             elif isinstance(var, list):
                 setattr(
                     self,
@@ -270,6 +425,19 @@ class TransformFilter(PandocStylesFilter):
         text = text or self.text
         return convert_text(text, input_fmt, self.fmt, False, extra_args)
 
+    def _text_in_fmt(self):
+        """convert_to_fmt for string templates, at the end of the run if possible"""
+        if self.fmt not in TEXT_FORMATS or not self._can_defer():
+            return self.convert_to_fmt()
+        text = self._text
+        if not text:
+            if not isinstance(self.content, ListContainer) or not all(
+                isinstance(x, Block) for x in self.content
+            ):
+                return self.convert_to_fmt()
+            text = self.snippets.content_text(self.content, self.fmt)
+        return self.snippets.text(text, self.fmt)
+
     def get_text(self, elem=None, output_fmt=None, extra_args=None):
         """
         Converts the content of the given Element to the format. Use instead
@@ -284,7 +452,13 @@ class TransformFilter(PandocStylesFilter):
 
 
 def run_transform_filter(
-    tags=None, all_formats=None, other=None, filter_types=None, check=None, **kwargs
+    tags=None,
+    all_formats=None,
+    other=None,
+    filter_types=None,
+    check=None,
+    batch_conversions=None,
+    **kwargs,
 ):
     """
     Creates and runs a pandoc filter.
@@ -316,6 +490,9 @@ def run_transform_filter(
 
     check: Replace the default check method with your own.
 
+    batch_conversions: Convert the {text} and the output of all elements in as few
+    pandoc calls as possible at the end of the run. Not used with a custom check.
+
     Your filter can return:
     > None:   do nothing
     > string: convert the string to a rawblock in the current format or
@@ -324,11 +501,80 @@ def run_transform_filter(
               like above.
     """
     pandoc_filter = TransformFilter(
-        tags, all_formats, other, filter_types, check, **kwargs
+        tags, all_formats, other, filter_types, check, batch_conversions, **kwargs
     )
     pandoc_filter.run()
 
 
+def convert_text(
+    text,
+    input_format="markdown",
+    output_format="panflute",
+    standalone=False,
+    extra_args=None,
+    pandoc_path=None,
+):
+    """
+    Like panflutes convert_text, but every snippet is converted only once (see
+    SnippetCache) and the conversion is done by the pandoc server, if one was
+    started with --server. Falls back to running pandoc.
+    """
+    start = time.perf_counter()
+    key = snippet_cache.key(
+        text, input_format, output_format, standalone, extra_args, pandoc_path
+    )
+    result = snippet_cache.get(key, output_format, extra_args)
+    cached = result is not None
+    if not cached:
+        result = _convert_text(
+            text, input_format, output_format, standalone, extra_args, pandoc_path
+        )
+        snippet_cache.put(key, result, extra_args)
+    if filter_stats.current is not None:
+        filter_stats.current.add_conversion(time.perf_counter() - start, cached)
+    return result
+
+
+def _convert_text(
+    text, input_format, output_format, standalone, extra_args, pandoc_path
+):
+    if pandoc_server.server_url() and not extra_args and pandoc_path is None:
+        try:
+            return _server_convert_text(text, input_format, output_format, standalone)
+        except pandoc_server.ServerError as e:
+            logging.debug(f"{e}, running pandoc instead")
+    return pf.convert_text(
+        text, input_format, output_format, standalone, extra_args, pandoc_path
+    )
+
+
+def _server_convert_text(text, input_format, output_format, standalone):
+    """convert_text of panflute with the pandoc call replaced by a server request"""
+    global _api_version
+    if input_format == "panflute":
+        if not isinstance(text, Doc):
+            if _api_version is None:
+                _api_version = _server_convert_text("", "markdown", "panflute", True)
+                _api_version = _api_version.api_version
+            if isinstance(text, Element):
+                text = [text]
+            text = Doc(*text, api_version=_api_version)
+        with io.StringIO() as f:
+            dump(text, f)
+            text = f.getvalue()
+
+    in_fmt = "json" if input_format == "panflute" else input_format
+    out_fmt = "json" if output_format == "panflute" else output_format
+    out = pandoc_server.convert(text, in_fmt, out_fmt, standalone)
+    out = "\n".join(out.splitlines())
+
+    if output_format == "panflute":
+        out = json.loads(out, object_hook=from_json)
+        if not standalone:
+            out = out.content.list
+    return out
+
+
 def is_pandoc_element(ele):
     if isinstance(ele, Element):
         return True
@@ -339,7 +585,7 @@ def is_pandoc_element(ele):
 
 def raw(fmt, text, element_type=RawBlock):
     """Return a Raw pandoc element in the given format."""
-    if fmt not in ["tex", "latex", "html", "context"]:
+    if fmt not in RAW_FORMATS:
         return convert_text(text)
     return element_type(text, fmt)
 
@@ -0,0 +1,59 @@
+"""Run several pandoc_styles filters in one process on one document"""
+
+import runpy
+import sys
+from functools import lru_cache
+from os.path import abspath, dirname
+
+import panflute as pf
+
+# the document the hosted filters work on, None if a filter runs on its own
+hosted_doc = None
+
+WRAPPER = """\
+# Runs several filters of pandoc_styles in one process. Generated for one build.
+from pandoc_styles.filter_host import main
+
+main({scripts!r})
+"""
+
+
+@lru_cache(maxsize=None)
+def is_hostable(script):
+    """
+    Check if the script is a filter of pandoc_styles (a run_transform_filter or
+    run_pandoc_styles_filter filter), which can be run by the host.
+    """
+    try:
+        with open(script, encoding="utf-8") as f:
+            source = f.read()
+    except (OSError, UnicodeDecodeError):
+        return False
+    return "run_transform_filter" in source or "run_pandoc_styles_filter" in source
+
+
+def write_wrapper(path, scripts):
+    """Write a filter script, that runs the given scripts in the host"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(WRAPPER.format(scripts=list(scripts)))
+    return path
+
+
+def main(scripts, input_stream=None, output_stream=None):
+    """
+    Read the document once, run every script as __main__ on it and write the
+    result once. The filters find the document in hosted_doc.
+    """
+    global hosted_doc
+    hosted_doc = pf.load(input_stream)
+    try:
+        for script in scripts:
+            # like python script.py, make modules next to the script importable
+            sys.path.insert(0, dirname(abspath(script)))
+            try:
+                runpy.run_path(script, run_name="__main__")
+            finally:
+                sys.path.pop(0)
+        pf.dump(hosted_doc, output_stream)
+    finally:
+        hosted_doc = None
@@ -0,0 +1,109 @@
+"""Measure what the filters of a build cost"""
+
+import json
+import logging
+import os
+import sys
+import time
+from glob import glob
+from os.path import basename, isdir, join
+
+from .constants import FILTER_STATS_DIR, FILTER_STATS_ENV
+from .profiler import peak_rss, text_table
+
+# the stats of the filter running in this process, None if not measured
+current = None
+
+
+def enabled():
+    return bool(os.environ.get(FILTER_STATS_ENV))
+
+
+def filter_name():
+    """Return the name of the running filter script"""
+    # filters run by the filter host are __main__ while they run
+    path = getattr(sys.modules.get("__main__"), "__file__", None) or sys.argv[0]
+    return basename(path)
+
+
+class FilterStats:
+    """Time, visited and matched elements and conversions of one filter run"""
+
+    def __init__(self, fmt):
+        self.filter = filter_name()
+        self.format = fmt
+        self.visited = 0
+        self.matched = 0
+        self.conversions = 0
+        self.conversion_time = 0.0
+        self.cached_conversions = 0
+        self.time = 0.0
+        self._start = time.perf_counter()
+
+    def add_conversion(self, seconds, cached=False):
+        if cached:
+            self.cached_conversions += 1
+        else:
+            self.conversions += 1
+            self.conversion_time += seconds
+
+    def stop(self):
+        self.time = time.perf_counter() - self._start
+
+    def as_dict(self):
+        return {
+            "filter": self.filter,
+            "format": self.format,
+            "time": round(self.time, 6),
+            "visited": self.visited,
+            "matched": self.matched,
+            "conversions": self.conversions,
+            "conversion_time": round(self.conversion_time, 6),
+            "cached_conversions": self.cached_conversions,
+            "peak_rss_kb": peak_rss(),
+        }
+
+    def write(self, temp_dir):
+        """Write the stats as a json report into the stats folder of the temp dir"""
+        folder = join(temp_dir, FILTER_STATS_DIR)
+        os.makedirs(folder, exist_ok=True)
+        name = f"{time.time_ns()}-{os.getpid()}.json"
+        with open(join(folder, name), "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(), f)
+
+
+def collect_reports(temp_dir):
+    """Return all reports in the temp dir in the order the filters ran and remove
+    them, so that every report is only collected once."""
+    folder = join(temp_dir, FILTER_STATS_DIR)
+    if not isdir(folder):
+        return []
+    reports = []
+    for path in sorted(glob(join(folder, "*.json"))):
+        try:
+            with open(path, encoding="utf-8") as f:
+                reports.append(json.load(f))
+            os.remove(path)
+        except (OSError, ValueError) as e:
+            logging.debug(f"Could not read the filter report {path}: {e}")
+    return reports
+
+
+def report_table(reports):
+    """Return a table of the reports"""
+    header = ["filter", "time", "visited", "matched", "conv", "conv time", "rss MB"]
+    rows = []
+    for report in reports:
+        rss = report.get("peak_rss_kb")
+        rows.append(
+            [
+                report["filter"],
+                f"{report['time']:.3f}s",
+                str(report["visited"]),
+                str(report["matched"]),
+                f"{report['conversions']} (+{report['cached_conversions']} cached)",
+                f"{report['conversion_time']:.3f}s",
+                "-" if rss is None else f"{rss / 1024:.1f}",
+            ]
+        )
+    return text_table(header, rows)
@@ -1,31 +1,49 @@
+import ast
+import importlib.util
+import logging
+import sys
+import threading
 from argparse import ArgumentParser
-from os.path import join
+from copy import deepcopy
+from os import stat
+from os.path import dirname
 
+from .cfg_file import load_cfg, save_cfg
 from .constants import (
-    CFG_TEMP_FILE,
     EPUB,
     FMT,
     HTML,
     LATEX,
     LATEX_FORMATS,
     MD_CURRENT_FILES,
-    MD_TEMP_DIR,
     OUTPUT_FILE,
 )
-from .utils import yaml_dump, yaml_load
+from .utils import file_read
+
+# imported flight scripts by path: (mtime, size, module)
+_modules = {}
+_modules_lock = threading.Lock()
+RUN_FUNCTIONS = {"run_preflight_script", "run_postflight_script"}
 
 
 class FlightScript:
-    def __init__(self, func, flight_type):
+    def __init__(self, func, flight_type, cfg=None):
         setattr(self, "fligh_script", func.__get__(self))
+        # the cfg saved by an in-process script, None if it didn't save
+        self.saved_cfg = None
+        self.in_process = cfg is not None
+        self.cfg_file = None
 
-        parser = ArgumentParser(description="")
-        parser.add_argument(
-            "--cfg", nargs="?", default="", help="The cfg from pandoc_styles"
-        )
-        args = parser.parse_args()
+        if cfg is None:
+            parser = ArgumentParser(description="")
+            parser.add_argument(
+                "--cfg", nargs="?", default="", help="The cfg from pandoc_styles"
+            )
+            args = parser.parse_args()
+            self.cfg_file = args.cfg
+            cfg = load_cfg(args.cfg)
 
-        self.cfg = yaml_load(args.cfg)
+        self.cfg = cfg
         self.fmt = self.cfg[FMT]
         self.real_fmt = self.fmt
         if self.fmt in LATEX_FORMATS:
@@ -42,7 +60,106 @@ class FlightScript:
         pass
 
     def save_cfg(self):
-        yaml_dump(self.cfg, join(self.cfg.get(MD_TEMP_DIR), CFG_TEMP_FILE))
+        if self.in_process:
+            self.saved_cfg = deepcopy(self.cfg)
+            return
+        save_cfg(self.cfg, self.cfg_file)
+
+
+def _is_main_guard(node):
+    """Check for if __name__ == "__main__":"""
+    test = node.test if isinstance(node, ast.If) else None
+    return (
+        isinstance(test, ast.Compare)
+        and isinstance(test.left, ast.Name)
+        and test.left.id == "__name__"
+        and len(test.comparators) == 1
+        and isinstance(test.comparators[0], ast.Constant)
+        and test.comparators[0].value == "__main__"
+    )
+
+
+def _can_import(path, flight_type):
+    """
+    Check the source of a flight script: it must define the flight function and
+    start itself (run_preflight_script, ...) only behind if __name__ ==
+    "__main__", so that importing it runs nothing.
+    """
+    try:
+        tree = ast.parse(file_read(path), path)
+    except (SyntaxError, UnicodeDecodeError, ValueError):
+        return False
+    defined = False
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == flight_type:
+            defined = True
+        if isinstance(node, ast.FunctionDef) or _is_main_guard(node):
+            continue
+        for child in ast.walk(node):
+            name = getattr(child, "id", None) or getattr(child, "attr", None)
+            if name in RUN_FUNCTIONS:
+                return False
+    return defined
+
+
+def _import_script(path):
+    """
+    Import a flight script once, again only if the file changed. Return None if
+    it exits while it is imported.
+    """
+    st = stat(path)
+    with _modules_lock:
+        cached = _modules.get(path)
+        if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+        spec = importlib.util.spec_from_file_location(
+            f"pandoc_styles_flight_{len(_modules)}", path
+        )
+        module = importlib.util.module_from_spec(spec)
+        # like a started script, it can import the modules next to it, and it
+        # doesn't see the command line of pandoc_styles
+        sys.path.insert(0, dirname(path))
+        argv = sys.argv
+        sys.argv = [path]
+        try:
+            spec.loader.exec_module(module)
+        except SystemExit:
+            module = None
+        finally:
+            sys.argv = argv
+            sys.path.remove(dirname(path))
+        _modules[path] = (st.st_mtime_ns, st.st_size, module)
+        return module
+
+
+def flight_function(path, flight_type):
+    """
+    Return the preflight/postflight function of a flight script, or None if the
+    script has none and has to be run as a process.
+    """
+    if not _can_import(path, flight_type):
+        return None
+    func = getattr(_import_script(path), flight_type, None)
+    return func if callable(func) else None
+
+
+def run_flight_function(func, flight_type, cfg):
+    """
+    Run a flight function in this process with a copy of cfg. Return the cfg the
+    script saved with save_cfg, or None if it saved nothing.
+    """
+    script = FlightScript(func, flight_type, deepcopy(cfg))
+    try:
+        script.fligh_script()
+    except SystemExit as e:
+        # like the exit code of the script run as a process
+        if e.code:
+            logging.error(f"{flight_type} {func.__module__} failed!")
+            raise RuntimeError(f"{flight_type} exited with {e.code}") from e
+    except Exception:
+        logging.error(f"{flight_type} {func.__module__} failed!")
+        raise
+    return script.saved_cfg
 
 
 def run_preflight_script(func):
@@ -0,0 +1,139 @@
+"""Configurations made of layers, that are only merged when needed"""
+
+from collections.abc import Mapping
+
+
+def merge_into(dictionary, new, owned=None):
+    """
+    Merge new into dictionary. Single keys are replaced, but nested dictionaries
+    are merged and lists are appended without duplicates.
+
+    Values of new are not copied. Containers in dictionary, whose id is not in
+    owned, are shared with other configurations and are copied before they are
+    changed. If owned is None, dictionary and everything in it may be changed.
+    """
+    for key, value in new.items():
+        current = dictionary.get(key)
+        if not current:
+            dictionary[key] = value
+        elif isinstance(value, dict) and isinstance(current, dict):
+            current = _own(dictionary, key, current, owned)
+            merge_into(current, value, owned)
+        elif isinstance(value, list) and isinstance(current, list):
+            current = _own(dictionary, key, current, owned)
+            seen = _seen(current, owned)
+            for item in value:
+                item_key = hash_key(item)
+                if item_key not in seen:
+                    seen.add(item_key)
+                    current.append(item)
+        else:
+            dictionary[key] = value
+
+
+def _own(dictionary, key, current, owned):
+    """Copy a shared container before it is changed"""
+    if owned is None or id(current) in owned:
+        return current
+    current = list(current) if isinstance(current, list) else dict(current)
+    owned[id(current)] = None
+    dictionary[key] = current
+    return current
+
+
+def _seen(items, owned):
+    """Return the set of hash keys of the items in an owned list"""
+    if owned is not None and owned.get(id(items)) is not None:
+        return owned[id(items)]
+    seen = {hash_key(item) for item in items}
+    if owned is not None:
+        owned[id(items)] = seen
+    return seen
+
+
+def hash_key(item):
+    """
+    Return a hashable stand-in for item, that is equal for equal items, so that
+    lists of dictionaries can be deduplicated with a set.
+    """
+    try:
+        hash(item)
+        return item
+    except TypeError:
+        pass
+    if isinstance(item, dict):
+        return (dict, frozenset((k, hash_key(v)) for k, v in item.items()))
+    if isinstance(item, (list, tuple)):
+        return (list, tuple(hash_key(x) for x in item))
+    return (type(item), repr(item))
+
+
+def _detach(value, owned):
+    """Copy everything in value that is still shared with the layers"""
+    if isinstance(value, dict):
+        if id(value) not in owned:
+            return {k: _detach(v, owned) for k, v in value.items()}
+        for k, v in value.items():
+            value[k] = _detach(v, owned)
+    elif isinstance(value, list):
+        if id(value) not in owned:
+            return [_detach(v, owned) for v in value]
+        value[:] = [_detach(v, owned) for v in value]
+    return value
+
+
+class LayeredConfig(Mapping):
+    """
+    A stack of configuration layers, similar to a ChainMap, but with the merge
+    semantics of update_dict: later layers replace scalars, merge dictionaries
+    and append to lists. The layers are neither copied nor changed; merging
+    happens in materialize, or for a single key on access.
+    """
+
+    def __init__(self, *layers):
+        self.layers = []
+        for layer in layers:
+            self.push(layer)
+
+    def push(self, layer):
+        """Add a layer on top. Empty layers are ignored."""
+        if isinstance(layer, LayeredConfig):
+            self.layers.extend(layer.layers)
+        elif layer:
+            self.layers.append(layer)
+        return self
+
+    def section(self, *keys):
+        """
+        Return the layers of the given keys as a new LayeredConfig. All layers of
+        the first key come before those of the second and so on.
+        """
+        return LayeredConfig(*(layer.get(key) for key in keys for layer in self.layers))
+
+    def materialize(self):
+        """Merge all layers into a new, independent dictionary"""
+        result = {}
+        owned = {}
+        for layer in self.layers:
+            merge_into(result, layer, owned)
+        owned[id(result)] = None
+        return _detach(result, owned)
+
+    def __getitem__(self, key):
+        values = [layer[key] for layer in self.layers if key in layer]
+        if not values:
+            raise KeyError(key)
+        merged = LayeredConfig(*({key: value} for value in values)).materialize()
+        return merged[key]
+
+    def __contains__(self, key):
+        return any(key in layer for layer in self.layers)
+
+    def __iter__(self):
+        return iter(dict.fromkeys(key for layer in self.layers for key in layer))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"LayeredConfig({', '.join(repr(layer) for layer in self.layers)})"
@@ -1,23 +1,47 @@
 # ruff: noqa: F405
 
 import importlib.resources
+import json
 import logging
 import re
+import shlex
 import sys
+import threading
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from copy import copy as copy_object
 from copy import deepcopy
-from os import getcwd, listdir, mkdir, remove
+from functools import partial
+from os import environ, getcwd, listdir, makedirs, mkdir, remove, stat
 from os.path import dirname, isdir, isfile, join, normpath, relpath
-from shutil import copy, copytree
+from shutil import copytree
 from tempfile import TemporaryDirectory
 
-import sass
-
+from .cache import FileCache, file_digest, hash_parts
+from .cfg_file import load_cfg, save_cfg
 from .constants import *  # noqa: F403
+from .filter_host import is_hostable, write_wrapper
+from .filter_stats import collect_reports, report_table
+from .flight_scripts import flight_function, run_flight_function
 from .format_mappings import FORMAT_TO_EXTENSION
-from .pandoc_cmd_line_options import COMMAND_LINE_OPTIONS
+from .layered_config import LayeredConfig
+from .output_replace import OutputReplacer
+from .pandoc_cmd_line_options import (
+    COMMAND_LINE_OPTIONS,
+    GENERAL_OPTIONS,
+    READER_OPTIONS,
+    SOURCE_OPTIONS,
+)
+from .pandoc_data import default_data_file, default_template, pandoc_version
+from .pandoc_server import PandocServer, convert_document
+from .profiler import Profile
+from .sass_compiler import compile_sass
+from .style_table import StyleTable
+from .template_engine import HEADER_INCLUDES, TemplateEngine
 from .utils import (
     change_dir,
+    copy_file,
     expand_directories,
     file_read,
     file_write,
@@ -27,10 +51,12 @@ from .utils import (
     has_extension,
     make_list,
     run_process,
+    update_dict,
     yaml_dump,
     yaml_dump_pandoc_md,
     yaml_load,
 )
+from .watch import BuildCancelled, Watcher
 
 
 class PandocStyles:
@@ -50,10 +76,16 @@ class PandocStyles:
         style_file=None,
         quiet=False,
         to_file_type=None,
+        jobs=1,
+        use_cache=False,
+        filter_host=False,
+        shared_ast=False,
+        profile=None,
     ):
         self.actual_temp_dir = TemporaryDirectory()
         self.temp_dir = self.actual_temp_dir.name
         self.metadata = metadata
+        self.source_files = list(files)
         self.pandoc_metadata, files = self.get_pandoc_metadata(
             metadata or files[0], files
         )
@@ -76,7 +108,8 @@ class PandocStyles:
         )
         self.used_stylepacks = []
         self.use_styles.extend(add_styles or [])
-        self.styles = yaml_load(style_file)
+        self.style_file = style_file
+        self.style_table = StyleTable.load(style_file)
         self.style = self.build_style()
         self.target = target or self.pandoc_metadata.get(MD_DESTINATION, "")
         self.output_name = (
@@ -85,15 +118,56 @@ class PandocStyles:
             or get_file_name(files[0])
         )
         self.output_ext = to_file_type
+        self.jobs = jobs
+        self.build_cache = FileCache(BUILD_CACHE) if use_cache else None
+        self.filter_host = filter_host
+        self.shared_ast = shared_ast
+        self.shared_asts = {}
+        self.shared_ast_lock = threading.Lock()
+        # cfg changes of the preflight runs by _preflight_key
+        self.preflights = {}
+        self.preflight_lock = threading.Lock()
+        self.hosted_filters = []
+        self.cancel_event = None
+        self.profile = profile
         self._do_user_config()
 
     def run(self):
         """Convert to all given formats"""
-        if self.target and not isdir(self.target):
-            mkdir(self.target)
+        self.make_target_dir()
+        if self.jobs > 1 and len(self.formats) > 1:
+            self._run_parallel()
+            return
         for fmt in self.formats:
             self.make_format(fmt)
 
+    def make_target_dir(self):
+        if self.target and not isdir(self.target):
+            mkdir(self.target)
+
+    def _run_parallel(self):
+        """Convert to all given formats at the same time"""
+        workers = min(self.jobs, len(self.formats))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(self._format_worker(fmt).make_format, fmt)
+                for fmt in self.formats
+            ]
+        # re-raise failures (e.g. the SystemExit of make_format) in format order
+        for future in futures:
+            future.result()
+
+    def _format_worker(self, fmt):
+        """
+        Return a copy of this object that builds fmt in its own temp subdirectory,
+        so that cfg, cfg.yaml and the modified templates are not shared.
+        """
+        worker = copy_object(self)
+        worker.temp_dir = join(self.temp_dir, fmt)
+        if not isdir(worker.temp_dir):
+            mkdir(worker.temp_dir)
+        return worker
+
     def get_output(self, fmt):
         """
         Converts to the given format and returns the output.
@@ -109,94 +183,140 @@ class PandocStyles:
         """
         print(self.get_output(fmt))
 
+    @property
+    def styles(self):
+        """The styles of the style file as written"""
+        return self.style_table.raw
+
     def build_style(self):
-        style = {}
-        if self.stylepacks:
-            style = self._get_stylepack_style(style, self.stylepacks)
+        """
+        Return the style as layers: the All style, the used styles, the stylepacks
+        and the style definition of the document. The layers are only merged in the
+        cfg of a format.
+        """
+        style = LayeredConfig()
+        if ALL_STYLE in self.style_table and self.style_table.get(ALL_STYLE)[0]:
+            style.push(self._get_style({MD_INHERITS: ALL_STYLE}))
 
-        if self.use_styles:
-            style[MD_INHERITS] = self.use_styles
-            style = self._get_style(style, self.styles)
+        for name in self.use_styles:
+            named_style, used = self.style_table.get(name)
+            style.push(named_style)
+            self.used_stylepacks.extend(used)
 
-        if MD_STYLE_DEF in self.pandoc_metadata:
-            self.update_dict(
-                style, self._get_style(self.pandoc_metadata[MD_STYLE_DEF], self.styles)
-            )
+        if self.stylepacks:
+            style.push(self._get_stylepack_style({}, self.stylepacks))
 
-        all_style = self.styles.get(ALL_STYLE)
-        if all_style:
-            all_style = self._get_style({MD_INHERITS: ALL_STYLE}, self.styles)
-            self.update_dict(all_style, style)
-            return all_style
+        if MD_STYLE_DEF in self.pandoc_metadata:
+            style.push(self._get_style(deepcopy(self.pandoc_metadata[MD_STYLE_DEF])))
         return style
 
     def _get_stylepack_style(self, style, stylepacks):
         if not stylepacks:
             return style
-
-        for stylepack in make_list(stylepacks):
-            if isinstance(stylepack, str):
-                used_styles = [DEFAULT_STYLE]
-                pack = stylepack
-            else:
-                for k, v in stylepack.items():
-                    pack = k
-                    used_styles = make_list(v)
-
-            pack_path = get_pack_path(pack)
-            self.used_stylepacks.append(pack)
-            stylepack_styles = yaml_load(join(pack_path, f"{pack}.yaml"))
-
-            if stylepack_styles.get(ALL_STYLE):
-                used_styles.insert(0, ALL_STYLE)
-
-            for s in used_styles:
-                self.update_dict(
-                    style, self._get_style(stylepack_styles[s], stylepack_styles)
-                )
+        self.used_stylepacks.extend(self.style_table.stylepack_style(style, stylepacks))
         return style
 
-    def _get_style(self, style, all_styles):
+    def _get_style(self, style, all_styles=None):
         """
         Gets the data for all inherited styles
         """
-        stylepacks = style.get(MD_STYLE_PACKS)
-        inherited = deepcopy(make_list(style.get(MD_INHERITS, [])))
-        if not inherited and not stylepacks:
-            return style
-
-        if stylepacks:
-            style = self._get_stylepack_style(style, stylepacks)
-        new_style = dict()
-        if inherited:
-            del style[MD_INHERITS]
-            for extra_style in inherited:
-                extra_style = self._get_style(all_styles[extra_style], all_styles)
-                self.update_dict(new_style, extra_style)
-        self.update_dict(new_style, style)
-        return new_style
+        style, used = self.style_table.resolve(style)
+        self.used_stylepacks.extend(used)
+        return style
 
     def make_format(self, fmt):
         """
         Converts to the given format.
         All attributes defined here change with each format
         """
-        self.cfg = self._get_cfg(fmt)
-        self._preflight()
-        self._process_sass()
-        self._add_to_template()
-        self._replace_in_template()
-        pandoc_args = self._get_pandoc_args()
+        with self._phase(fmt, "cfg"):
+            self.cfg = self._get_cfg(fmt)
+            self._output_replacer()
+        with self._phase(fmt, "preflight"):
+            self._preflight()
+        self._check_cancelled()
+        with self._phase(fmt, "sass"):
+            self._process_sass()
+        with self._phase(fmt, "template"):
+            self._modify_template()
+        with self._phase(fmt, "arguments"):
+            pandoc_args = self._get_pandoc_args()
         logging.debug(f"Command-line args: {pandoc_args}")
+        self._check_cancelled()
         try:
-            run_process(pandoc_args, self.quiet)
-            self._replace_in_output()
-            self._postflight()
+            with self._phase(fmt, "pandoc"):
+                self._run_pandoc(pandoc_args)
+                self._report_filter_stats()
+            with self._phase(fmt, "replace-in-output"):
+                self._replace_in_output()
+            with self._phase(fmt, "postflight"):
+                self._postflight()
             logging.info(f"Build {self.cfg[OUTPUT_FILE]}")
         except:  # noqa: E722
+            # a newer build in watch mode terminated pandoc or a flight script
+            self._check_cancelled()
             logging.error(f"Failed to build {self.cfg[OUTPUT_FILE]}!")
             sys.exit(1)
 
+    def _phase(self, fmt, name):
+        """Time a phase of make_format, if the build is profiled"""
+        if self.profile is None:
+            return nullcontext()
+        return self.profile.phase(self.output_name, fmt, name)
+
+    def _report_filter_stats(self):
+        """Log the stats, that the filters of this format reported (--filter-stats)"""
+        reports = collect_reports(self.temp_dir)
+        if reports:
+            table = report_table(reports)
+            logging.info(f"Filters of {self.cfg[OUTPUT_FILE]}:\n{table}")
+
+    def _check_cancelled(self):
+        """Stop the build, if a newer one was requested (in watch mode)"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise BuildCancelled(self.cfg[FMT])
+
+    def _run_pandoc(self, pandoc_args):
+        """Run pandoc or, if the build cache is used, reuse a cached output"""
+        output_file = self.cfg[OUTPUT_FILE]
+        if not self.build_cache:
+            self._convert(pandoc_args)
+            return
+
+        key = self._build_cache_key(pandoc_args)
+        if self.build_cache.get_file(key, output_file):
+            logging.debug(f"Reused the cached output for {output_file}")
+            return
+        self._convert(pandoc_args)
+        if isfile(output_file):
+            self.build_cache.put_file(key, output_file)
+
+    def _convert(self, pandoc_args):
+        """Run pandoc, or let the pandoc server convert, if it is running and can"""
+        if not convert_document(pandoc_args):
+            run_process(pandoc_args, self.quiet)
+
+    def _build_cache_key(self, pandoc_args):
+        """
+        Hash everything that determines the output of pandoc: the pandoc version,
+        the command line and the content of every file referenced in it (sources,
+        metadata, cfg, templates, css and filters). Paths in the temp dir change
+        with every run, so the temp dir is left out of the hash.
+        """
+        temp_dirs = (self.temp_dir, self.actual_temp_dir.name)
+        parts = [pandoc_version(), pandoc_args]
+        for temp_dir in temp_dirs:
+            parts[1] = parts[1].replace(temp_dir, "")
+        for arg in shlex.split(pandoc_args):
+            for candidate in (arg, arg.split("=", 1)[-1]):
+                for path in (candidate, join(self.target, candidate)):
+                    if path != self.cfg[OUTPUT_FILE] and isfile(path):
+                        parts.append(file_digest(path, *temp_dirs))
+                        break
+        # hosted filters are only named inside the host script
+        parts.extend(file_digest(path) for path in self.hosted_filters)
+        return hash_parts(*parts)
+
     def get_pandoc_metadata(self, md_file, files):
         """Get the metadata yaml block in the file given"""
         if not md_file:
@@ -231,9 +351,10 @@ class PandocStyles:
 
     def _get_cfg(self, fmt):
         """Get the style configuration for the current format"""
-        cfg = self.style_to_cfg(self.style, fmt)
         # update fields in the cfg with fields in the document metadata
-        self.update_dict(cfg, self.pandoc_metadata)
+        cfg = (
+            self.style_layers(self.style, fmt).push(self.pandoc_metadata).materialize()
+        )
 
         if MD_VERBATIM_VARIABLES not in cfg:
             cfg[MD_VERBATIM_VARIABLES] = {}
@@ -245,13 +366,14 @@ class PandocStyles:
             cfg[OUTPUT_FILE] = join(self.target, cfg[OUTPUT_FILE])
         cfg[FMT] = fmt
         cfg[TO_FMT] = fmt
-        if cfg["pdf-engine"] in [
+        pdf_engine = cfg.get("pdf-engine")
+        if pdf_engine in [
             "pdflatex",
             "xelatex",
             "lualatex",
             "tectonic",
             "latexmk",
-        ] or (not cfg["pdf-engine"] and fmt == PDF):
+        ] or (not pdf_engine and fmt == PDF):
             cfg[TO_FMT] = LATEX
         cfg[MD_TEMP_DIR] = self.temp_dir
         cfg[MD_CFG_DIR] = CONFIG_DIR
@@ -278,18 +400,14 @@ class PandocStyles:
         pandoc_args.append(f'-M {MD_PANDOC_STYLES_MD}="{self._make_cfg_file()}"')
 
         # filter out command-line options
+        self.hosted_filters = []
         keys_to_delete = []
         for key, value in self.cfg.items():
             if key not in COMMAND_LINE_OPTIONS:
                 continue
             keys_to_delete.append(key)
             if key == "filter":
-                for item in make_list(value):
-                    if item.endswith(".lua"):
-                        key = "lua-filter"
-                    else:
-                        key = "filter"
-                    item = self.expand_dirs(item, key)
+                for key, item in self._get_filters(value):
                     pandoc_args.append(f"--{key}={item}")
                 continue
             for item in make_list(value):
@@ -338,12 +456,16 @@ class PandocStyles:
                         item = self.expand_dirs(item, key)
                         pandoc_args.append(f'{prefix}{key}="{item}"')
             del self.cfg[group]
+        # -----------------------------------------------
+
+        if self.shared_ast and self._can_share_ast(pandoc_args):
+            return self._shared_ast_args(pandoc_args, complex_data)
+
         if complex_data:
             complex_data = yaml_dump_pandoc_md(
                 complex_data, join(self.temp_dir, "cmplx_metadata.yaml")
             )
             pandoc_args.append(f'"{complex_data}"')
-        # -----------------------------------------------
 
         for ffile in self.cfg[MD_CURRENT_FILES]:
             pandoc_args.append(f'"{ffile}"')
@@ -354,14 +476,122 @@ class PandocStyles:
         pandoc_args.append(f'"{meta}"')
         return " ".join(pandoc_args)
 
+    def _can_share_ast(self, pandoc_args):
+        """
+        Check if the format can be rendered from the shared ast: there is more than
+        one format, the metadata file is yaml and no option needs the sources.
+        """
+        return (
+            len(self.formats) > 1
+            and self.cfg[MD_CURRENT_FILES]
+            and (not self.metadata or has_extension(self.metadata, ["yaml", "yml"]))
+            and not any(_option_name(arg) in SOURCE_OPTIONS for arg in pandoc_args)
+        )
+
+    def _shared_ast_args(self, pandoc_args, complex_data):
+        """
+        Return the command line, that renders the format from the shared ast of
+        the sources. The metadata of the format is given as metadata files and
+        its keys are removed from the ast, so that it takes precedence over the
+        metadata of the sources, like it does when the files are given as inputs.
+        """
+        parse_args = [
+            arg
+            for arg in pandoc_args[1:]
+            if _option_name(arg) in READER_OPTIONS + GENERAL_OPTIONS
+        ]
+        render_args = [pandoc_args[0]] + [
+            arg for arg in pandoc_args[1:] if _option_name(arg) not in READER_OPTIONS
+        ]
+        ast = self._get_shared_ast(parse_args)
+
+        meta_files = []
+        if complex_data:
+            meta_files.append(
+                yaml_dump(complex_data, join(self.temp_dir, "cmplx_metadata.yaml"))
+            )
+        overridden = set(self.cfg)
+        if self.metadata:
+            meta_files.append(self.metadata)
+            overridden.update(yaml_load(self.metadata) or {})
+        meta_files.append(yaml_dump(self.cfg, join(self.temp_dir, "cur_metadata.yaml")))
+
+        # filters change the document, so every format gets its own copy
+        doc = dict(ast)
+        doc["meta"] = {k: v for k, v in ast["meta"].items() if k not in overridden}
+        doc_file = join(self.temp_dir, "document.json")
+        file_write(doc_file, json.dumps(doc))
+
+        render_args.append("--read json")
+        render_args.extend(f'--metadata-file="{f}"' for f in meta_files)
+        render_args.append(f'"{doc_file}"')
+        return " ".join(render_args)
+
+    def _get_shared_ast(self, parse_args):
+        """
+        Return the ast of the sources. It is parsed by pandoc only once for every
+        distinct combination of reader options and source contents.
+        """
+        sources = self.cfg[MD_CURRENT_FILES]
+        key = hash_parts(*parse_args, *(file_digest(f) for f in sources))
+        with self.shared_ast_lock:
+            if key not in self.shared_asts:
+                ast_dir = join(self.actual_temp_dir.name, "ast")
+                if not isdir(ast_dir):
+                    mkdir(ast_dir)
+                ast_file = join(ast_dir, f"{key}.json")
+                args = [f'{PANDOC_CMD} -t json -o "{ast_file}"', *parse_args]
+                args.extend(f'"{f}"' for f in sources)
+                self._convert(" ".join(args))
+                self.shared_asts[key] = json.loads(file_read(ast_file))
+                logging.debug(f"Parsed the sources once into {ast_file}")
+            return self.shared_asts[key]
+
+    def _get_filters(self, filters):
+        """
+        Return (option, path) for all filters. If the filter host is used,
+        consecutive filters of pandoc_styles are replaced by one script, that runs
+        them in one process.
+        """
+        result = []
+        group = []
+        for item in make_list(filters):
+            key = "lua-filter" if item.endswith(".lua") else "filter"
+            item = self.expand_dirs(item, key)
+            if self.filter_host and has_extension(item, "py") and is_hostable(item):
+                group.append(item)
+                continue
+            result.extend(self._host_filters(group))
+            group = []
+            result.append((key, item))
+        result.extend(self._host_filters(group))
+        return result
+
+    def _host_filters(self, scripts):
+        """Return the filter option for a group of hosted filters"""
+        if len(scripts) < 2:
+            return [("filter", script) for script in scripts]
+        self.hosted_filters.extend(scripts)
+        number = len(self.hosted_filters)
+        wrapper = join(self.temp_dir, f"filter_host_{number}.py")
+        return [("filter", write_wrapper(wrapper, scripts))]
+
     def _flight(self, flight_type, repl_txt, repl_val):
         """Run a flight script"""
         if flight_type not in self.cfg:
             return
         for script in make_list(self.cfg[flight_type]):
             if len(script.split(" ")) == 1 and has_extension(script, "py"):
-                cfg = self._make_cfg_file()
                 script = self.expand_dirs(script, flight_type)
+                func = None
+                if not self.cfg.get(MD_FLIGHT_SUBPROCESS):
+                    func = flight_function(script, flight_type)
+                if func is not None:
+                    cfg = run_flight_function(func, flight_type, self.cfg)
+                    if cfg is not None:
+                        self.cfg = cfg
+                    continue
+                cfg = self._make_cfg_file()
                 run_process([sys.executable, script, "--cfg", cfg])
                 self._read_cfg_file()
             else:
@@ -369,17 +599,77 @@ class PandocStyles:
                 run_process(script)
 
     def _preflight(self):
-        """Run all _preflight scripts given in the style definition"""
+        """
+        Run all preflight scripts given in the style definition. With
+        preflight-shared, formats with the same preflight key (see _preflight_key)
+        share the files modified by the first of them and get the changes it made
+        to its cfg.
+        """
         if MD_PREFLIGHT not in self.cfg:
             return
+        if not self.cfg.get(MD_PREFLIGHT_SHARED):
+            self._run_preflight(join(self.temp_dir, MODIFIED_FILES))
+            return
+        key = self._preflight_key()
+        with self.preflight_lock:
+            if key not in self.preflights:
+                before = deepcopy(self.cfg)
+                folder = join(self.actual_temp_dir.name, MODIFIED_FILES, key[:16])
+                self._run_preflight(folder)
+                changed = {k: v for k, v in self.cfg.items() if before.get(k) != v}
+                removed = [k for k in before if k not in self.cfg]
+                # changes to the format or its output can't be shared
+                if any(k in changed or k in removed for k in PREFLIGHT_FORMAT_KEYS):
+                    self.preflights[key] = None
+                else:
+                    self.preflights[key] = (changed, removed)
+                return
+            shared = self.preflights[key]
+        if shared is None:
+            self._run_preflight(join(self.temp_dir, MODIFIED_FILES))
+            return
+        changed, removed = shared
+        self.cfg.update(deepcopy(changed))
+        for k in removed:
+            self.cfg.pop(k, None)
+
+    def _preflight_key(self):
+        """
+        Return a key over everything the preflight scripts see: the cfg apart from
+        the format and its output, the scripts and the sources with their
+        modification times.
+        """
+        ignored = PREFLIGHT_FORMAT_KEYS + [MD_CURRENT_FILES]
+        cfg = {k: v for k, v in self.cfg.items() if k not in ignored}
+        if isinstance(cfg.get(MD_VERBATIM_VARIABLES), dict):
+            cfg[MD_VERBATIM_VARIABLES] = {
+                k: v
+                for k, v in cfg[MD_VERBATIM_VARIABLES].items()
+                if k not in PREFLIGHT_FORMAT_KEYS
+            }
+        try:
+            cfg = json.dumps(cfg, sort_keys=True, default=str)
+        except TypeError:
+            # keys, that can't be sorted, like numbers next to text
+            cfg = json.dumps(cfg, default=str)
+        parts = [cfg]
+        for script in make_list(self.cfg[MD_PREFLIGHT]):
+            if len(script.split(" ")) == 1 and has_extension(script, "py"):
+                script = self.expand_dirs(script, MD_PREFLIGHT)
+            parts.extend([script, _mtime(script)])
+        for f in self.cfg[MD_CURRENT_FILES]:
+            parts.extend([f, _mtime(f)])
+        return hash_parts(*parts)
+
+    def _run_preflight(self, folder):
+        """Copy the sources into folder and run the preflight scripts on them"""
         new = []
-        if not isdir(join(self.temp_dir, MODIFIED_FILES)):
-            mkdir(join(self.temp_dir, MODIFIED_FILES))
+        makedirs(folder, exist_ok=True)
         for f in self.cfg[MD_CURRENT_FILES]:
-            modified_file = join(self.temp_dir, MODIFIED_FILES, get_full_file_name(f))
+            modified_file = join(folder, get_full_file_name(f))
             if isfile(modified_file):
                 remove(modified_file)
-            new.append(copy(f, modified_file))
+            new.append(copy_file(f, modified_file))
         self.cfg[MD_CURRENT_FILES] = new
         self._flight(
             MD_PREFLIGHT,
@@ -405,11 +695,8 @@ class PandocStyles:
         ]
         css.extend([file_read(self.expand_dirs(f, MD_SASS)) for f in sass_files])
         css.extend(make_list(cfg.get(MD_SASS_APPEND, [])))
-        css = sass.compile(
-            string="\n".join(css),
-            output_style="expanded",
-            include_paths=[join(CONFIG_DIR, PATH_SASS)],
-        )
+        css = "\n".join(css)
+        css = compile_sass(css, [join(CONFIG_DIR, PATH_SASS)])
 
         css_file_path = cfg.get(MD_SASS_OUTPUT_PATH)
         temp = css_file_path == PATH_TEMP
@@ -431,118 +718,95 @@ class PandocStyles:
                 pass
         self.update_dict(self.cfg, {CSS: [css_file_path]})
 
-    def _add_to_template(self):
-        """Add code to the template given in the style definition"""
-        if MD_ADD_TO_TEMPLATE not in self.cfg:
-            return
-        for item in make_list(self.cfg[MD_ADD_TO_TEMPLATE]):
-            self._modify_template(
-                r"(\$for\(header-includes\)\$\n\$header-includes\$\n\$endfor\$)",
-                item,
-                True,
-            )
-
-    def _replace_in_template(self):
-        """Replace code in the template with other code given in the style definition"""
-        if MD_REPL_IN_TEMPLATE not in self.cfg:
-            return
-        for item in make_list(self.cfg[MD_REPL_IN_TEMPLATE]):
-            self._modify_template(
+    def _template_operations(self):
+        """
+        Return the operations of add-to-template and replace-in-template as
+        (pattern, replacement, add, count), with replacement files read.
+        """
+        operations = [
+            (HEADER_INCLUDES, item, True, 0)
+            for item in make_list(self.cfg.get(MD_ADD_TO_TEMPLATE) or [])
+        ]
+        operations.extend(
+            (
                 item[MD_REPL_PATTERN],
                 item.get(MD_REPL_TEXT, ""),
                 item.get(MD_REPL_ADD, False),
                 item.get(MD_REPL_COUNT, 0),
             )
+            for item in make_list(self.cfg.get(MD_REPL_IN_TEMPLATE) or [])
+        )
+        for i, (pattern, repl, add, count) in enumerate(operations):
+            if isinstance(repl, str) and isfile(self.expand_dirs(repl, MD_TEMPLATE)):
+                repl = file_read(self.expand_dirs(repl, MD_TEMPLATE))
+                operations[i] = (pattern, repl, add, count)
+        return operations
 
-    def _modify_template(self, pattern, repl, add=False, count=0):
-        """Helper method to do the actual replacement"""
+    def _modify_template(self):
+        """
+        Add code to the template and replace code in it, as given in the style
+        definition. The template is read and the new template written only once.
+        """
+        operations = self._template_operations()
+        if not operations:
+            return
         try:
             template = file_read(self.expand_dirs(self.cfg[MD_TEMPLATE], MD_TEMPLATE))
         except (KeyError, FileNotFoundError):
-            pc = run_process(f"{PANDOC_CMD} -D {self.cfg[TO_FMT]}", True)
-            if not pc:
+            template = default_template(self.cfg[TO_FMT])
+            if template is None:
                 return
-            template = pc.stdout
-        original_template = template
-        if isfile(self.expand_dirs(repl, MD_TEMPLATE)):
-            repl = file_read(self.expand_dirs(repl, MD_TEMPLATE))
-        template = self._replace_in_text(pattern, repl, template, add, count)
-        if original_template != template:
-            template = file_write("new.template", template, self.temp_dir)
-            self.cfg[MD_TEMPLATE] = template
+        new_template = TemplateEngine(operations).apply(template)
+        if new_template != template:
+            self.cfg[MD_TEMPLATE] = file_write(
+                "new.template", new_template, self.temp_dir
+            )
         # for html we need the styles.html file in addition
         if self.cfg[TO_FMT] == HTML:
-            pc = run_process(
-                f"{PANDOC_CMD} --print-default-data-file=templates/styles.html", True
-            )
-            if pc:
-                file_write("styles.html", pc.stdout, self.temp_dir)
+            styles = default_data_file("templates/styles.html")
+            if styles is not None:
+                file_write("styles.html", styles, self.temp_dir)
 
     def _replace_in_output(self):
         """Replace text in the output with text given in the style definition"""
         if MD_REPL_IN_OUTPUT not in self.cfg:
             return
-        original_text = text = file_read(self.cfg[OUTPUT_FILE])
-        for item in self.cfg[MD_REPL_IN_OUTPUT]:
-            text = self._replace_in_text(
-                item[MD_REPL_PATTERN],
-                item.get(MD_REPL_TEXT, ""),
-                text,
-                item.get(MD_REPL_ADD),
-                item.get(MD_REPL_COUNT, 0),
-            )
-        if original_text != text:
-            file_write(self.cfg[OUTPUT_FILE], text)
+        self._output_replacer().apply(self.cfg[OUTPUT_FILE])
 
-    @staticmethod
-    def _replace_in_text(pattern, repl, text, add=False, count=0):
-        """Helper method to replace text"""
-        repl = "\n".join(item for item in make_list(repl))
-        repl = repl.replace("\\", "\\\\")
-        repl = rf"{repl}\n\1" if add else repl
-        text = re.sub(pattern, repl, text, count, re.DOTALL)
-        return text
+    def _output_replacer(self):
+        """Check the replace-in-output patterns of the style"""
+        try:
+            return OutputReplacer(self.cfg.get(MD_REPL_IN_OUTPUT))
+        except ValueError as e:
+            logging.error(f"{MD_REPL_IN_OUTPUT} of {self.cfg[FMT]}: {e}")
+            sys.exit(1)
 
     @classmethod
     def style_to_cfg(cls, style, fmt):
         """Transform a style to the configuration for the current format"""
-        cfg = dict()
-        for group in [ALL_FMTS, fmt]:
-            if group in style:
-                cls.update_dict(cfg, style[group])
-        return cfg
+        return cls.style_layers(style, fmt).materialize()
 
-    @classmethod
-    def update_dict(cls, dictionary, new):
-        """
-        Merge dictionary with new. Single keys are replaced, but nested dictionaries
-        and list are appended
-        """
-        # we deepcopy new, so that it stays independent from the source
-        new = deepcopy(new)
-        for key, value in new.items():
-            if not dictionary.get(key):
-                dictionary[key] = value
-            elif isinstance(value, dict):
-                cls.update_dict(dictionary[key], value)
-            elif isinstance(value, list) and isinstance(dictionary[key], list):
-                for item in value:
-                    if item not in dictionary[key]:
-                        dictionary[key].append(item)
-            else:
-                dictionary[key] = value
+    @staticmethod
+    def style_layers(style, fmt):
+        """Return the layers of a style, that apply to the current format"""
+        return LayeredConfig(style).section(ALL_FMTS, fmt)
+
+    update_dict = staticmethod(update_dict)
 
     def _make_cfg_file(self):
         """
         Dump the configuration for a format into a file. This way filter and flight
-        scripts can read the configuration.
+        scripts can read the configuration. The file is only rewritten, if the
+        configuration changed. With debug logging it is also dumped as yaml.
         """
-        # return file_write(CFG_TEMP_FILE, yaml_dump(self.cfg), self.temp_dir)
-        return yaml_dump(self.cfg, join(self.temp_dir, CFG_TEMP_FILE))
+        path = join(self.temp_dir, CFG_FILTER_FILE)
+        if save_cfg(self.cfg, path) and logging.getLogger().isEnabledFor(logging.DEBUG):
+            yaml_dump(self.cfg, join(self.temp_dir, CFG_TEMP_FILE))
+        return path
 
     def _read_cfg_file(self):
-        """Read the cfg file"""
-        self.cfg = yaml_load(join(self.temp_dir, CFG_TEMP_FILE))
+        """Read the cfg file, it is only parsed again if it was changed"""
+        self.cfg = load_cfg(join(self.temp_dir, CFG_FILTER_FILE))
 
     def expand_dirs(self, item, key=""):
         return expand_directories(item, key)
@@ -646,6 +910,64 @@ def main():
         metavar="FOLDER",
         help="The folder of the source files, for use in macros etc.",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        metavar="N",
+        help="Build up to N formats or, with several documents, up to N documents "
+        "at the same time.",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse the output of earlier builds, if pandoc, the sources, the "
+        "style, templates, css and filters are unchanged. Only files given to "
+        "pandoc are tracked, not images or other resources they include. "
+        "Filters reuse the snippets they converted in earlier builds.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and rebuild the affected formats, whenever a source "
+        "file, the styles, a sass file or a filter changes.",
+    )
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        help="Start one pandoc server and send conversions to it instead of "
+        "starting pandoc again for each. Conversions the server can't do (pdf, "
+        "docx, filters, css, images, ...) still run pandoc.",
+    )
+    parser.add_argument(
+        "--filter-host",
+        action="store_true",
+        help="Run consecutive python filters of pandoc_styles together in one "
+        "process, which reads and writes the document only once.",
+    )
+    parser.add_argument(
+        "--shared-ast",
+        action="store_true",
+        help="Parse the sources only once and render all formats from the "
+        "parsed document. Filters still run for every format.",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=PROFILE_FILE,
+        metavar="FILE",
+        help="Time every phase of the build per document and format, with the "
+        "time spent in pandoc and other subprocesses, and show a table. The "
+        f"timings are written as json to FILE (default: {PROFILE_FILE}).",
+    )
+    parser.add_argument(
+        "--filter-stats",
+        action="store_true",
+        help="Measure the time, the visited and matched elements, the conversions "
+        "and the memory of every python filter of pandoc_styles and show them "
+        f"after each format. Same as setting {FILTER_STATS_ENV}=1.",
+    )
     parser.add_argument(
         "-q",
         "--quiet",
@@ -700,28 +1022,173 @@ def main():
         return
 
     convert_list = [args.files] if not args.individual else [[f] for f in args.files]
+    if args.watch and len(convert_list) > 1:
+        logging.error("--watch can only watch one document, not --individual files.")
+        sys.exit(1)
+    if args.filter_stats:
+        environ[FILTER_STATS_ENV] = "1"
+    if args.cache:
+        # filters started by pandoc use the caches on disk as well
+        environ[CACHE_ENV] = "1"
+
+    with PandocServer() if args.server else nullcontext():
+        if args.watch:
+            with change_dir(args.working_dir):
+                Watcher(partial(make_pandoc_styles, convert_list[0], args)).run()
+            return
 
-    with change_dir(args.working_dir):
+        profile = Profile() if args.profile else None
+        with change_dir(args.working_dir):
+            summary = convert_documents(convert_list, args, profile)
+    if args.cache:
+        FileCache(BUILD_CACHE).prune()
+        FileCache(STYLE_CACHE).prune()
+        FileCache(SASS_CACHE).prune()
+        FileCache(PANDOC_CACHE).prune()
+        FileCache(TEMPLATE_CACHE).prune()
+        FileCache(SNIPPET_CACHE).prune(SNIPPET_CACHE_SIZE)
+    if profile is not None:
+        logging.info(f"Profile:\n{profile.table()}")
+        logging.info(f"Wrote the profile to {profile.write(args.profile)}")
+
+    failed = [files for files, success in summary if not success]
+    if len(summary) > 1:
+        converted = len(summary) - len(failed)
+        logging.info(f"Converted {converted} of {len(summary)} documents")
+        for files in failed:
+            logging.error(f"Failed to convert {', '.join(files)}!")
+    if failed:
+        sys.exit(1)
+
+
+def convert_documents(convert_list, args, profile=None):
+    """
+    Convert every document in convert_list and return a list of (files, success).
+    With more than one job the documents are spread across a process pool. The log
+    messages of every document are emitted in the order of convert_list. The
+    timings of all documents are collected in profile, if given.
+    """
+    jobs = 1 if args.print else args.jobs
+    if jobs <= 1 or len(convert_list) <= 1:
+        summary = []
+        # the error of a single document is not summarized, but raised
+        single = len(convert_list) == 1
         for files in convert_list:
-            ps = PandocStyles(
-                files,
-                args.to,
-                args.from_format,
-                args.styles,
-                args.add_styles,
-                args.metadata,
-                args.destination,
-                args.output_name,
-                args.stylepacks,
-                args.style_file,
-                args.quiet,
-                args.to_file_type,
+            files, success, _, timings = _convert_document(
+                files, args, jobs, raise_errors=single
             )
+            summary.append((files, success))
+            if profile is not None:
+                profile.records.extend(timings)
+        return summary
+
+    summary = []
+    level = logging.getLogger().level
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(convert_list)),
+        initializer=_init_worker,
+        initargs=(level,),
+    ) as pool:
+        futures = [
+            pool.submit(_convert_document, files, args, 1, True)
+            for files in convert_list
+        ]
+        for future in futures:
+            files, success, records, timings = future.result()
+            for record_level, message in records:
+                logging.log(record_level, message)
+            summary.append((files, success))
+            if profile is not None:
+                profile.records.extend(timings)
+    return summary
+
+
+def _init_worker(level):
+    """Drop the inherited log handlers, messages are sent back to the main process"""
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+
+def _convert_document(files, args, jobs, capture_log=False, raise_errors=False):
+    """
+    Convert one document. Return the files, if the conversion succeeded, the
+    captured log messages and the timings of the phases (with --profile). An
+    unexpected error is logged with its traceback, or raised with raise_errors.
+    """
+    records = []
+    profile = Profile() if args.profile else None
+    handler = _ListHandler(records) if capture_log else None
+    if handler:
+        logging.getLogger().addHandler(handler)
+    success = True
+    try:
+        ps = make_pandoc_styles(files, args, jobs, profile)
+
+        if args.print:
+            ps.print_output(args.to[0])
+        else:
+            ps.run()
+    except SystemExit as e:
+        success = not e.code
+    except Exception as e:
+        if raise_errors:
+            raise
+        logging.exception(f"{', '.join(files)}: {e!r}")
+        success = False
+    finally:
+        if handler:
+            logging.getLogger().removeHandler(handler)
+    return files, success, records, profile.records if profile else []
+
+
+def _mtime(path):
+    """Return the modification time of the file as text, "" if there is none"""
+    try:
+        return str(stat(path).st_mtime_ns)
+    except OSError:
+        return ""
+
+
+def _option_name(arg):
+    """Return the name of a pandoc option like --toc, --css="x" or -M key=value"""
+    return arg.split(" ", 1)[0].split("=", 1)[0].lstrip("-")
+
+
+def make_pandoc_styles(files, args, jobs=None, profile=None):
+    """Create a PandocStyles object for the files with the command line options"""
+    return PandocStyles(
+        list(files),
+        args.to,
+        args.from_format,
+        args.styles,
+        args.add_styles,
+        args.metadata,
+        args.destination,
+        args.output_name,
+        args.stylepacks,
+        args.style_file,
+        args.quiet,
+        args.to_file_type,
+        args.jobs if jobs is None else jobs,
+        args.cache,
+        args.filter_host,
+        args.shared_ast,
+        profile,
+    )
 
-            if args.print:
-                ps.print_output(args.to[0])
-            else:
-                ps.run()
+
+class _ListHandler(logging.Handler):
+    """Collects (level, message) of all log records in a list"""
+
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+
+    def emit(self, record):
+        # the message with the traceback, if there is one
+        self.records.append((record.levelno, self.format(record)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,266 @@
+"""Replace text in (possibly very large) output files"""
+
+import logging
+import mmap
+import os
+import re
+import shutil
+from functools import lru_cache
+from os.path import abspath, dirname, getsize
+from tempfile import NamedTemporaryFile
+
+from .constants import MD_REPL_ADD, MD_REPL_COUNT, MD_REPL_PATTERN, MD_REPL_TEXT
+from .template_engine import compile_pattern, make_replacement
+from .utils import file_read, file_write, make_list
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+# outputs of this size (in bytes) are not read into memory, but streamed
+STREAM_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+# nodes, that match differently on bytes than on str
+NOT_BYTE_SAFE = {
+    sre_parse.ANY,
+    sre_parse.NOT_LITERAL,
+    sre_parse.CATEGORY,
+    sre_parse.NEGATE,
+    sre_parse.RANGE_UNI_IGNORE,
+}
+
+
+def _children(op, av):
+    """Return the subpatterns of a node of a parsed pattern"""
+    if op in REPEATS or op == getattr(sre_parse, "POSSESSIVE_REPEAT", None):
+        return [av[2]]
+    if op == sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_parse.BRANCH:
+        return av[1]
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    if op == getattr(sre_parse, "ATOMIC_GROUP", None):
+        return [av]
+    if op == sre_parse.GROUPREF_EXISTS:
+        return [item for item in av[1:] if item]
+    return []
+
+
+def _has_nested_repeat(parsed, in_repeat=False):
+    """Check for an unbounded repetition inside another one, like (a+)* or (.*?x)+"""
+    for op, av in parsed:
+        unbounded = op in REPEATS and av[1] == sre_parse.MAXREPEAT
+        if unbounded and in_repeat:
+            return True
+        for child in _children(op, av):
+            if _has_nested_repeat(child, in_repeat or unbounded):
+                return True
+    return False
+
+
+def _only_repeats(parsed):
+    """
+    Check if a pattern can match a text in more than one way just by repeating,
+    like the a+ in (a+)+, that can match "aa" once or twice.
+    """
+    found = False
+    for op, av in parsed:
+        if op in REPEATS and av[1] == sre_parse.MAXREPEAT:
+            found = True
+        elif op == sre_parse.SUBPATTERN and _only_repeats(av[-1]):
+            found = True
+        elif op == sre_parse.BRANCH and any(_only_repeats(b) for b in av[1]):
+            found = True
+        elif op != sre_parse.AT:
+            return False
+    return found
+
+
+def _has_ambiguous_repeat(parsed):
+    """Check for an unbounded repetition of only repetitions, like (a+)* or (a*b*)+"""
+    for op, av in parsed:
+        if op in REPEATS and av[1] == sre_parse.MAXREPEAT and _only_repeats(av[2]):
+            return True
+        for child in _children(op, av):
+            if _has_ambiguous_repeat(child):
+                return True
+    return False
+
+
+def _is_byte_safe(parsed):
+    """
+    Check if the pattern matches exactly the same on utf-8 bytes as on the decoded
+    text. That is the case, if it only consists of ascii literals and sets, groups,
+    repetitions and anchors and does not ignore case.
+    """
+    for op, av in parsed:
+        if op in NOT_BYTE_SAFE:
+            return False
+        if op == sre_parse.SUBPATTERN and av[1] & re.IGNORECASE:
+            return False
+        if op == sre_parse.LITERAL and av > 127:
+            return False
+        if op == sre_parse.IN:
+            for item_op, item_av in av:
+                if item_op in NOT_BYTE_SAFE:
+                    return False
+                if item_op == sre_parse.LITERAL and item_av > 127:
+                    return False
+                if item_op == sre_parse.RANGE and item_av[1] > 127:
+                    return False
+        for child in _children(op, av):
+            if not _is_byte_safe(child):
+                return False
+    return True
+
+
+@lru_cache(maxsize=256)
+def check_pattern(pattern):
+    """
+    Compile and check a pattern. Raise a ValueError for invalid patterns and for
+    patterns, that backtrack exponentially when they fail, and warn about patterns,
+    that can backtrack for a long time. Return the pattern compiled for bytes (or
+    None, if that is not possible) and if it matches on bytes like on any text.
+    """
+    try:
+        compile_pattern(pattern)
+        parsed = sre_parse.parse(pattern, re.DOTALL)
+    except re.error as e:
+        raise ValueError(f"Invalid pattern {pattern!r}: {e}") from e
+    if _has_ambiguous_repeat(parsed):
+        raise ValueError(
+            f"Pattern {pattern!r} repeats a repetition, like (a+)+, which takes "
+            "forever to fail on some outputs. Drop the inner or the outer repetition."
+        )
+    if _has_nested_repeat(parsed):
+        logging.warning(
+            f"Pattern {pattern!r} nests unbounded repetitions, which can take very "
+            "long to fail on some outputs. A bounded repetition like {0,100} avoids "
+            "that."
+        )
+    try:
+        bytes_pattern = re.compile(pattern.encode("ascii"), re.DOTALL)
+    except (UnicodeEncodeError, re.error):
+        return None, False
+    byte_safe = not parsed.state.flags & re.IGNORECASE and _is_byte_safe(parsed)
+    return bytes_pattern, byte_safe
+
+
+class Replacement:
+    """A single replace-in-output item of a style"""
+
+    def __init__(self, item):
+        self.pattern = item[MD_REPL_PATTERN]
+        self.bytes_pattern, self.byte_safe = check_pattern(self.pattern)
+        self.repl = make_replacement(item.get(MD_REPL_TEXT, ""), item.get(MD_REPL_ADD))
+        self.count = item.get(MD_REPL_COUNT, 0)
+        if not isinstance(self.count, int) or self.count < 0:
+            raise ValueError(f"Count of {self.pattern!r} must be 0 or more")
+
+    def sub(self, text):
+        return compile_pattern(self.pattern).sub(self.repl, text, self.count)
+
+    def can_stream(self, ascii_file):
+        """Check if the replacement can be done on the raw bytes of a file"""
+        if self.bytes_pattern is None or not self.repl.isascii():
+            return False
+        return self.byte_safe or ascii_file
+
+    def stream(self, path):
+        """
+        Replace in the file without reading it into memory. Matches are searched
+        in a memory map and the result is written to a temporary file, that
+        replaces the output at the end. Return True if anything was replaced.
+        """
+        repl = self.repl.encode("ascii")
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                folder = dirname(abspath(path))
+                with NamedTemporaryFile(dir=folder, delete=False) as out:
+                    replaced, pos = self._write_replaced(mm, repl, out)
+                    if replaced:
+                        _copy_range(mm, pos, len(mm), out)
+        if not replaced:
+            os.remove(out.name)
+            return False
+        shutil.copymode(path, out.name)
+        os.replace(out.name, path)
+        return True
+
+    def _write_replaced(self, mm, repl, out):
+        """
+        Write the content of mm up to the last replaced match to out. Return the
+        number of replaced matches and the position after the last one.
+        """
+        pos = 0
+        replaced = 0
+        # the matches hold a view on mm, so they must not outlive this method
+        for match in self.bytes_pattern.finditer(mm):
+            _copy_range(mm, pos, match.start(), out)
+            out.write(match.expand(repl))
+            pos = match.end()
+            replaced += 1
+            if replaced == self.count:
+                break
+        return replaced, pos
+
+
+def _copy_range(mm, start, end, out):
+    for pos in range(start, end, CHUNK_SIZE):
+        out.write(mm[pos : min(pos + CHUNK_SIZE, end)])
+
+
+def _scan_file(path):
+    """Return if the file is ascii only and if it has Windows newlines"""
+    ascii_file = True
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            if b"\r" in chunk:
+                return False, True
+            ascii_file = ascii_file and chunk.isascii()
+    return ascii_file, False
+
+
+class OutputReplacer:
+    """
+    Applies the replace-in-output items of a style to an output file. The patterns
+    are checked when the replacer is created, so invalid patterns fail before pandoc
+    runs.
+
+    The items are applied one after the other, each on the result of the ones
+    before, as a later pattern may be written to match what an earlier one
+    inserted. Outputs larger than STREAM_SIZE are streamed through a memory map
+    as long as the patterns allow matching on bytes, smaller ones are replaced
+    in memory and written once. In memory, Windows newlines are read as \n, so
+    a pattern matches them with \n. Such files are never streamed.
+    """
+
+    def __init__(self, items):
+        self.replacements = [Replacement(item) for item in make_list(items or [])]
+
+    def apply(self, path):
+        """Apply all replacements to the file. Return True if it changed."""
+        replacements = list(self.replacements)
+        changed = False
+        if replacements and getsize(path) >= STREAM_SIZE:
+            # replacements are ascii, so an ascii file stays ascii
+            ascii_file, windows_newlines = _scan_file(path)
+            while (
+                replacements
+                and not windows_newlines
+                and replacements[0].can_stream(ascii_file)
+            ):
+                changed = replacements.pop(0).stream(path) or changed
+
+        if replacements:
+            original_text = text = file_read(path)
+            for replacement in replacements:
+                text = replacement.sub(text)
+            if original_text != text:
+                file_write(path, text)
+                changed = True
+        return changed
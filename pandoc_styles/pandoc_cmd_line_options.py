@@ -90,3 +90,28 @@ COMMAND_LINE_OPTIONS = [
     "dump-args",
     "ignore-args",
 ]
+
+# Options that only apply to reading the sources. A shared ast is parsed with them,
+# the formats are rendered without them.
+READER_OPTIONS = [
+    "f",
+    "r",
+    "from",
+    "read",
+    "shift-heading-level-by",
+    "base-header-level",
+    "strip-empty-paragraphs",
+    "indented-code-classes",
+    "default-image-extension",
+    "file-scope",
+    "preserve-tabs",
+    "tab-stop",
+    "track-changes",
+    "abbreviations",
+]
+
+# Options given for parsing a shared ast as well as for rendering
+GENERAL_OPTIONS = ["data-dir", "verbose", "quiet", "fail-if-warnings"]
+
+# Options that need the sources and prevent a shared ast
+SOURCE_OPTIONS = ["defaults", "extract-media"]
@@ -0,0 +1,81 @@
+"""Information printed by pandoc, fetched once per pandoc binary"""
+
+import re
+import shutil
+from os import stat
+from os.path import realpath
+
+from .cache import disk_cache, hash_parts
+from .constants import PANDOC_CACHE, PANDOC_CMD
+from .utils import run_process
+
+# output of this process by cache key
+pandoc_outputs = {}
+
+
+def pandoc_identity():
+    """
+    Return a string, that changes whenever the pandoc binary in use changes: its
+    resolved path, modification time and size.
+    """
+    path = shutil.which(PANDOC_CMD)
+    if path is None:
+        return PANDOC_CMD
+    path = realpath(path)
+    try:
+        st = stat(path)
+    except OSError:
+        return path
+    return f"{path}:{st.st_mtime_ns}:{st.st_size}"
+
+
+def pandoc_output(pandoc_option):
+    """
+    Return what pandoc prints with the given option. The output is cached in
+    memory and, with --cache, on disk for the pandoc binary in use.
+    """
+    key = hash_parts(pandoc_identity(), pandoc_option)
+    output = pandoc_outputs.get(key)
+    if output is not None:
+        return output
+
+    cache = disk_cache(PANDOC_CACHE)
+    output = cache.get(key) if cache else None
+    if output is None:
+        pc = run_process(f"{PANDOC_CMD} {pandoc_option}", True)
+        if not pc:
+            return None
+        output = pc.stdout
+        if cache:
+            cache.put(key, output)
+    pandoc_outputs[key] = output
+    return output
+
+
+def default_template(fmt):
+    """Return the default template of pandoc for the format"""
+    return pandoc_output(f"-D {fmt}")
+
+
+def default_data_file(name):
+    """Return the content of a default data file of pandoc"""
+    return pandoc_output(f"--print-default-data-file={name}")
+
+
+def pandoc_version():
+    """Return the version line of the pandoc in use"""
+    return pandoc_output("--version").splitlines()[0]
+
+
+def pandoc_version_tuple():
+    """Return the version of the pandoc in use as a tuple of ints"""
+    match = re.search(r"(\d+(?:\.\d+)*)", pandoc_version())
+    return tuple(int(x) for x in match.group(1).split(".")) if match else ()
+
+
+def pandoc_features():
+    """Return the features pandoc was compiled with, e.g. {"+server", "+lua"}"""
+    for line in pandoc_output("--version").splitlines():
+        if line.startswith("Features:"):
+            return set(line.split(":", 1)[1].split())
+    return set()
@@ -0,0 +1,286 @@
+"""Run conversions through a long-lived pandoc server instead of new processes"""
+
+import base64
+import json
+import logging
+import os
+import re
+import shlex
+import socket
+import subprocess
+import time
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from .constants import PANDOC_CMD, SERVER_ENV
+from .pandoc_data import pandoc_features
+from .utils import file_read, file_write, has_extension
+
+SERVER_TIMEOUT = 120
+START_TIMEOUT = 10
+
+# command line flags the server understands and their name in a request
+SERVER_FLAGS = {
+    "s": "standalone",
+    "standalone": "standalone",
+    "toc": "table-of-contents",
+    "table-of-contents": "table-of-contents",
+    "N": "number-sections",
+    "number-sections": "number-sections",
+    "section-divs": "section-divs",
+    "ascii": "ascii",
+    "reference-links": "reference-links",
+    "strip-comments": "strip-comments",
+    "incremental": "incremental",
+    "html-q-tags": "html-q-tags",
+    "listings": "listings",
+    "preserve-tabs": "preserve-tabs",
+}
+# command line options the server understands and the type of their value
+SERVER_OPTIONS = {
+    "toc-depth": int,
+    "columns": int,
+    "dpi": int,
+    "tab-stop": int,
+    "shift-heading-level-by": int,
+    "slide-level": int,
+    "wrap": str,
+    "top-level-division": str,
+    "identifier-prefix": str,
+    "title-prefix": str,
+    "email-obfuscation": str,
+    "reference-location": str,
+    "eol": str,
+}
+MARKDOWN_EXTENSIONS = ["md", "markdown", "yaml", "yml"]
+# formats, that embed images and other resources, which the sandboxed server can't
+# read
+BINARY_FORMATS = {"docx", "odt", "epub", "epub2", "epub3", "pptx", "pdf", "fb2"}
+IMAGE_REFERENCE = re.compile(r"!\[|<img\b|\\includegraphics", re.IGNORECASE)
+
+
+class ServerError(Exception):
+    """The server is not available or could not convert"""
+
+
+def server_url():
+    """Return the url of the running server or None"""
+    return os.environ.get(SERVER_ENV) or None
+
+
+def convert(text, from_fmt, to_fmt, standalone=False, options=None, url=None):
+    """
+    Convert text with the server. options are further fields of the request, named
+    like the options of a pandoc defaults file. Return the output as text, or as
+    bytes for binary formats.
+    """
+    url = url or server_url()
+    if url is None:
+        raise ServerError("No pandoc server is running")
+    request = dict(options or {})
+    request.update({"text": text, "from": from_fmt, "to": to_fmt})
+    if standalone:
+        request["standalone"] = True
+    data = json.dumps(request).encode("utf-8")
+    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    try:
+        with urlopen(Request(url, data, headers), timeout=SERVER_TIMEOUT) as response:
+            result = json.loads(response.read().decode("utf-8"))
+    except (URLError, OSError, ValueError) as e:
+        raise ServerError(f"pandoc server request failed: {e}") from e
+    if not isinstance(result, dict) or "output" not in result:
+        raise ServerError(f"pandoc server could not convert: {result}")
+    if result.get("messages"):
+        # pandoc warns about something (like a file it could not read), that the
+        # command line may do differently
+        raise ServerError(f"pandoc server reported: {result['messages']}")
+    if result.get("base64"):
+        return base64.b64decode(result["output"])
+    return result["output"]
+
+
+def server_request(pandoc_args):
+    """
+    Translate a pandoc command line into a request for the server. Return the
+    request and the output file, or None if the server can't do this conversion,
+    because it would need filters, a pdf engine or files it can't read, like
+    images, css or anything a binary format embeds.
+    """
+    args = shlex.split(pandoc_args)[1:]
+    request = {"variables": {}, "metadata": {}}
+    inputs = []
+    output_file = None
+    while args:
+        arg = args.pop(0)
+        if not arg.startswith("-"):
+            inputs.append(arg)
+            continue
+        if arg.startswith("--") and "=" in arg:
+            key, value = arg[2:].split("=", 1)
+        else:
+            key = arg.lstrip("-")
+            value = None
+        if key in SERVER_FLAGS and value is None:
+            request[SERVER_FLAGS[key]] = True
+            continue
+        if value is None:
+            if not args:
+                return None
+            value = args.pop(0)
+        if key in ["t", "to", "w", "write"]:
+            request["to"] = value
+        elif key in ["f", "from", "r", "read"]:
+            request["from"] = value
+        elif key in ["o", "output"]:
+            output_file = value
+        elif key in ["V", "variable", "M", "metadata"]:
+            group = "variables" if key in ["V", "variable"] else "metadata"
+            name, _, item = value.partition("=")
+            request[group][name] = {"true": True, "false": False, "": True}.get(
+                item, item
+            )
+        elif key == "template":
+            try:
+                request["template"] = file_read(value)
+            except OSError:
+                return None
+        elif key in SERVER_OPTIONS:
+            try:
+                if SERVER_OPTIONS[key] is list:
+                    request.setdefault(key, []).append(value)
+                else:
+                    request[key] = SERVER_OPTIONS[key](value)
+            except ValueError:
+                return None
+        else:
+            return None
+
+    if output_file is None or "to" not in request:
+        return None
+    to_fmt = re.split(r"[+-]", request["to"])[0]
+    if to_fmt in BINARY_FORMATS or has_extension(output_file, list(BINARY_FORMATS)):
+        return None
+    if "from" not in request:
+        # without --read, pandoc guesses the format from the extensions
+        if not all(has_extension(f, MARKDOWN_EXTENSIONS) for f in inputs):
+            return None
+        request["from"] = "markdown"
+    try:
+        texts = [file_read(f) for f in inputs]
+    except (OSError, UnicodeDecodeError):
+        return None
+    if any(IMAGE_REFERENCE.search(t) for t in texts):
+        return None
+    # pandoc concatenates the inputs, separated by a newline if needed
+    request["text"] = "".join(t if t.endswith("\n") else f"{t}\n" for t in texts)
+    return request, output_file
+
+
+def convert_document(pandoc_args):
+    """
+    Do the conversion of the pandoc command line with the server, if it is running
+    and supports it. Return True on success.
+    """
+    if server_url() is None:
+        return False
+    request = server_request(pandoc_args)
+    if request is None:
+        return False
+    request, output_file = request
+    text = request.pop("text")
+    from_fmt = request.pop("from")
+    to_fmt = request.pop("to")
+    try:
+        output = convert(text, from_fmt, to_fmt, options=request)
+    except ServerError as e:
+        logging.debug(f"{e}, running pandoc instead")
+        return False
+    if isinstance(output, bytes):
+        with open(output_file, "wb") as f:
+            f.write(output)
+    else:
+        file_write(output_file, output if output.endswith("\n") else f"{output}\n")
+    return True
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class PandocServer:
+    """
+    Starts a pandoc server on a free local port and publishes its url in the
+    environment, so that filters started by pandoc find it as well. If the server
+    can't be started, everything falls back to running pandoc for each conversion.
+
+        with PandocServer():
+            ...
+    """
+
+    def __init__(self):
+        self.process = None
+        self.url = None
+
+    def start(self):
+        """Start the server. Return True if it is ready to accept requests."""
+        try:
+            features = pandoc_features()
+        except (OSError, subprocess.CalledProcessError) as e:
+            logging.warning(f"Could not start the pandoc server: {e}")
+            return False
+        if features and "+server" not in features:
+            logging.warning("pandoc was built without server support.")
+            return False
+        port = _free_port()
+        try:
+            self.process = subprocess.Popen(
+                [PANDOC_CMD, "server", "--port", str(port)]
+                + ["--timeout", str(SERVER_TIMEOUT)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as e:
+            logging.warning(f"Could not start the pandoc server: {e}")
+            return False
+        if not self._wait_until_ready(port):
+            logging.warning("The pandoc server did not start, running pandoc instead.")
+            self.stop()
+            return False
+        self.url = f"http://127.0.0.1:{port}/"
+        os.environ[SERVER_ENV] = self.url
+        logging.debug(f"Started a pandoc server at {self.url}")
+        return True
+
+    def _wait_until_ready(self, port):
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                return False
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                    return True
+            except OSError:
+                time.sleep(0.05)
+        return False
+
+    def stop(self):
+        """Stop the server"""
+        if self.url is not None and os.environ.get(SERVER_ENV) == self.url:
+            del os.environ[SERVER_ENV]
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        self.url = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
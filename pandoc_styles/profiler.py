@@ -0,0 +1,136 @@
+"""Time the phases of a build (--profile)"""
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# wall time of the subprocesses started by the phase running in this thread
+_local = threading.local()
+
+
+def add_subprocess_time(seconds):
+    """Count the wall time of a subprocess to the phase running in this thread"""
+    if getattr(_local, "subprocess_time", None) is not None:
+        _local.subprocess_time += seconds
+
+
+def _rss_kb(usage):
+    # bytes on macOS, KB everywhere else
+    return usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+
+
+def peak_rss():
+    """Return the peak resident memory of this process in KB, or None"""
+    if resource is None:
+        return None
+    return _rss_kb(resource.getrusage(resource.RUSAGE_SELF))
+
+
+def _children_usage():
+    """Return the cpu time and the peak memory (KB) of all finished children"""
+    if resource is None:
+        return None, None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, _rss_kb(usage)
+
+
+def text_table(header, rows, left=1):
+    """Return the rows as a table with aligned columns, the first left ones to the
+    left, the others to the right"""
+    widths = [max(len(cell) for cell in column) for column in zip(header, *rows)]
+    lines = []
+    for row in [header] + rows:
+        cells = [
+            cell.ljust(width) if i < left else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        ]
+        lines.append("  ".join(cells))
+    return "\n".join(lines)
+
+
+class Profile:
+    """
+    Records the wall time of every phase of a build per document and format, the
+    wall time of the subprocesses started in it and the cpu time of the children,
+    that finished in it. The peak memory is that of the largest child so far.
+
+    The cpu time of the children is counted for the whole process, so with several
+    formats built at the same time (--jobs), a phase also gets the cpu time of
+    children of the other formats.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, document, fmt, name):
+        outer = getattr(_local, "subprocess_time", None)
+        _local.subprocess_time = 0.0
+        cpu_before, _ = _children_usage()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            subprocess_time = _local.subprocess_time
+            _local.subprocess_time = None if outer is None else outer + subprocess_time
+            cpu_after, rss = _children_usage()
+            record = {
+                "document": document,
+                "format": fmt,
+                "phase": name,
+                "wall": round(wall, 6),
+                "subprocess_wall": round(subprocess_time, 6),
+                "children_cpu": (
+                    None if cpu_after is None else round(cpu_after - cpu_before, 6)
+                ),
+                "children_peak_rss_kb": rss,
+            }
+            with self._lock:
+                self.records.append(record)
+
+    def totals(self):
+        """Return the wall time of each phase summed over all documents and formats"""
+        totals = {}
+        for record in self.records:
+            totals[record["phase"]] = totals.get(record["phase"], 0) + record["wall"]
+        return {phase: round(wall, 6) for phase, wall in totals.items()}
+
+    def write(self, path):
+        """Write the records and the totals as json"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"phases": self.records, "totals": self.totals()}, f, indent=2)
+        return path
+
+    def table(self):
+        """Return the records as a short table, cpu and rss are of the children"""
+        header = ["document", "format", "phase", "wall", "subproc", "cpu", "rss MB"]
+        rows = [
+            [
+                record["document"],
+                record["format"],
+                record["phase"],
+                f"{record['wall']:.3f}s",
+                f"{record['subprocess_wall']:.3f}s",
+                (
+                    "-"
+                    if record["children_cpu"] is None
+                    else f"{record['children_cpu']:.3f}s"
+                ),
+                (
+                    "-"
+                    if record["children_peak_rss_kb"] is None
+                    else f"{record['children_peak_rss_kb'] / 1024:.1f}"
+                ),
+            ]
+            for record in self.records
+        ]
+        return text_table(header, rows, left=3)
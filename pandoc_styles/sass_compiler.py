@@ -0,0 +1,79 @@
+"""Compile sass with libsass, cached in memory and, with --cache, on disk"""
+
+import re
+from os.path import abspath, basename, dirname, isfile, join
+
+import sass
+
+from .cache import disk_cache, file_digest, hash_parts
+from .constants import SASS_CACHE
+
+IMPORT_RULE = re.compile(r"@(?:import|use|forward)\s+([^;]+);")
+IMPORT_NAME = re.compile(r"""["']([^"']+)["']""")
+
+# compiled css of this process by cache key
+compiled_css = {}
+
+
+def compile_sass(string, include_paths, output_style="expanded"):
+    """
+    Compile the sass in string. The css is cached by the sass, the output style
+    and the content of all files it imports through the include paths, so it is
+    only compiled again if one of them changes.
+    """
+    key = sass_cache_key(string, include_paths, output_style)
+    css = compiled_css.get(key)
+    if css is not None:
+        return css
+
+    cache = disk_cache(SASS_CACHE)
+    css = cache.get(key) if cache else None
+    if css is None:
+        css = sass.compile(
+            string=string, output_style=output_style, include_paths=include_paths
+        )
+        if cache:
+            cache.put(key, css)
+    compiled_css[key] = css
+    return css
+
+
+def sass_cache_key(string, include_paths, output_style):
+    parts = [string, output_style, *include_paths]
+    for path in sorted(imported_files(string, include_paths)):
+        parts.extend([path, file_digest(path)])
+    return hash_parts(*parts)
+
+
+def imported_files(string, include_paths, base_dir=None, found=None):
+    """Return the set of all files imported by the sass, directly or indirectly"""
+    found = set() if found is None else found
+    for rule in IMPORT_RULE.findall(string):
+        for name in IMPORT_NAME.findall(rule):
+            if name.startswith(("http://", "https://", "//")) or "url(" in name:
+                continue
+            path = _resolve_import(name, include_paths, base_dir)
+            if path is None or path in found:
+                continue
+            found.add(path)
+            with open(path, encoding="utf-8") as f:
+                imported_files(f.read(), include_paths, dirname(path), found)
+    return found
+
+
+def _resolve_import(name, include_paths, base_dir):
+    """Find the file sass would load for the import name"""
+    # the sass string itself is resolved relative to the working directory
+    folders = [base_dir or ""] + list(include_paths)
+    folder, file_name = dirname(name), basename(name)
+    candidates = [name]
+    for ext in ["scss", "sass", "css"]:
+        candidates.append(join(folder, f"{file_name}.{ext}"))
+        candidates.append(join(folder, f"_{file_name}.{ext}"))
+        candidates.append(join(name, f"_index.{ext}"))
+    for base in folders:
+        for candidate in candidates:
+            path = join(base, candidate)
+            if isfile(path):
+                return abspath(path)
+    return None
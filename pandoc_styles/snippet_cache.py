@@ -0,0 +1,85 @@
+"""Remember the conversions of filters, so each snippet is converted only once"""
+
+import json
+from collections import OrderedDict
+
+from panflute import Doc, Element
+from panflute.elements import from_json
+
+from .cache import disk_cache, hash_parts
+from .constants import SNIPPET_CACHE
+from .pandoc_data import pandoc_identity
+
+# conversions kept in the memory of a filter process
+MEMORY_SIZE = 2048
+
+
+def source_text(text):
+    """Return the input of a conversion as text: panflute elements as json"""
+    if isinstance(text, str):
+        return text
+    if isinstance(text, (Doc, Element)):
+        return json.dumps(text.to_json())
+    return json.dumps([item.to_json() for item in text])
+
+
+class SnippetCache:
+    """
+    Caches converted snippets by their input, the formats, the extra arguments and
+    the pandoc binary. The results are kept in memory, least recently used first,
+    and, if the build runs with --cache, on disk for all filter processes and later
+    builds. Conversions with extra arguments are not stored on disk, as these often
+    name files (a bibliography, ...), which may change.
+
+    Results are stored serialized, every hit returns new elements.
+    """
+
+    def __init__(self, size=MEMORY_SIZE):
+        self.size = size
+        self.results = OrderedDict()
+        self._pandoc = None
+
+    def key(self, text, input_format, output_format, standalone, extra_args, pandoc):
+        if self._pandoc is None:
+            self._pandoc = pandoc_identity()
+        return hash_parts(
+            pandoc or self._pandoc,
+            input_format,
+            output_format,
+            str(bool(standalone)),
+            *(extra_args or []),
+            source_text(text),
+        )
+
+    def _disk(self, extra_args):
+        return None if extra_args else disk_cache(SNIPPET_CACHE)
+
+    def get(self, key, output_format, extra_args=None):
+        """Return the result stored under key or None"""
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+        else:
+            disk = self._disk(extra_args)
+            result = disk.get(key) if disk else None
+            if result is None:
+                return None
+            self._remember(key, result)
+        if output_format == "panflute":
+            return json.loads(result, object_hook=from_json)
+        return result
+
+    def put(self, key, result, extra_args=None):
+        """Store a result of convert_text under key"""
+        if not isinstance(result, str):
+            result = source_text(result)
+        self._remember(key, result)
+        disk = self._disk(extra_args)
+        if disk:
+            disk.put(key, result)
+
+    def _remember(self, key, result):
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.size:
+            self.results.popitem(last=False)
@@ -0,0 +1,257 @@
+"""Convert the snippets of a filter run together, in as few pandoc calls as we can"""
+
+import json
+import logging
+import re
+
+from panflute import Div, RawBlock, RawInline
+
+# stands for the result of a pending conversion inside a text
+TOKEN = "\ue000{}\ue001"
+TOKEN_PATTERN = re.compile("\ue000(\\d+)\ue001")
+PLACEHOLDER_CLASS = "pandoc-styles-pending"
+PLACEHOLDER_PATTERN = re.compile(f"{PLACEHOLDER_CLASS}-(\\d+)")
+SEPARATOR = "PANDOC-STYLES-SNIPPET-{}"
+SEPARATOR_PATTERN = re.compile(r"^PANDOC-STYLES-SNIPPET-(\d+)$", re.MULTILINE)
+# a raw format panflute accepts, that is not used in markdown
+SEPARATOR_FORMAT = "native"
+# formats, whose writers pass a raw block in their own format through unchanged
+TEXT_FORMATS = ["html", "latex", "context", "markdown"]
+# markdown, that is read differently as part of a larger document: footnotes, link
+# references, headers (their identifiers), example lists, citations, metadata
+# blocks and latex macros
+UNSAFE_MARKDOWN = re.compile(
+    r"\[\^|^ {0,3}\[[^\]\n]+\]:|^ {0,3}#|\S[^\n]*\n {0,3}(=+|-+)[ \t]*$"
+    r"|^(---|\.\.\.)[ \t]*$|@|\\(re)?newcommand|\\def",
+    re.MULTILINE,
+)
+
+
+class Pending:
+    """A conversion, that is done at the end of the filter run"""
+
+    def __init__(self, number, source, input_format, output_format):
+        self.number = number
+        # markdown or, for the json input format, a list of blocks as json
+        self.source = source
+        self.input_format = input_format
+        self.output_format = output_format
+        self.result = None
+        self.done = False
+
+
+class SnippetBatch:
+    """
+    Collects the conversions of a filter run. Instead of the result, a conversion
+    returns a token (for text) or a placeholder Div (for elements). At the end of the
+    run, all conversions between the same formats are done in one pandoc call, with
+    separators between the snippets, and the tokens and placeholders in the document
+    are replaced by the results. A conversion may contain the tokens and
+    placeholders of earlier ones, these are resolved first.
+
+    Snippets, that pandoc would read differently inside a larger document, like
+    ones with footnotes, are converted one by one, as are all snippets of a batch,
+    whose separators don't come back in order.
+    """
+
+    def __init__(self, convert_text, api_version, cache=None):
+        self.convert_text = convert_text
+        self.api_version = list(api_version)
+        self.cache = cache
+        self.pending = []
+
+    def _add(self, source, input_format, output_format):
+        pending = Pending(len(self.pending), source, input_format, output_format)
+        self.pending.append(pending)
+        return pending
+
+    def text(self, text, output_format):
+        """Return a token for the markdown text converted to the output format"""
+        return TOKEN.format(self._add(text, "markdown", output_format).number)
+
+    def content_text(self, blocks, output_format):
+        """Return a token for the blocks converted to the output format"""
+        source = [block.to_json() for block in blocks]
+        return TOKEN.format(self._add(source, "json", output_format).number)
+
+    def elements(self, text):
+        """Return a placeholder for the markdown text converted to elements"""
+        number = self._add(text, "markdown", "panflute").number
+        return Div(
+            identifier=f"{PLACEHOLDER_CLASS}-{number}", classes=[PLACEHOLDER_CLASS]
+        )
+
+    def patch(self, doc):
+        """Do all pending conversions and put the results into the document"""
+        if not self.pending:
+            return
+        self.resolve()
+        doc.walk(self._patch_element)
+        self.pending = []
+
+    def resolve(self):
+        todo = [pending for pending in self.pending if not pending.done]
+        while todo:
+            groups = {}
+            for pending in todo:
+                # conversions only contain earlier ones, so there is always one ready
+                if all(self.pending[n].done for n in self._dependencies(pending)):
+                    pending.source = self._substitute(pending.source)
+                    key = (pending.input_format, pending.output_format)
+                    groups.setdefault(key, []).append(pending)
+            for group in groups.values():
+                self._convert_group(group)
+            todo = [pending for pending in todo if not pending.done]
+
+    def _dependencies(self, pending):
+        source = pending.source
+        if not isinstance(source, str):
+            source = json.dumps(source)
+        numbers = TOKEN_PATTERN.findall(source) + PLACEHOLDER_PATTERN.findall(source)
+        return [int(n) for n in numbers]
+
+    def _substitute(self, source):
+        """Replace tokens and placeholders in the source with their results"""
+        if isinstance(source, str):
+            return TOKEN_PATTERN.sub(lambda m: self.pending[int(m[1])].result, source)
+        if isinstance(source, list):
+            new = []
+            for item in source:
+                number = _placeholder_number(item)
+                if number is None:
+                    new.append(self._substitute(item))
+                else:
+                    new.extend(e.to_json() for e in self.pending[number].result)
+            return new
+        if isinstance(source, dict):
+            if source.get("t") in ["RawBlock", "RawInline"]:
+                fmt, text = source["c"]
+                return {"t": source["t"], "c": [fmt, self._substitute(text)]}
+            return {key: self._substitute(value) for key, value in source.items()}
+        return source
+
+    def _convert_group(self, group):
+        if self.cache is not None:
+            # convert_text looks into the cache as well, but only batches are
+            # converted here, so each snippet is looked up on its own
+            for pending in group:
+                key = self._cache_key(pending)
+                pending.result = self.cache.get(key, pending.output_format)
+                pending.done = pending.result is not None
+            group = [pending for pending in group if not pending.done]
+        batch = [pending for pending in group if _can_batch(pending)]
+        if len(batch) > 1:
+            self._convert_batch(batch)
+        for pending in group:
+            if not pending.done:
+                self._convert_one(pending)
+
+    def _convert_one(self, pending):
+        source = pending.source
+        if pending.input_format == "json":
+            source = self._document(source)
+        pending.result = self.convert_text(
+            source, pending.input_format, pending.output_format
+        )
+        pending.done = True
+
+    def _convert_batch(self, batch):
+        input_format = batch[0].input_format
+        output_format = batch[0].output_format
+        # text formats keep a raw block of their own format, json keeps all of them
+        if output_format == "panflute":
+            separator_format = SEPARATOR_FORMAT
+        else:
+            separator_format = output_format
+
+        if input_format == "json":
+            blocks = []
+            for i, pending in enumerate(batch):
+                if i:
+                    separator = [separator_format, SEPARATOR.format(i)]
+                    blocks.append({"t": "RawBlock", "c": separator})
+                blocks.extend(pending.source)
+            source = self._document(blocks)
+        else:
+            source = batch[0].source
+            for i, pending in enumerate(batch[1:], 1):
+                separator = f"```{{={separator_format}}}\n{SEPARATOR.format(i)}\n```"
+                source = f"{source}\n\n{separator}\n\n{pending.source}"
+
+        output = self.convert_text(source, input_format, output_format)
+        if output_format == "panflute":
+            results = _split_elements(output, len(batch))
+        else:
+            results = _split_text(output, len(batch))
+        if results is None:
+            logging.debug("Snippets could not be converted together, converting each.")
+            return
+        for pending, result in zip(batch, results):
+            pending.result = result
+            pending.done = True
+            if self.cache is not None:
+                self.cache.put(self._cache_key(pending), result)
+
+    def _cache_key(self, pending):
+        """The key of the snippet, as if it was converted on its own"""
+        source = pending.source
+        if pending.input_format == "json":
+            source = self._document(source)
+        return self.cache.key(
+            source, pending.input_format, pending.output_format, False, None, None
+        )
+
+    def _document(self, blocks):
+        return json.dumps(
+            {"pandoc-api-version": self.api_version, "meta": {}, "blocks": blocks}
+        )
+
+    def _patch_element(self, elem, doc):
+        if isinstance(elem, Div) and PLACEHOLDER_CLASS in elem.classes:
+            return list(self.pending[_placeholder_number(elem.to_json())].result)
+        if isinstance(elem, (RawBlock, RawInline)) and TOKEN_PATTERN.search(elem.text):
+            elem.text = self._substitute(elem.text)
+
+
+def _placeholder_number(item):
+    """Return the number of a placeholder Div given as json, else None"""
+    if not isinstance(item, dict) or item.get("t") != "Div":
+        return None
+    identifier, classes, _ = item["c"][0]
+    if classes != [PLACEHOLDER_CLASS]:
+        return None
+    return int(PLACEHOLDER_PATTERN.fullmatch(identifier)[1])
+
+
+def _can_batch(pending):
+    if pending.output_format not in TEXT_FORMATS + ["panflute"]:
+        return False
+    if pending.input_format == "json":
+        return '"t": "Note"' not in json.dumps(pending.source)
+    return not UNSAFE_MARKDOWN.search(pending.source)
+
+
+def _split_elements(elements, count):
+    """Split the converted elements at the separators"""
+    results = [[]]
+    for elem in elements:
+        if (
+            isinstance(elem, RawBlock)
+            and elem.format == SEPARATOR_FORMAT
+            and SEPARATOR_PATTERN.fullmatch(elem.text.strip())
+        ):
+            if elem.text.strip() != SEPARATOR.format(len(results)):
+                return None
+            results.append([])
+        else:
+            results[-1].append(elem)
+    return results if len(results) == count else None
+
+
+def _split_text(text, count):
+    """Split the converted text at the separators"""
+    # text, number, text, number, ..., text
+    parts = SEPARATOR_PATTERN.split(text)
+    if parts[1::2] != [str(i) for i in range(1, count)]:
+        return None
+    return [part.strip("\n") for part in parts[::2]]
@@ -0,0 +1,215 @@
+"""Style files with the inheritance of all styles resolved, cached on disk"""
+
+import json
+import logging
+from copy import deepcopy
+from os import stat
+from os.path import abspath, join
+
+from .cache import disk_cache, hash_parts
+from .constants import (
+    ALL_STYLE,
+    DEFAULT_STYLE,
+    MD_INHERITS,
+    MD_STYLE_PACKS,
+    STYLE_CACHE,
+)
+from .layered_config import LayeredConfig
+from .utils import get_pack_path, make_list, update_dict, yaml_load
+
+TABLE_VERSION = 2
+
+
+class StyleTable:
+    """
+    The styles of a style file with their inheritance and stylepacks resolved. A
+    style is resolved when it is looked up the first time. Tables are kept in memory
+    and, with --cache, on disk and reused as long as the style file and the
+    stylepack files it uses are unchanged. Looking up a style is then a dictionary
+    access instead of a recursive merge.
+    """
+
+    # compiled tables of this process by the absolute path of the style file
+    tables = {}
+
+    def __init__(self, style_file):
+        self.style_file = abspath(style_file)
+        self.names = []
+        self.styles = {}
+        self.stylepacks = {}
+        self.errors = {}
+        self.files = {}
+        self.packs = {}
+        self._raw = None
+
+    @classmethod
+    def load(cls, style_file):
+        """Return the compiled table of the style file"""
+        path = abspath(style_file)
+        table = cls.tables.get(path)
+        if table is None or not table.is_valid():
+            table = cls._from_cache(path)
+            if table is None:
+                table = cls(path)
+                table.names = list(table.raw)
+                table._store()
+            cls.tables[path] = table
+        return table
+
+    @classmethod
+    def _cache(cls):
+        return disk_cache(STYLE_CACHE)
+
+    @classmethod
+    def _cache_key(cls, path):
+        return hash_parts(str(TABLE_VERSION), path)
+
+    @classmethod
+    def _from_cache(cls, path):
+        cache = cls._cache()
+        data = cache.get(cls._cache_key(path)) if cache else None
+        if not data:
+            return None
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return None
+        if data.get("version") != TABLE_VERSION:
+            return None
+        table = cls(path)
+        for key in ["names", "styles", "stylepacks", "errors", "files", "packs"]:
+            setattr(table, key, data[key])
+        return table if table.is_valid() else None
+
+    def _store(self):
+        cache = self._cache()
+        if cache is None:
+            return
+        data = {
+            "version": TABLE_VERSION,
+            "names": self.names,
+            "styles": self.styles,
+            "stylepacks": self.stylepacks,
+            "errors": self.errors,
+            "files": self.files,
+            "packs": self.packs,
+        }
+        try:
+            data = json.dumps(data)
+        except (TypeError, ValueError):
+            # values yaml knows, but json does not (e.g. dates), are not cached
+            logging.debug(f"Could not cache the compiled styles of {self.style_file}")
+            return
+        cache.put(self._cache_key(self.style_file), data)
+
+    @staticmethod
+    def _file_state(path):
+        try:
+            st = stat(path)
+        except OSError:
+            return None
+        return [st.st_mtime_ns, st.st_size]
+
+    def is_valid(self):
+        """Check if the style file and all used stylepacks are unchanged"""
+        for path, state in self.files.items():
+            if self._file_state(path) != state:
+                return False
+        for pack, path in self.packs.items():
+            if abspath(join(get_pack_path(pack), f"{pack}.yaml")) != path:
+                return False
+        return True
+
+    @property
+    def raw(self):
+        """The styles as written in the style file"""
+        if self._raw is None:
+            self.files[self.style_file] = self._file_state(self.style_file)
+            self._raw = yaml_load(self.style_file) or {}
+        return self._raw
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def get(self, name):
+        """
+        Return the resolved style and the stylepacks it uses. A style, that can't
+        be resolved, raises a KeyError or a ValueError.
+        """
+        if name in self.styles:
+            return self.styles[name], self.stylepacks[name]
+        try:
+            result = self._get(name, ())
+        except (KeyError, ValueError) as e:
+            if name in self.names and name not in self.errors:
+                self.errors[name] = e.args[0] if e.args else repr(e)
+                self._store()
+            raise
+        self._store()
+        return result
+
+    def _get(self, name, chain):
+        if name in self.styles:
+            return self.styles[name], self.stylepacks[name]
+        if name in self.errors:
+            raise ValueError(self.errors[name])
+        if name in chain:
+            cycle = " -> ".join([*chain[chain.index(name) :], name])
+            raise ValueError(f"Inheritance cycle in {self.style_file}: {cycle}")
+        if name not in self.raw:
+            if chain:
+                raise KeyError(f"Style {chain[-1]} inherits unknown style {name}")
+            raise KeyError(f"Unknown style {name}")
+        style, used = self.resolve(deepcopy(self.raw[name]), (*chain, name))
+        self.styles[name] = style
+        self.stylepacks[name] = used
+        return style, used
+
+    def resolve(self, style, chain=()):
+        """
+        Resolve the inheritance and the stylepacks of the given (unnamed) style.
+        Return the new style and the stylepacks it uses. style may be changed.
+        """
+        stylepacks = style.get(MD_STYLE_PACKS)
+        inherited = make_list(style.get(MD_INHERITS, []))
+        used = []
+        if not inherited and not stylepacks:
+            return style, used
+
+        if stylepacks:
+            used.extend(self.stylepack_style(style, stylepacks))
+        new_style = LayeredConfig()
+        style.pop(MD_INHERITS, None)
+        for extra_style in inherited:
+            extra_style, extra_used = self._get(extra_style, chain)
+            new_style.push(extra_style)
+            used.extend(extra_used)
+        return new_style.push(style).materialize(), used
+
+    def stylepack_style(self, style, stylepacks):
+        """Merge the styles of the stylepacks into style. Return the used stylepacks"""
+        used = []
+        for stylepack in make_list(stylepacks):
+            if isinstance(stylepack, str):
+                used_styles = [DEFAULT_STYLE]
+                pack = stylepack
+            else:
+                for k, v in stylepack.items():
+                    pack = k
+                    used_styles = list(make_list(v))
+
+            pack_file = abspath(join(get_pack_path(pack), f"{pack}.yaml"))
+            used.append(pack)
+            self.packs[pack] = pack_file
+            pack_table = StyleTable.load(pack_file)
+            self.files.update(pack_table.files)
+            self.packs.update(pack_table.packs)
+
+            if ALL_STYLE in pack_table and pack_table.get(ALL_STYLE)[0]:
+                used_styles.insert(0, ALL_STYLE)
+
+            for s in used_styles:
+                pack_style, pack_used = pack_table.get(s)
+                update_dict(style, pack_style)
+                used.extend(pack_used)
+        return used
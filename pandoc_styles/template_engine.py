@@ -0,0 +1,65 @@
+"""Apply add-to-template and replace-in-template to a template in one pass"""
+
+import re
+from functools import lru_cache
+
+from .cache import disk_cache, hash_parts
+from .constants import TEMPLATE_CACHE
+from .utils import make_list
+
+HEADER_INCLUDES = r"(\$for\(header-includes\)\$\n\$header-includes\$\n\$endfor\$)"
+
+
+@lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    """Return the compiled pattern, compiled only once per process"""
+    return re.compile(pattern, re.DOTALL)
+
+
+def make_replacement(repl, add=False):
+    """Turn the replacement text of a style into a replacement for re.sub"""
+    repl = "\n".join(item for item in make_list(repl))
+    repl = repl.replace("\\", "\\\\")
+    return rf"{repl}\n\1" if add else repl
+
+
+class TemplateEngine:
+    """
+    Applies a list of operations (pattern, replacement, add, count) to a template.
+    The operations run in the given order on the template in memory. Results are
+    cached in memory and, with --cache, on disk by the template and the operations,
+    so the same style applied to the same template is only transformed once.
+    """
+
+    # transformed templates of this process by cache key
+    templates = {}
+
+    def __init__(self, operations):
+        self.operations = [
+            (pattern, make_replacement(repl, add), count)
+            for pattern, repl, add, count in operations
+        ]
+
+    def cache_key(self, template):
+        parts = [template]
+        for pattern, repl, count in self.operations:
+            parts.extend([pattern, repl, str(count)])
+        return hash_parts(*parts)
+
+    def apply(self, template):
+        """Return the transformed template"""
+        key = self.cache_key(template)
+        result = self.templates.get(key)
+        if result is not None:
+            return result
+
+        cache = disk_cache(TEMPLATE_CACHE)
+        result = cache.get(key) if cache else None
+        if result is None:
+            result = template
+            for pattern, repl, count in self.operations:
+                result = compile_pattern(pattern).sub(repl, result, count)
+            if cache:
+                cache.put(key, result)
+        self.templates[key] = result
+        return result
@@ -1,18 +1,42 @@
 """Some utility functions"""
 
+import json
 import logging
 import os
 import shlex
+import shutil
 import subprocess
 import sys
+import threading
+import time
 from contextlib import contextmanager
+from copy import deepcopy
 from os import chdir, getcwd
 from os.path import isdir, isfile, join, normpath, split, splitext
 
 from ruamel.yaml import YAML
 from ruamel.yaml.compat import StringIO
+from ruamel.yaml.constructor import ConstructorError
 
-from .constants import CONFIG_DIR, PATH_MISC, PATH_STYLE, USER_DIR_PREFIX
+from .constants import (
+    CONFIG_DIR,
+    PATH_MISC,
+    PATH_STYLE,
+    USER_DIR_PREFIX,
+)
+from .layered_config import merge_into
+from .profiler import add_subprocess_time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# yaml loaders by kind, one set per thread
+_yaml_loaders = threading.local()
+# processes started by run_process by the thread, that waits for them
+_children = {}
+_children_lock = threading.Lock()
 
 
 def file_read(file_name, *path, encoding="utf-8"):
@@ -34,6 +58,34 @@ def file_write(file_name, string, *path, mode="w", encoding="utf-8"):
     return file_name
 
 
+# ioctl to clone a file on copy on write file systems (Linux)
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+
+def _reflink(source, target):
+    """Clone source into target, return False if the file system can't"""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        return False
+    return True
+
+
+def copy_file(source, target):
+    """
+    Copy source to target like shutil.copy and return target. On file systems with
+    copy on write (btrfs, xfs, ...) the copy is a reflink, which shares the data
+    with the source until one of them is changed.
+    """
+    if _reflink(source, target):
+        shutil.copymode(source, target)
+        return target
+    return shutil.copy(source, target)
+
+
 class _StringYAML(YAML):
     def dump(self, data, stream=None, **kw):  # pylint: disable=arguments-differ
         as_string = False
@@ -45,14 +97,34 @@ class _StringYAML(YAML):
             return stream.getvalue()
 
 
-def yaml_load(source, is_string=False):
+def _yaml_loader(round_trip=False):
+    """
+    Return the yaml loader of this thread, as ruamel instances are not thread safe.
+    The safe loader uses libyaml if ruamel.yaml.clib is installed and pure python
+    otherwise; the round trip loader keeps comments and the layout.
+    """
+    kind = "round_trip" if round_trip else "safe"
+    yaml = getattr(_yaml_loaders, kind, None)
+    if yaml is None:
+        yaml = YAML() if round_trip else YAML(typ="safe")
+        setattr(_yaml_loaders, kind, yaml)
+    return yaml
+
+
+def yaml_load(source, is_string=False, round_trip=False):
     """Return a dictionary with the content of the yaml in the source file.
-    If a string should be loaded, set is_string to True"""
-    yaml = YAML()
-    if is_string:
-        return yaml.load(source)
-    with open(source, encoding="utf-8") as s:
-        return yaml.load(s)
+    If a string should be loaded, set is_string to True. Set round_trip, if the
+    yaml is written back and its comments should be kept."""
+    if not is_string:
+        with open(source, encoding="utf-8") as s:
+            source = s.read()
+    try:
+        return _yaml_loader(round_trip).load(source)
+    except ConstructorError:
+        if round_trip:
+            raise
+        # tags, the safe loader doesn't know
+        return _yaml_loader(round_trip=True).load(source)
 
 
 def yaml_dump(doc, target=None, transform=None):
@@ -72,10 +144,31 @@ def yaml_dump_pandoc_md(doc, target=None):
     return yaml_dump(doc, target, lambda s: f"---\n{s}---\n")
 
 
+def json_dump(doc, target=None):
+    """Dump to the target file as json. If target is None, return the json as a
+    String. Otherwise return the path to the file. Values json doesn't know, like
+    dates, are written as strings."""
+    text = json.dumps(doc, ensure_ascii=False, default=str)
+    if target is None:
+        return text
+    return file_write(target, text)
+
+
+def terminate_children(thread):
+    """Terminate the processes started with run_process by thread, that still run"""
+    with _children_lock:
+        processes = list(_children.get(thread.ident, ()))
+    for process in processes:
+        if process.poll() is None:
+            process.terminated = True
+            process.terminate()
+
+
 def run_process(args, get_output=False, shell=False):
     """
     Run a process with the given args.
     If get_output is true, return the subprocess.
+    The process can be stopped from another thread with terminate_children.
     """
     args = args if (shell or isinstance(args, list)) else shlex.split(args)
     env = None
@@ -83,26 +176,40 @@ def run_process(args, get_output=False, shell=False):
         venv_bin, _ = os.path.split(sys.executable)
         env = os.environ
         env["PATH"] = venv_bin + os.pathsep + env["PATH"]
+    output = {}
+    if get_output:
+        output = {
+            "stdout": subprocess.PIPE,
+            "stderr": subprocess.STDOUT,
+            "universal_newlines": True,
+            "encoding": "utf-8",
+        }
+    start = time.perf_counter()
     try:
+        with subprocess.Popen(args, shell=shell, env=env, **output) as process:
+            thread = threading.get_ident()
+            with _children_lock:
+                _children.setdefault(thread, set()).add(process)
+            try:
+                stdout, _ = process.communicate()
+            finally:
+                with _children_lock:
+                    _children[thread].discard(process)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args, stdout)
         if get_output:
-            pc = subprocess.run(
-                args,
-                check=True,
-                shell=shell,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                encoding="utf-8",
-                env=env,
-            )
-            return pc
-        subprocess.run(args, check=True, shell=shell, env=env)
+            return subprocess.CompletedProcess(args, process.returncode, stdout)
     except subprocess.CalledProcessError:
-        logging.error(f"{args} failed!")
+        if getattr(process, "terminated", False):
+            logging.debug(f"{args} was terminated")
+        else:
+            logging.error(f"{args} failed!")
         raise
     except FileNotFoundError:
         logging.error(f"{args} not found!")
         raise
+    finally:
+        add_subprocess_time(time.perf_counter() - start)
 
 
 def get_full_file_name(path):
@@ -131,6 +238,15 @@ def has_extension(ffile, extensions):
     return False
 
 
+def update_dict(dictionary, new):
+    """
+    Merge dictionary with new. Single keys are replaced, but nested dictionaries
+    and list are appended
+    """
+    # we deepcopy new once, so that it stays independent from the source
+    merge_into(dictionary, deepcopy(new))
+
+
 def make_list(item):
     """Make a list with item as its member, if item isn't a list already"""
     return item if isinstance(item, list) else [item]
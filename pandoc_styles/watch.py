@@ -0,0 +1,185 @@
+"""Rebuild the formats of a document when one of its inputs changes"""
+
+import logging
+import threading
+import time
+from os import listdir, stat
+from os.path import isdir, join
+
+from .constants import (
+    CONFIG_DIR,
+    FMT,
+    MD_POSTFLIGHT,
+    MD_PREFLIGHT,
+    MD_SASS,
+    MD_SASS_FILES,
+    MD_TEMPLATE,
+    PATH_SASS,
+)
+from .utils import get_pack_path, make_list, terminate_children
+
+
+class BuildCancelled(Exception):
+    """Raised inside a build, that was superseded by a newer change"""
+
+
+class Watcher:
+    """
+    Watches the sources, the style file, the sass files and the filter and flight
+    scripts of a document and rebuilds the affected formats on changes.
+
+    make_styles is called to create the PandocStyles object. It is only called
+    again, if the sources or the styles changed, so that the resolved style and
+    the compiled css are kept between builds.
+    """
+
+    def __init__(self, make_styles, interval=0.5, debounce=0.3):
+        self.make_styles = make_styles
+        self.interval = interval
+        self.debounce = debounce
+        self.ps = None
+        self.mtimes = {}
+        self.dependencies = {}
+        self.reload = False
+        self.build_thread = None
+        self.cancel_event = None
+        self.building = []
+
+    def run(self):
+        """Build all formats, then rebuild on changes until interrupted"""
+        self._load()
+        self._start_build(list(self.ps.formats))
+        logging.info("Watching for changes. Press Ctrl+C to stop.")
+        pending = set()
+        last_change = None
+        try:
+            while True:
+                time.sleep(self.interval)
+                changed = self._changed_files()
+                if changed:
+                    pending.update(changed)
+                    last_change = time.monotonic()
+                    continue
+                if pending and time.monotonic() - last_change >= self.debounce:
+                    self._rebuild(pending)
+                    pending = set()
+        except KeyboardInterrupt:
+            if self.cancel_event:
+                self.cancel_event.set()
+            if self.build_thread:
+                terminate_children(self.build_thread)
+
+    def _load(self):
+        """(Re)create the PandocStyles object and collect the watched files"""
+        self.ps = self.make_styles()
+        self.ps.make_target_dir()
+        self.dependencies = self._get_dependencies()
+        self.mtimes = {path: self._mtime(path) for path in self.dependencies}
+
+    def _get_dependencies(self):
+        """
+        Return a dictionary of watched files and the formats they affect. None
+        means, that the PandocStyles object has to be reloaded.
+        """
+        ps = self.ps
+        dependencies = {}
+        reload_files = list(ps.source_files) + [ps.style_file]
+        if ps.metadata:
+            reload_files.append(ps.metadata)
+        reload_files.extend(
+            join(get_pack_path(pack), f"{pack}.yaml") for pack in ps.used_stylepacks
+        )
+        for path in reload_files:
+            dependencies[path] = None
+
+        sass_dir = join(CONFIG_DIR, PATH_SASS)
+        sass_lib = (
+            [join(sass_dir, f) for f in listdir(sass_dir)] if isdir(sass_dir) else []
+        )
+        for fmt in ps.formats:
+            cfg = ps._get_cfg(fmt)
+            files = []
+            if MD_SASS in cfg:
+                files.extend(sass_lib)
+                files.extend(
+                    ps.expand_dirs(f, MD_SASS)
+                    for f in make_list(cfg[MD_SASS].get(MD_SASS_FILES, []))
+                )
+            for key in ["filter", MD_PREFLIGHT, MD_POSTFLIGHT, MD_TEMPLATE]:
+                files.extend(
+                    ps.expand_dirs(item, key)
+                    for item in make_list(cfg.get(key) or [])
+                    if isinstance(item, str)
+                )
+            for path in files:
+                if dependencies.get(path, ()) is not None:
+                    dependencies.setdefault(path, set()).add(cfg[FMT])
+        return dependencies
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _changed_files(self):
+        changed = set()
+        for path, mtime in self.mtimes.items():
+            new_mtime = self._mtime(path)
+            if new_mtime != mtime:
+                self.mtimes[path] = new_mtime
+                changed.add(path)
+        return changed
+
+    def _rebuild(self, changed):
+        """Rebuild the formats affected by the changed files"""
+        logging.info(f"Changed: {', '.join(sorted(changed))}")
+        formats = set()
+        for path in changed:
+            if self.dependencies[path] is None:
+                self.reload = True
+                formats.update(self.ps.formats)
+            else:
+                formats.update(self.dependencies[path])
+
+        # a newer change supersedes the running build, but its formats are kept
+        if self.build_thread and self.build_thread.is_alive():
+            self.cancel_event.set()
+            terminate_children(self.build_thread)
+            self.build_thread.join()
+            formats.update(self.building)
+
+        if self.reload:
+            try:
+                self._load()
+            except Exception as e:
+                logging.error(f"Failed to load the document or the styles: {e!r}")
+                self.building = list(formats)
+                return
+            self.reload = False
+        self._start_build([fmt for fmt in self.ps.formats if fmt in formats])
+
+    def _start_build(self, formats):
+        self.cancel_event = threading.Event()
+        self.ps.cancel_event = self.cancel_event
+        self.building = list(formats)
+        self.build_thread = threading.Thread(
+            target=self._build, args=(formats, self.cancel_event), daemon=True
+        )
+        self.build_thread.start()
+
+    def _build(self, formats, cancel_event):
+        for fmt in formats:
+            if cancel_event.is_set():
+                return
+            try:
+                self.ps.make_format(fmt)
+            except BuildCancelled:
+                logging.info(f"Cancelled the build of {fmt}")
+                return
+            except SystemExit:
+                pass
+            except Exception as e:
+                logging.error(f"Failed to build {fmt}: {e!r}")
+            self.building.remove(fmt)
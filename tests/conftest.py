@@ -0,0 +1,92 @@
+"""
+pandoc_styles finds its configuration folder on import, so HOME points to an
+empty temporary folder before any test imports it.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+HOME = tempfile.mkdtemp(prefix="pandoc_styles_tests_")
+os.environ["HOME"] = os.environ["USERPROFILE"] = HOME
+
+# writes the text of its inputs to the output: markdown as it is, json inputs as
+# the text of their raw blocks. -t json wraps the text into one raw block.
+STUB = """#!{python}
+import json
+import os
+import sys
+
+args = sys.argv[1:]
+with open(os.environ["PANDOC_STUB_LOG"], "a", encoding="utf-8") as f:
+    f.write(json.dumps(args) + "\\n")
+if "--version" in args:
+    print("pandoc 3.1.9\\nFeatures: +lua")
+    sys.exit()
+if "-D" in args:
+    print("$body$")
+    sys.exit()
+if any(arg.startswith("--print-default-data-file") for arg in args):
+    sys.exit()
+output, to, inputs = None, None, []
+i = 0
+while i < len(args):
+    arg = args[i]
+    if arg in ("-o", "-t", "-M", "-V", "--read", "-f"):
+        if arg == "-o":
+            output = args[i + 1]
+        elif arg == "-t":
+            to = args[i + 1]
+        i += 2
+        continue
+    if not arg.startswith("-") and not arg.endswith((".yaml", ".yml")):
+        inputs.append(arg)
+    i += 1
+text = ""
+for path in inputs:
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    if path.endswith(".json"):
+        blocks = json.loads(content)["blocks"]
+        content = "".join(b["c"][1] for b in blocks if b["t"] == "RawBlock")
+    text += content
+if to == "json":
+    block = {{"t": "RawBlock", "c": ["markdown", text]}}
+    text = json.dumps(
+        {{"pandoc-api-version": [1, 23, 1], "meta": {{}}, "blocks": [block]}}
+    )
+with open(output, "w", encoding="utf-8") as f:
+    f.write(text)
+"""
+
+
+class StubPandoc:
+    """A stand-in for pandoc first on the PATH, that logs the arguments of calls"""
+
+    def __init__(self, folder):
+        self.log = folder / "calls.log"
+        self.path = folder / "pandoc"
+        self.path.write_text(STUB.format(python=sys.executable), encoding="utf-8")
+        self.path.chmod(0o755)
+
+    def calls(self):
+        if not self.log.exists():
+            return []
+        with open(self.log, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def stub_pandoc(tmp_path, monkeypatch):
+    from pandoc_styles import pandoc_data  # only after HOME is set
+
+    folder = tmp_path / "stub"
+    folder.mkdir()
+    stub = StubPandoc(folder)
+    monkeypatch.setenv("PATH", f"{folder}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("PANDOC_STUB_LOG", str(stub.log))
+    monkeypatch.setattr(pandoc_data, "pandoc_outputs", {})
+    return stub
@@ -0,0 +1,212 @@
+import os
+from os.path import isdir, join
+
+import pytest
+
+from pandoc_styles import cache as cache_module
+from pandoc_styles import pandoc_data, sass_compiler
+from pandoc_styles.constants import (
+    BUILD_CACHE,
+    CACHE_ENV,
+    PANDOC_CACHE,
+    SASS_CACHE,
+    STYLE_CACHE,
+    TEMPLATE_CACHE,
+)
+from pandoc_styles.main import PandocStyles
+from pandoc_styles.style_table import StyleTable
+from pandoc_styles.template_engine import TemplateEngine
+
+STYLES = """\
+All:
+  all:
+    toc: true
+Default:
+  html:
+    standalone: true
+"""
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    """Point the configuration folder to a folder, that doesn't exist yet"""
+    folder = str(tmp_path / "config")
+    monkeypatch.setattr(cache_module, "CONFIG_DIR", folder)
+    monkeypatch.delenv(CACHE_ENV, raising=False)
+    monkeypatch.setattr(StyleTable, "tables", {})
+    return folder
+
+
+@pytest.fixture
+def style_file(tmp_path):
+    path = tmp_path / "styles.yaml"
+    path.write_text(STYLES, encoding="utf-8")
+    return str(path)
+
+
+def test_disk_cache_only_with_cache_flag(config_dir, monkeypatch):
+    assert cache_module.disk_cache("test") is None
+    monkeypatch.setenv(CACHE_ENV, "1")
+    assert cache_module.disk_cache("test").name == "test"
+
+
+def test_style_table_does_not_create_the_config_dir(config_dir, style_file):
+    table = StyleTable.load(style_file)
+    assert table.get("All")[0] == {"all": {"toc": True}}
+    assert not isdir(config_dir)
+
+
+def test_style_table_needs_the_cache_flag(config_dir, style_file):
+    os.makedirs(config_dir)
+    StyleTable.load(style_file).get("All")
+    assert cache_module.FileCache(STYLE_CACHE).stats()[0] == 0
+
+
+def test_style_table_with_cache_flag(config_dir, style_file, monkeypatch):
+    monkeypatch.setenv(CACHE_ENV, "1")
+    StyleTable.load(style_file).get("Default")
+    assert cache_module.FileCache(STYLE_CACHE).stats()[0] == 1
+    # a new process finds the resolved style in the cache
+    monkeypatch.setattr(StyleTable, "tables", {})
+    table = StyleTable.load(style_file)
+    assert table.styles == {"Default": {"html": {"standalone": True}}}
+    assert table._raw is None
+
+
+def test_style_table_resolves_lazily(config_dir, tmp_path, caplog):
+    path = tmp_path / "styles.yaml"
+    path.write_text(
+        "Used:\n  inherits: Base\n  html:\n    toc: true\n"
+        "Base:\n  html:\n    standalone: true\n"
+        "Broken:\n  inherits: Missing\n",
+        encoding="utf-8",
+    )
+    table = StyleTable.load(str(path))
+    assert "Broken" in table
+    assert table.get("Used")[0] == {"html": {"standalone": True, "toc": True}}
+    assert set(table.styles) == {"Used", "Base"}
+    assert not caplog.records
+    with pytest.raises(KeyError):
+        table.get("Broken")
+
+
+def test_unwritable_cache_is_skipped(tmp_path, monkeypatch, style_file):
+    # a file in place of the configuration folder makes every write fail
+    blocker = tmp_path / "config"
+    blocker.write_text("", encoding="utf-8")
+    monkeypatch.setattr(cache_module, "CONFIG_DIR", join(blocker, "sub"))
+    monkeypatch.setattr(StyleTable, "tables", {})
+    monkeypatch.setenv(CACHE_ENV, "1")
+    cache = cache_module.FileCache("test")
+    cache.put("ab" * 32, "text")
+    cache.put_file("ab" * 32, style_file)
+    assert cache.get("ab" * 32) is None
+    assert StyleTable.load(style_file).get("Default")
+
+
+def test_sass_cache_only_with_cache_flag(config_dir, monkeypatch):
+    monkeypatch.setattr(sass_compiler, "compiled_css", {})
+    assert "color: red" in sass_compiler.compile_sass("a { color: red; }", [])
+    assert not isdir(config_dir)
+
+    monkeypatch.setattr(sass_compiler, "compiled_css", {})
+    monkeypatch.setenv(CACHE_ENV, "1")
+    sass_compiler.compile_sass("a { color: red; }", [])
+    assert cache_module.FileCache(SASS_CACHE).stats()[0] == 1
+
+
+def test_pandoc_cache_only_with_cache_flag(config_dir, tmp_path, monkeypatch):
+    pandoc = tmp_path / "bin" / "pandoc"
+    pandoc.parent.mkdir()
+    pandoc.write_text("#!/bin/sh\necho template\n", encoding="utf-8")
+    pandoc.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{pandoc.parent}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(pandoc_data, "pandoc_outputs", {})
+    assert pandoc_data.default_template("html").strip() == "template"
+    assert not isdir(config_dir)
+
+    monkeypatch.setattr(pandoc_data, "pandoc_outputs", {})
+    monkeypatch.setenv(CACHE_ENV, "1")
+    pandoc_data.default_template("html")
+    assert cache_module.FileCache(PANDOC_CACHE).stats()[0] == 1
+
+
+def test_template_cache_only_with_cache_flag(config_dir, monkeypatch):
+    operations = [("(<body>)", "<main>", True, 1)]
+    monkeypatch.setattr(TemplateEngine, "templates", {})
+    assert TemplateEngine(operations).apply("<body>") == "<main>\n<body>"
+    assert not isdir(config_dir)
+
+    monkeypatch.setattr(TemplateEngine, "templates", {})
+    monkeypatch.setenv(CACHE_ENV, "1")
+    TemplateEngine(operations).apply("<body>")
+    assert cache_module.FileCache(TEMPLATE_CACHE).stats()[0] == 1
+
+
+def test_get_file_copies_the_entry(config_dir, tmp_path):
+    source = tmp_path / "out.html"
+    source.write_text("output", encoding="utf-8")
+    cache = cache_module.FileCache("test")
+    cache.put_file("ab" * 32, str(source))
+    target = tmp_path / "copy.html"
+    target.write_text("old", encoding="utf-8")
+    assert cache.get_file("ab" * 32, str(target))
+    assert target.read_text(encoding="utf-8") == "output"
+    assert os.stat(target).st_nlink == 1
+    # changing the output must not change the cache
+    target.write_text("changed", encoding="utf-8")
+    assert cache.get_file("ab" * 32, str(source))
+    assert source.read_text(encoding="utf-8") == "output"
+
+
+def test_get_file_misses(config_dir, tmp_path):
+    target = tmp_path / "out.html"
+    assert not cache_module.FileCache("test").get_file("ab" * 32, str(target))
+    assert not target.exists()
+
+
+@pytest.fixture
+def cached_build(config_dir, tmp_path, stub_pandoc):
+    """Return a function, that builds html with the build cache and the style"""
+    source = tmp_path / "doc.md"
+    source.write_text("text\n", encoding="utf-8")
+    template = tmp_path / "template.html"
+    template.write_text("$body$", encoding="utf-8")
+    style_file = tmp_path / "styles.yaml"
+
+    def build(template_text="$body$", toc_depth=2):
+        """Build and return the number of conversions pandoc ran"""
+        template.write_text(template_text, encoding="utf-8")
+        style_file.write_text(
+            f"Test:\n  html:\n    template: {template}\n    toc-depth: {toc_depth}\n",
+            encoding="utf-8",
+        )
+        before = len([c for c in stub_pandoc.calls() if "-o" in c])
+        PandocStyles(
+            [str(source)],
+            ["html"],
+            use_styles=["Test"],
+            target=str(tmp_path / "out"),
+            style_file=str(style_file),
+            use_cache=True,
+        ).run()
+        assert (tmp_path / "out" / "doc.html").read_text(encoding="utf-8") == "text\n"
+        return len([c for c in stub_pandoc.calls() if "-o" in c]) - before
+
+    return build
+
+
+def test_build_cache_hit(cached_build):
+    assert cached_build() == 1
+    assert cached_build() == 0
+    assert cache_module.FileCache(BUILD_CACHE).stats()[0] == 1
+
+
+def test_build_cache_misses_on_a_changed_template(cached_build):
+    assert cached_build() == 1
+    assert cached_build(template_text="<main>$body$</main>") == 1
+
+
+def test_build_cache_misses_on_a_changed_option(cached_build):
+    assert cached_build() == 1
+    assert cached_build(toc_depth=3) == 1
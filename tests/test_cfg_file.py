@@ -0,0 +1,114 @@
+import datetime
+import json
+import os
+
+import pytest
+
+from pandoc_styles import cfg_file
+from pandoc_styles.cfg_file import cfg_generation, load_cfg, save_cfg
+from pandoc_styles.utils import yaml_dump, yaml_load
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cfg.json")
+
+
+def test_save_and_load(path):
+    cfg = {"fmt": "html", "list": [1, 2], "nested": {"a": True}}
+    assert save_cfg(cfg, path)
+    assert load_cfg(path) == cfg
+    assert cfg_generation(path) == 1
+
+
+def test_the_file_is_a_plain_cfg(path):
+    save_cfg({"fmt": "html"}, path)
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"fmt": "html"}
+
+
+def test_generation_grows_only_with_changes(path):
+    assert cfg_generation(path) == 0
+    save_cfg({"a": 1}, path)
+    assert not save_cfg({"a": 1}, path)
+    assert cfg_generation(path) == 1
+    assert save_cfg({"a": 2}, path)
+    assert cfg_generation(path) == 2
+
+
+def test_load_returns_copies(path):
+    save_cfg({"a": [1]}, path)
+    load_cfg(path)["a"].append(2)
+    assert load_cfg(path) == {"a": [1]}
+
+
+def test_load_sees_a_rewrite_of_another_process(path):
+    save_cfg({"a": 1}, path)
+    assert load_cfg(path) == {"a": 1}
+    # same size and mtime, only the generation tells the change
+    mtime = os.stat(path).st_mtime_ns
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"a": 2}')
+    os.utime(path, ns=(mtime, mtime))
+    with open(f"{path}{cfg_file.GENERATION_SUFFIX}", "w", encoding="utf-8") as f:
+        f.write('{"version": 1, "generation": 2}')
+    assert load_cfg(path) == {"a": 2}
+
+
+def test_newer_format_is_rejected(path):
+    save_cfg({"a": 1}, path)
+    with open(f"{path}{cfg_file.GENERATION_SUFFIX}", "w", encoding="utf-8") as f:
+        f.write('{"version": 99, "generation": 2}')
+    cfg_file._files.clear()
+    with pytest.raises(ValueError):
+        load_cfg(path)
+
+
+def test_json_types(path):
+    save_cfg({"date": datetime.date(2024, 1, 31), "keys": {1: "one"}}, path)
+    cfg_file._files.clear()
+    assert load_cfg(path) == {"date": "2024-01-31", "keys": {"1": "one"}}
+
+
+def test_yaml_cfg(tmp_path):
+    path = str(tmp_path / "cfg.yaml")
+    assert save_cfg({"fmt": "pdf"}, path)
+    assert load_cfg(path) == {"fmt": "pdf"}
+
+
+CFG = {
+    "fmt": "html",
+    "output-file": "/out/doc.html",
+    "current-files": ["/tmp/a b.md", "/tmp/ü.md"],
+    "metadata": {"title": 'A "quoted" title: with colon', "lang": "de"},
+    "command-line": {"toc": True, "toc-depth": 2, "css": ["a.css", "b.css"]},
+    "replace-in-output": [{"pattern": "\\n\\s+</body>", "count": 0}],
+    "add-to-template": ["line one\nline two\n"],
+    "empty": None,
+    "ratio": 0.5,
+}
+
+
+def test_round_trip_like_the_yaml_file(tmp_path, path):
+    """The cfg a filter reads is the one it read from the cfg.yaml before"""
+    yaml_path = str(tmp_path / "cfg.yaml")
+    yaml_dump(CFG, yaml_path)
+    save_cfg(CFG, path)
+    cfg_file._files.clear()
+    assert load_cfg(path) == yaml_load(yaml_path) == CFG
+
+
+def test_round_trip_through_a_filter(path):
+    """A filter process changes the cfg, the build reads the change back"""
+    save_cfg(CFG, path)
+    # the filter runs in another process, without the parsed files of this one
+    build_files = dict(cfg_file._files)
+    cfg_file._files.clear()
+    cfg = load_cfg(path)
+    cfg["metadata"]["title"] = "changed"
+    assert save_cfg(cfg, path)
+
+    cfg_file._files.clear()
+    cfg_file._files.update(build_files)
+    assert load_cfg(path) == cfg
+    assert cfg_generation(path) == 2
@@ -0,0 +1,94 @@
+import panflute as pf
+import pytest
+
+from pandoc_styles import filter_host
+from pandoc_styles.filter import PandocStylesFilter, TransformFilter
+
+
+def make_doc():
+    return pf.Doc(
+        pf.Div(pf.Para(pf.Str("a")), classes=["x"]),
+        pf.Div(pf.Para(pf.Str("b")), classes=["y"]),
+        pf.CodeBlock("c", classes=["x", "y"]),
+        pf.Para(pf.Span(pf.Str("d"), classes=["x"]), pf.Emph(pf.Str("e"))),
+        pf.Header(pf.Str("f"), classes=["x"]),
+        pf.Div(pf.Div(pf.Para(pf.Str("g")), classes=["x"])),
+        format="html",
+    )
+
+
+def old_check(elem, filter_types, tags):
+    """The check of every element before the dispatch was precomputed"""
+    return (not filter_types or any(isinstance(elem, x) for x in filter_types)) and (
+        not tags or any(x in tags for x in elem.classes)
+    )
+
+
+def run(pandoc_filter, monkeypatch):
+    monkeypatch.setattr(filter_host, "hosted_doc", make_doc())
+    pandoc_filter.run()
+
+
+@pytest.mark.parametrize(
+    "filter_types, tags",
+    [
+        ([pf.Div], ["x"]),
+        ([pf.Div, pf.CodeBlock], []),
+        ([pf.Div, pf.Span, pf.CodeBlock, pf.Header], ["x", "y"]),
+        ([pf.Para, pf.Emph], []),
+    ],
+)
+@pytest.mark.parametrize("filter_class", ["PandocStylesFilter", "TransformFilter"])
+def test_dispatch_calls_the_same_handlers(
+    monkeypatch, filter_types, tags, filter_class
+):
+    expected = []
+    make_doc().walk(
+        lambda elem, doc: (
+            expected.append(elem.to_json())
+            if old_check(elem, filter_types, tags)
+            else None
+        )
+    )
+    called = []
+
+    def handler(self):
+        called.append(self.elem.to_json())
+
+    if filter_class == "PandocStylesFilter":
+        pandoc_filter = PandocStylesFilter(handler, filter_types, tags)
+    else:
+        pandoc_filter = TransformFilter(tags, handler, filter_types=filter_types)
+    run(pandoc_filter, monkeypatch)
+    assert called == expected
+    assert expected
+
+
+def test_custom_check_sees_every_element(monkeypatch):
+    checked = []
+
+    class Filter(PandocStylesFilter):
+        def check(self):
+            checked.append(type(self.elem))
+            return False
+
+    run(Filter(lambda self: None, [pf.Div], ["x"]), monkeypatch)
+    visited = []
+    make_doc().walk(lambda elem, doc: visited.append(type(elem)))
+    assert checked == visited
+
+
+def test_subclass_without_init(monkeypatch):
+    class Filter(PandocStylesFilter):
+        # pylint: disable=super-init-not-called
+        def __init__(self):
+            self.filter_types = [pf.CodeBlock]
+            self.tags = []
+
+        def func(self):
+            return f"code: {self.elem.text}"
+
+    monkeypatch.setattr(filter_host, "hosted_doc", make_doc())
+    monkeypatch.setattr("pandoc_styles.filter.convert_text", lambda text: [pf.Para()])
+    Filter().run()
+    assert sum(isinstance(e, pf.CodeBlock) for e in filter_host.hosted_doc.content) == 0
@@ -0,0 +1,86 @@
+import io
+import json
+import os
+import subprocess
+import sys
+from os.path import abspath, dirname
+
+import panflute as pf
+
+from pandoc_styles import filter_host
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+BOX = """\
+import panflute as pf
+from pandoc_styles import run_transform_filter
+
+run_transform_filter(
+    ["box"], html=lambda self: [pf.Para(pf.Str("box:"))] + list(self.content)
+)
+"""
+
+UPPER = """\
+from pandoc_styles import Str, run_pandoc_styles_filter
+
+
+def upper(self):
+    self.elem.text = self.elem.text.upper()
+
+
+run_pandoc_styles_filter(upper, Str)
+"""
+
+
+def document():
+    doc = pf.Doc(
+        pf.Div(pf.Para(pf.Str("one")), classes=["box"]),
+        pf.Para(pf.Str("two")),
+        format="html",
+    )
+    with io.StringIO() as f:
+        pf.dump(doc, f)
+        return f.getvalue()
+
+
+def scripts(tmp_path):
+    paths = []
+    for name, text in [("box.py", BOX), ("upper.py", UPPER)]:
+        path = tmp_path / name
+        path.write_text(text, encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+def run_alone(script, text):
+    """Run the filter like pandoc does without the host"""
+    return subprocess.run(
+        [sys.executable, script, "html"],
+        input=text,
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": ROOT},
+    ).stdout
+
+
+def test_hosted_filters_give_the_same_document(tmp_path, monkeypatch):
+    paths = scripts(tmp_path)
+    text = document()
+    for path in paths:
+        text = run_alone(path, text)
+
+    monkeypatch.setattr(sys, "argv", ["filter_host", "html"])
+    output = io.StringIO()
+    filter_host.main(paths, io.StringIO(document()), output)
+    assert json.loads(output.getvalue()) == json.loads(text)
+    assert "BOX:" in text
+
+
+def test_wrapper_runs_the_filters_like_the_host(tmp_path):
+    paths = scripts(tmp_path)
+    wrapper = filter_host.write_wrapper(str(tmp_path / "host.py"), paths)
+    text = document()
+    for path in paths:
+        text = run_alone(path, text)
+    assert json.loads(run_alone(wrapper, document())) == json.loads(text)
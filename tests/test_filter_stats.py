@@ -0,0 +1,36 @@
+from pandoc_styles.filter_stats import report_table
+from pandoc_styles.profiler import Profile, text_table
+
+REPORT = {
+    "filter": "box.py",
+    "time": 1.2,
+    "visited": 10,
+    "matched": 2,
+    "conversions": 3,
+    "cached_conversions": 1,
+    "conversion_time": 0.5,
+    "peak_rss_kb": 20480,
+}
+
+
+def test_text_table_aligns_columns():
+    table = text_table(["name", "n"], [["a", "10"], ["long", "2"]])
+    assert table.splitlines() == ["name   n", "a     10", "long   2"]
+
+
+def test_report_table():
+    lines = report_table([REPORT, dict(REPORT, filter="x.py", peak_rss_kb=None)])
+    assert lines.splitlines() == [
+        "filter    time  visited  matched           conv  conv time  rss MB",
+        "box.py  1.200s       10        2  3 (+1 cached)     0.500s    20.0",
+        "x.py    1.200s       10        2  3 (+1 cached)     0.500s       -",
+    ]
+
+
+def test_profile_table():
+    profile = Profile()
+    with profile.phase("doc.md", "html", "pandoc"):
+        pass
+    header, row = profile.table().splitlines()
+    assert header.split()[:3] == ["document", "format", "phase"]
+    assert row.split()[:3] == ["doc.md", "html", "pandoc"]
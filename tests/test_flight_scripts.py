@@ -0,0 +1,88 @@
+from os.path import abspath, dirname
+
+import pytest
+
+from pandoc_styles.flight_scripts import flight_function, run_flight_function
+from pandoc_styles.main import PandocStyles
+
+GUARDED = """\
+from pandoc_styles import file_read, file_write, run_preflight_script
+
+
+def preflight(self):
+    file_write(self.files[-1], f"{file_read(self.files[-1])}FORMAT={self.fmt}")
+
+
+if __name__ == "__main__":
+    run_preflight_script(preflight)
+"""
+
+# valid for a script run as a process: it starts itself when it is imported
+UNGUARDED = """\
+from pandoc_styles import file_read, file_write, run_preflight_script
+
+
+def preflight(self):
+    file_write(self.files[-1], f"{file_read(self.files[-1])}FORMAT={self.fmt}")
+
+
+run_preflight_script(preflight)
+"""
+
+EXITS = """\
+import sys
+
+
+def preflight(self):
+    sys.exit(3)
+"""
+
+
+@pytest.fixture
+def script(tmp_path):
+    def script(text):
+        path = tmp_path / "flight.py"
+        path.write_text(text, encoding="utf-8")
+        return str(path)
+
+    return script
+
+
+def test_guarded_script_runs_in_process(script):
+    assert flight_function(script(GUARDED), "preflight") is not None
+
+
+def test_unguarded_script_runs_as_process(script):
+    assert flight_function(script(UNGUARDED), "preflight") is None
+
+
+def test_script_without_the_function_runs_as_process(script):
+    assert flight_function(script(GUARDED), "postflight") is None
+
+
+def test_exit_of_an_in_process_script_fails(script):
+    func = flight_function(script(EXITS), "preflight")
+    with pytest.raises(RuntimeError):
+        run_flight_function(func, "preflight", {"fmt": "html", "current-files": []})
+
+
+@pytest.mark.parametrize("text", [GUARDED, UNGUARDED])
+def test_build_with_flight_script(tmp_path, stub_pandoc, monkeypatch, script, text):
+    # the script run as a process imports pandoc_styles from this checkout
+    monkeypatch.setenv("PYTHONPATH", dirname(dirname(abspath(__file__))))
+    source = tmp_path / "doc.md"
+    source.write_text("text\n", encoding="utf-8")
+    style_file = tmp_path / "styles.yaml"
+    style_file.write_text(
+        f"Test:\n  all:\n    preflight: [{script(text)}]\n", encoding="utf-8"
+    )
+    PandocStyles(
+        [str(source)],
+        ["html", "latex"],
+        use_styles=["Test"],
+        target=str(tmp_path / "out"),
+        style_file=str(style_file),
+    ).run()
+    for fmt in ["html", "latex"]:
+        output = tmp_path / "out" / f"doc.{fmt}"
+        assert output.read_text(encoding="utf-8") == f"text\nFORMAT={fmt}"
@@ -0,0 +1,83 @@
+from copy import deepcopy
+
+import pytest
+
+from pandoc_styles.layered_config import LayeredConfig, merge_into
+from pandoc_styles.utils import update_dict
+
+
+def reference_update_dict(dictionary, new):
+    """update_dict as it was before the layered configs"""
+    new = deepcopy(new)
+    for key, value in new.items():
+        if not dictionary.get(key):
+            dictionary[key] = value
+        elif isinstance(value, dict):
+            reference_update_dict(dictionary[key], value)
+        elif isinstance(value, list) and isinstance(dictionary[key], list):
+            for item in value:
+                if item not in dictionary[key]:
+                    dictionary[key].append(item)
+        else:
+            dictionary[key] = value
+
+
+LAYERS = [
+    [{"a": 1}, {"a": 2}],
+    [{"a": {"b": 1, "c": [1]}}, {"a": {"c": [1, 2], "d": 3}}],
+    [{"l": [1, 2]}, {"l": [2, 3]}, {"l": [3, 4, 1]}],
+    [{"l": [{"x": 1}]}, {"l": [{"x": 1}, {"x": 2}]}],
+    [{"a": ""}, {"a": "set"}],
+    [{"a": [1]}, {"a": "scalar"}],
+    [{"a": 0}, {"a": {"b": 1}}, {"a": {"c": 2}}],
+    [{"n": {"m": {"o": [1]}}}, {"n": {"m": {"o": [2], "p": True}}}, {"n": None}],
+    [{}, {"a": 1}, {}],
+]
+
+
+@pytest.mark.parametrize("layers", LAYERS)
+def test_merge_into_matches_update_dict(layers):
+    expected = {}
+    for layer in layers:
+        reference_update_dict(expected, layer)
+
+    result = {}
+    for layer in deepcopy(layers):
+        merge_into(result, layer)
+    assert result == expected
+
+    result = {}
+    for layer in layers:
+        update_dict(result, layer)
+    assert result == expected
+
+
+@pytest.mark.parametrize("layers", LAYERS)
+def test_materialize_matches_update_dict_and_keeps_layers(layers):
+    expected = {}
+    for layer in layers:
+        reference_update_dict(expected, layer)
+    original = deepcopy(layers)
+
+    config = LayeredConfig(*layers)
+    result = config.materialize()
+    assert result == expected
+    assert layers == original
+
+    # the result is independent of the layers
+    for value in result.values():
+        if isinstance(value, list):
+            value.append("changed")
+        elif isinstance(value, dict):
+            value["changed"] = True
+    assert layers == original
+    for key in expected:
+        assert config[key] == expected[key]
+
+
+def test_section_orders_the_layers_by_key():
+    config = LayeredConfig(
+        {"all": {"a": [1]}, "html": {"a": [2]}},
+        {"all": {"a": [3]}, "html": {"b": 1}},
+    )
+    assert config.section("all", "html").materialize() == {"a": [1, 3, 2], "b": 1}
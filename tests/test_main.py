@@ -0,0 +1,63 @@
+import logging
+import sys
+
+import pytest
+
+from pandoc_styles import main as main_module
+from pandoc_styles.main import PandocStyles
+
+
+@pytest.fixture
+def failing_build(tmp_path, stub_pandoc, monkeypatch):
+    """Return a function, that runs main() for the documents, with b.md failing"""
+
+    def run(self):
+        if any(f.endswith("b.md") for f in self.files):
+            raise RuntimeError("boom")
+
+    monkeypatch.setattr(PandocStyles, "run", run)
+
+    style_file = tmp_path / "styles.yaml"
+    style_file.write_text("Test:\n  all:\n    toc: true\n", encoding="utf-8")
+
+    def build(*names):
+        for name in names:
+            (tmp_path / name).write_text("text\n", encoding="utf-8")
+        args = [str(tmp_path / name) for name in names]
+        args += ["-i", "--style-file", str(style_file)]
+        monkeypatch.setattr(sys, "argv", ["pandoc-styles", *args])
+        main_module.main()
+
+    return build
+
+
+def test_error_of_a_single_document_is_raised(failing_build):
+    with pytest.raises(RuntimeError, match="boom"):
+        failing_build("b.md")
+
+
+def test_error_of_one_of_many_documents_is_logged(failing_build, caplog):
+    with caplog.at_level(logging.INFO), pytest.raises(SystemExit) as exit_info:
+        failing_build("a.md", "b.md", "c.md")
+    assert exit_info.value.code == 1
+    error = next(r for r in caplog.records if "boom" in r.getMessage())
+    assert error.exc_info is not None
+    assert "Converted 2 of 3 documents" in caplog.text
+
+
+def test_captured_log_has_the_traceback():
+    records = []
+    handler = main_module._ListHandler(records)
+    logger = logging.getLogger("pandoc_styles_test")
+    logger.addHandler(handler)
+    try:
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            logger.exception("failed")
+    finally:
+        logger.removeHandler(handler)
+    level, message = records[0]
+    assert level == logging.ERROR
+    assert message.startswith("failed\nTraceback")
+    assert "RuntimeError: boom" in message
@@ -0,0 +1,71 @@
+import logging
+
+import pytest
+
+from pandoc_styles import output_replace
+from pandoc_styles.constants import MD_REPL_PATTERN, MD_REPL_TEXT
+from pandoc_styles.output_replace import OutputReplacer, check_pattern
+
+
+@pytest.mark.parametrize(
+    "pattern", [r"(<br>\s*)+", r"(<li>.*?</li>\s*)+", r"(\n\s*)+</body>"]
+)
+def test_check_pattern_accepts_repeated_groups(pattern):
+    bytes_pattern, _ = check_pattern(pattern)
+    assert bytes_pattern is not None
+
+
+def test_check_pattern_warns_about_nested_repetitions(caplog):
+    check_pattern.cache_clear()
+    with caplog.at_level(logging.WARNING):
+        check_pattern(r"(.*?x)+b")
+    assert "nests unbounded repetitions" in caplog.text
+
+
+@pytest.mark.parametrize("pattern", [r"(a+)+b", r"(\s*)*</body>", r"(?:a*|b)+c"])
+def test_check_pattern_rejects_repeated_repetitions(pattern):
+    with pytest.raises(ValueError):
+        check_pattern(pattern)
+
+
+def test_check_pattern_rejects_invalid_patterns():
+    with pytest.raises(ValueError):
+        check_pattern(r"(<br>")
+
+
+def test_check_pattern_byte_safety():
+    assert check_pattern(r"</body>")[1]
+    assert not check_pattern(r"(?i)</body>")[1]
+    assert check_pattern("ä")[0] is None
+
+
+@pytest.mark.parametrize("stream_size", [0, output_replace.STREAM_SIZE])
+def test_replace_matches_windows_newlines_with_n(tmp_path, monkeypatch, stream_size):
+    monkeypatch.setattr(output_replace, "STREAM_SIZE", stream_size)
+    path = tmp_path / "out.html"
+    path.write_bytes(b"<script>/*\r\n  * /MathJax.js */</script>\r\n</body>\r\n")
+    replacer = OutputReplacer(
+        [
+            {
+                MD_REPL_PATTERN: r"<script>\/\*\n\s+\*\s+\/MathJax\.js.*?<\/script>",
+                MD_REPL_TEXT: "<script></script>",
+            }
+        ]
+    )
+    assert replacer.apply(str(path))
+    assert path.read_bytes() == b"<script></script>\n</body>\n"
+
+
+@pytest.mark.parametrize("stream_size", [0, output_replace.STREAM_SIZE])
+def test_replace_in_order(tmp_path, monkeypatch, stream_size):
+    monkeypatch.setattr(output_replace, "STREAM_SIZE", stream_size)
+    path = tmp_path / "out.html"
+    path.write_text("<b>x</b>", encoding="utf-8")
+    replacer = OutputReplacer(
+        [
+            {MD_REPL_PATTERN: "<b>", MD_REPL_TEXT: "<strong>"},
+            {MD_REPL_PATTERN: "<strong>x", MD_REPL_TEXT: "<strong>y"},
+        ]
+    )
+    assert replacer.apply(str(path))
+    assert path.read_text(encoding="utf-8") == "<strong>y</b>"
@@ -0,0 +1,122 @@
+import io
+import json
+import os
+
+import pytest
+
+from pandoc_styles import pandoc_data, pandoc_server
+from pandoc_styles.constants import SERVER_ENV
+from pandoc_styles.pandoc_server import (
+    PandocServer,
+    ServerError,
+    convert,
+    server_request,
+    server_url,
+)
+
+
+@pytest.fixture
+def bin_dir(tmp_path, monkeypatch):
+    """A PATH with only an empty folder, so there is no pandoc"""
+    folder = tmp_path / "bin"
+    folder.mkdir()
+    monkeypatch.setenv("PATH", str(folder))
+    monkeypatch.setattr(pandoc_data, "pandoc_outputs", {})
+    monkeypatch.delenv(SERVER_ENV, raising=False)
+    return folder
+
+
+def write_pandoc(folder, features):
+    pandoc = folder / "pandoc"
+    pandoc.write_text(
+        f"#!/bin/sh\necho 'pandoc 3.1.9'\necho 'Features: {features}'\n",
+        encoding="utf-8",
+    )
+    pandoc.chmod(0o755)
+
+
+def test_stop_without_start(bin_dir):
+    PandocServer().stop()
+    assert server_url() is None
+
+
+def test_stop_keeps_a_server_it_did_not_start(bin_dir, monkeypatch):
+    monkeypatch.setenv(SERVER_ENV, "http://127.0.0.1:1/")
+    PandocServer().stop()
+    assert server_url() == "http://127.0.0.1:1/"
+
+
+def test_start_without_pandoc(bin_dir):
+    with PandocServer() as server:
+        assert server.url is None
+        assert server_url() is None
+
+
+def test_start_without_server_support(bin_dir):
+    write_pandoc(bin_dir, "-server +lua")
+    server = PandocServer()
+    assert not server.start()
+    server.stop()
+    assert server_url() is None
+    assert SERVER_ENV not in os.environ
+
+
+@pytest.fixture
+def source(tmp_path):
+    def source(text):
+        path = tmp_path / "doc.md"
+        path.write_text(text, encoding="utf-8")
+        return str(path)
+
+    return source
+
+
+def test_server_request_for_text_formats(source):
+    request, output_file = server_request(
+        f"pandoc {source('text')} -t html -o out.html --standalone"
+    )
+    assert output_file == "out.html"
+    assert request["text"] == "text\n"
+    assert request["to"] == "html"
+    assert request["standalone"]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        "-t docx -o out.docx",
+        "-t epub3 -o out.epub",
+        "-t latex -o out.pdf",
+        "-t html -o out.html --css style.css",
+        "-t html -o out.html --filter filter.py",
+    ],
+)
+def test_no_server_request_for_resources(source, args):
+    assert server_request(f"pandoc {source('text')} {args}") is None
+
+
+@pytest.mark.parametrize(
+    "text", ["![image](image.png)", '<img src="image.png">', "\\includegraphics{a}"]
+)
+def test_no_server_request_for_images(source, text):
+    assert server_request(f"pandoc {source(text)} -t html -o out.html") is None
+
+
+def test_server_messages_fail(monkeypatch):
+    response = {"output": "<p>text</p>", "messages": [{"verbosity": "WARNING"}]}
+
+    class Response(io.BytesIO):
+        def __enter__(self):
+            return self
+
+    monkeypatch.setattr(
+        pandoc_server,
+        "urlopen",
+        lambda *args, **kwargs: Response(json.dumps(response).encode("utf-8")),
+    )
+    with pytest.raises(ServerError):
+        convert("text", "markdown", "html", url="http://127.0.0.1:1/")
+    response["messages"] = []
+    assert convert("text", "markdown", "html", url="http://127.0.0.1:1/") == (
+        "<p>text</p>"
+    )
@@ -0,0 +1,89 @@
+import sys
+from os.path import join
+
+import pytest
+
+from pandoc_styles import main as main_module
+from pandoc_styles.cfg_file import load_cfg
+from pandoc_styles.constants import CFG_FILTER_FILE, FMT, MD_TEMP_DIR
+from pandoc_styles.main import PandocStyles
+
+STYLES = """\
+Test:
+  html:
+    metadata:
+      title: HTML
+  latex:
+    metadata:
+      title: LATEX
+"""
+FORMATS = {"html": "html", "latex": "latex", "markdown": "md"}
+
+
+@pytest.fixture
+def style_file(tmp_path):
+    path = tmp_path / "styles.yaml"
+    path.write_text(STYLES, encoding="utf-8")
+    return str(path)
+
+
+def test_parallel_formats_build_in_their_own_temp_dirs(
+    tmp_path, stub_pandoc, monkeypatch, style_file
+):
+    builds = {}
+    make_format = PandocStyles.make_format
+
+    def record(self, fmt):
+        make_format(self, fmt)
+        builds[fmt] = (
+            self,
+            self.temp_dir,
+            load_cfg(join(self.temp_dir, CFG_FILTER_FILE)),
+        )
+
+    monkeypatch.setattr(PandocStyles, "make_format", record)
+    source = tmp_path / "doc.md"
+    source.write_text("text\n", encoding="utf-8")
+    ps = PandocStyles(
+        [str(source)],
+        list(FORMATS),
+        use_styles=["Test"],
+        target=str(tmp_path / "out"),
+        style_file=style_file,
+        jobs=2,
+    )
+    ps.run()
+
+    assert set(builds) == set(FORMATS)
+    assert len({id(worker) for worker, _, _ in builds.values()}) == len(FORMATS)
+    for fmt, (worker, temp_dir, cfg) in builds.items():
+        assert worker is not ps
+        assert temp_dir == join(ps.temp_dir, fmt)
+        assert cfg[FMT] == fmt
+        assert cfg[MD_TEMP_DIR] == temp_dir
+    assert builds["html"][2]["metadata"]["title"] == "HTML"
+    assert builds["latex"][2]["metadata"]["title"] == "LATEX"
+    for ext in FORMATS.values():
+        output = tmp_path / "out" / f"doc.{ext}"
+        assert output.read_text(encoding="utf-8") == "text\n"
+
+
+@pytest.mark.parametrize("individual", [True, False])
+def test_parallel_documents_and_formats(
+    tmp_path, stub_pandoc, monkeypatch, style_file, individual
+):
+    names = ["a", "b", "c"]
+    for name in names:
+        (tmp_path / f"{name}.md").write_text(f"{name}\n", encoding="utf-8")
+    args = [str(tmp_path / f"{name}.md") for name in names]
+    args += ["--to", "html", "latex", "--jobs", "2", "--styles", "Test"]
+    args += ["-d", str(tmp_path / "out"), "--style-file", style_file]
+    monkeypatch.setattr(sys, "argv", ["pandoc-styles", *args, *(["-i"] * individual)])
+    main_module.main()
+
+    documents = names if individual else ["a"]
+    for name in documents:
+        for ext in ["html", "latex"]:
+            text = (tmp_path / "out" / f"{name}.{ext}").read_text(encoding="utf-8")
+            assert text == (f"{name}\n" if individual else "a\nb\nc\n")
+    assert len(list((tmp_path / "out").iterdir())) == 2 * len(documents)
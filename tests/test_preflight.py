@@ -0,0 +1,98 @@
+import pytest
+
+from pandoc_styles.main import PandocStyles
+
+SCRIPT = """\
+from pandoc_styles import file_read, file_write, run_preflight_script
+
+
+def preflight(self):
+    with open({runs!r}, "a") as f:
+        f.write("run\\n")
+    text = file_read(self.files[-1])
+    file_write(self.files[-1], f"{{text}}FORMAT={{self.fmt}} {{self.cfg['append']}}")
+
+
+if __name__ == "__main__":
+    run_preflight_script(preflight)
+"""
+
+
+@pytest.fixture
+def build(tmp_path, stub_pandoc):
+    """Return a function, that builds html and latex with the style"""
+    runs = tmp_path / "runs.log"
+    script = tmp_path / "append.py"
+    script.write_text(SCRIPT.format(runs=str(runs)), encoding="utf-8")
+    source = tmp_path / "doc.md"
+    source.write_text("---\nstyle: Test\n---\ntext\n", encoding="utf-8")
+    target = tmp_path / "out"
+
+    def build(style):
+        style_file = tmp_path / "styles.yaml"
+        style_file.write_text(style.format(script=script), encoding="utf-8")
+        PandocStyles(
+            [str(source)],
+            ["html", "latex"],
+            target=str(target),
+            style_file=str(style_file),
+        ).run()
+        outputs = {
+            path.suffix: path.read_text(encoding="utf-8") for path in target.iterdir()
+        }
+        return outputs, runs.read_text(encoding="utf-8").count("run")
+
+    return build
+
+
+def test_preflight_runs_for_every_format(build):
+    outputs, runs = build("Test:\n  all:\n    preflight: [{script}]\n    append: A\n")
+    assert outputs[".html"].endswith("FORMAT=html A")
+    assert outputs[".latex"].endswith("FORMAT=latex A")
+    assert runs == 2
+
+
+def test_shared_preflight_runs_once(build):
+    outputs, runs = build(
+        "Test:\n  all:\n    preflight: [{script}]\n    preflight-shared: true\n"
+        "    append: A\n"
+    )
+    assert outputs[".html"].endswith("FORMAT=html A")
+    assert outputs[".latex"].endswith("FORMAT=html A")
+    assert runs == 1
+
+
+def test_formats_with_different_cfgs_dont_share(build):
+    outputs, runs = build(
+        "Test:\n  all:\n    preflight: [{script}]\n    preflight-shared: true\n"
+        "  html:\n    append: A\n  latex:\n    append: B\n"
+    )
+    assert outputs[".html"].endswith("FORMAT=html A")
+    assert outputs[".latex"].endswith("FORMAT=latex B")
+    assert runs == 2
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_shared_preflight_with_jobs(tmp_path, stub_pandoc, jobs):
+    runs = tmp_path / "runs.log"
+    script = tmp_path / "append.py"
+    script.write_text(SCRIPT.format(runs=str(runs)), encoding="utf-8")
+    source = tmp_path / "doc.md"
+    source.write_text("text\n", encoding="utf-8")
+    style_file = tmp_path / "styles.yaml"
+    style_file.write_text(
+        f"Test:\n  all:\n    preflight: [{script}]\n    preflight-shared: true\n"
+        "    append: A\n",
+        encoding="utf-8",
+    )
+    PandocStyles(
+        [str(source)],
+        ["html", "latex", "markdown"],
+        use_styles=["Test"],
+        target=str(tmp_path / "out"),
+        style_file=str(style_file),
+        jobs=jobs,
+    ).run()
+    assert runs.read_text(encoding="utf-8").count("run") == 1
+    for path in (tmp_path / "out").iterdir():
+        assert path.read_text(encoding="utf-8").startswith("text\nFORMAT=")
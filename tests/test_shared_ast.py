@@ -0,0 +1,52 @@
+import pytest
+
+from pandoc_styles.main import PandocStyles
+
+FORMATS = {"html": "html", "latex": "latex", "markdown": "md"}
+
+
+@pytest.fixture
+def build(tmp_path, stub_pandoc):
+    """Return a function, that builds the formats and returns outputs and calls"""
+    for name in ["a", "b"]:
+        (tmp_path / f"{name}.md").write_text(f"text {name}\n", encoding="utf-8")
+    style_file = tmp_path / "styles.yaml"
+    style_file.write_text("Test:\n  all:\n    toc: true\n", encoding="utf-8")
+
+    def build(formats, shared_ast):
+        target = tmp_path / ("shared" if shared_ast else "separate")
+        before = len(stub_pandoc.calls())
+        PandocStyles(
+            [str(tmp_path / "a.md"), str(tmp_path / "b.md")],
+            formats,
+            use_styles=["Test"],
+            target=str(target),
+            style_file=str(style_file),
+            shared_ast=shared_ast,
+        ).run()
+        outputs = {
+            fmt: (target / f"a.{FORMATS[fmt]}").read_text(encoding="utf-8")
+            for fmt in formats
+        }
+        calls = [c for c in stub_pandoc.calls()[before:] if "-o" in c]
+        return outputs, calls
+
+    return build
+
+
+def test_shared_ast_gives_the_same_outputs(build):
+    separate, separate_calls = build(list(FORMATS), False)
+    shared, shared_calls = build(list(FORMATS), True)
+    assert shared == separate
+    assert shared["html"] == "text a\ntext b\n"
+    # the sources are parsed once, every format is rendered from the ast
+    parses = [c for c in shared_calls if c[c.index("-t") + 1] == "json"]
+    assert len(parses) == 1
+    assert len(shared_calls) == len(separate_calls) + 1
+    assert all("json" in c for c in shared_calls if c not in parses)
+
+
+def test_single_format_reads_the_sources(build):
+    _, calls = build(["html"], True)
+    assert len(calls) == 1
+    assert "json" not in calls[0]
@@ -0,0 +1,168 @@
+import json
+import re
+
+import panflute as pf
+from panflute.elements import from_json
+
+import pandoc_styles
+from pandoc_styles import filter as filter_module
+from pandoc_styles import filter_host
+from pandoc_styles.filter import PandocStylesFilter, TransformFilter
+from pandoc_styles.snippet_cache import SnippetCache
+from pandoc_styles.snippets import SnippetBatch
+
+API_VERSION = [1, 23, 1]
+RAW_BLOCK = re.compile(r"```\{=(\S+)\}\n(.*)\n```", re.DOTALL)
+
+
+class FakePandoc:
+    """
+    Stands in for convert_text: reads paragraphs and raw blocks of markdown, json
+    or panflute elements and writes them as html, keeping raw html blocks like
+    pandoc does.
+    """
+
+    def __init__(self, keep_raw=True):
+        self.keep_raw = keep_raw
+        self.calls = 0
+
+    def __call__(self, text, input_format="markdown", output_format="panflute", *_):
+        self.calls += 1
+        if input_format == "json":
+            blocks = list(json.loads(text, object_hook=from_json).content)
+        elif input_format == "panflute":
+            blocks = list(text)
+        else:
+            blocks = []
+            for chunk in re.split(r"\n\n+", text.strip("\n")):
+                raw = RAW_BLOCK.fullmatch(chunk)
+                if raw:
+                    blocks.append(pf.RawBlock(raw[2], raw[1]))
+                elif chunk.startswith("<"):
+                    blocks.append(pf.RawBlock(chunk, "html"))
+                else:
+                    blocks.append(pf.Para(pf.Str(chunk)))
+        if output_format == "panflute":
+            return blocks
+        lines = []
+        for block in blocks:
+            if isinstance(block, pf.RawBlock):
+                if self.keep_raw and block.format == output_format:
+                    lines.append(block.text)
+            else:
+                lines.append(f"<p>{pf.stringify(block).strip()}</p>")
+        return "\n".join(lines)
+
+
+def results(batch):
+    batch.resolve()
+    return [pending.result for pending in batch.pending]
+
+
+def test_batched_text_like_unbatched():
+    snippets = ["one", "two", "three"]
+    pandoc = FakePandoc()
+    batch = SnippetBatch(pandoc, API_VERSION)
+    for snippet in snippets:
+        batch.text(snippet, "html")
+    assert results(batch) == [FakePandoc()(s, "markdown", "html") for s in snippets]
+    assert pandoc.calls == 1
+
+
+def test_batched_content_like_unbatched():
+    contents = [[pf.Para(pf.Str("one"))], [pf.Para(pf.Str("two"))]]
+    pandoc = FakePandoc()
+    batch = SnippetBatch(pandoc, API_VERSION)
+    for content in contents:
+        batch.content_text(content, "html")
+    expected = [
+        FakePandoc()(
+            json.dumps(
+                {
+                    "pandoc-api-version": API_VERSION,
+                    "meta": {},
+                    "blocks": [block.to_json() for block in content],
+                }
+            ),
+            "json",
+            "html",
+        )
+        for content in contents
+    ]
+    assert results(batch) == expected
+    assert pandoc.calls == 1
+
+
+def test_lost_separators_fall_back_to_single_conversions():
+    snippets = ["one", "two", "three"]
+    pandoc = FakePandoc(keep_raw=False)
+    batch = SnippetBatch(pandoc, API_VERSION)
+    for snippet in snippets:
+        batch.text(snippet, "html")
+    assert results(batch) == ["<p>one</p>", "<p>two</p>", "<p>three</p>"]
+    assert pandoc.calls == 1 + len(snippets)
+
+
+def test_unsafe_markdown_is_converted_alone():
+    pandoc = FakePandoc()
+    batch = SnippetBatch(pandoc, API_VERSION)
+    batch.text("one", "html")
+    batch.text("two", "html")
+    batch.text("a note[^1]", "html")
+    assert results(batch) == ["<p>one</p>", "<p>two</p>", "<p>a note[^1]</p>"]
+    assert pandoc.calls == 2
+
+
+def test_conversions_of_earlier_results():
+    pandoc = FakePandoc()
+    batch = SnippetBatch(pandoc, API_VERSION)
+    token = batch.text("inner", "html")
+    batch.text(f"outer {token}", "html")
+    assert results(batch) == ["<p>inner</p>", "<p>outer <p>inner</p></p>"]
+
+
+def test_batching_is_opt_in():
+    assert not PandocStylesFilter(lambda self: None).batch_conversions
+    assert not TransformFilter(all_formats="{text}").batch_conversions
+    assert TransformFilter(html="{text}", batch_conversions=True).batch_conversions
+    assert not TransformFilter(
+        html="{text}", check=lambda self: True, batch_conversions=True
+    ).batch_conversions
+
+
+def run_box_filter(monkeypatch, batch_conversions):
+    """Run a TransformFilter over a document, return it as json and the calls"""
+    pandoc = FakePandoc()
+    cache = SnippetCache()
+    cache._pandoc = "pandoc"
+    monkeypatch.setattr(pf, "convert_text", pandoc)
+    monkeypatch.setattr(filter_module, "snippet_cache", cache)
+    doc = pf.Doc(
+        pf.Div(pf.Para(pf.Str("one")), classes=["box"]),
+        pf.Para(pf.Str("between")),
+        pf.Div(pf.Para(pf.Str("two")), pf.Para(pf.Str("more")), classes=["box"]),
+        pf.Div(pf.Para(pf.Str("three")), classes=["box"]),
+        format="html",
+        api_version=tuple(API_VERSION),
+    )
+    monkeypatch.setattr(filter_host, "hosted_doc", doc)
+    TransformFilter(
+        tags=["box"],
+        html='<div class="box">\n{text}\n</div>',
+        batch_conversions=batch_conversions,
+    ).run()
+    return filter_host.hosted_doc.to_json(), pandoc.calls
+
+
+def test_batched_filter_output_like_unbatched(monkeypatch):
+    unbatched, unbatched_calls = run_box_filter(monkeypatch, False)
+    batched, batched_calls = run_box_filter(monkeypatch, True)
+    assert batched == unbatched
+    assert batched_calls == 2
+    assert unbatched_calls == 6
+
+
+def test_package_exports_the_caching_convert_text():
+    assert pandoc_styles.convert_text is filter_module.convert_text
+    assert pf.convert_text is not filter_module.convert_text
+    assert "convert_text" in filter_module.__all__
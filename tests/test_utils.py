@@ -0,0 +1,75 @@
+import threading
+from os.path import abspath, dirname, join
+
+import pytest
+from ruamel.yaml import YAML
+
+from pandoc_styles import utils
+from pandoc_styles.utils import yaml_load
+
+STYLES = join(dirname(dirname(abspath(__file__))), "pandoc_styles", "config_dir")
+
+TRICKY = """\
+plain: text
+yaml11: [no, yes, on, off, 010, 0o10, 1_000]
+date: 2024-01-31
+float: 1.5e3
+empty:
+anchors:
+  base: &base {a: 1, b: [1, 2]}
+  copy: *base
+  merged:
+    <<: *base
+    b: 3
+block: |
+  line one
+  line two
+unicode: "ü ☃"
+"""
+
+
+def round_trip_load(text):
+    """yaml_load as it was: a new round trip loader for every call"""
+    return YAML().load(text)
+
+
+@pytest.mark.parametrize("text", [TRICKY, "a: 1\n", ""])
+def test_yaml_load_like_a_new_round_trip_loader(text):
+    assert yaml_load(text, True) == round_trip_load(text)
+    # a reused loader gives the same result again
+    assert yaml_load(text, True) == round_trip_load(text)
+
+
+def test_unknown_tags_load_like_before():
+    text = "list:\n  - !custom tagged\n"
+    tagged = yaml_load(text, True)["list"][0]
+    expected = round_trip_load(text)["list"][0]
+    assert type(tagged) is type(expected)
+    assert (tagged.value, str(tagged.tag)) == (expected.value, str(expected.tag))
+
+
+@pytest.mark.parametrize("name", ["styles.yaml", "config.yaml"])
+def test_shipped_files_load_like_before(name):
+    with open(join(STYLES, name), encoding="utf-8") as f:
+        text = f.read()
+    assert yaml_load(join(STYLES, name)) == round_trip_load(text)
+
+
+def test_round_trip_keeps_comments():
+    assert "# note" in utils.yaml_dump(yaml_load("a: 1  # note\n", True, True))
+
+
+def test_loader_per_thread():
+    loaders = []
+
+    def load():
+        yaml_load("a: 1", True)
+        loaders.append(utils._yaml_loader())
+
+    threads = [threading.Thread(target=load) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loaders[0] is not loaders[1]
+    assert utils._yaml_loader() is utils._yaml_loader()
@@ -0,0 +1,52 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from pandoc_styles import main as main_module
+from pandoc_styles.utils import run_process, terminate_children
+
+
+def test_terminate_children_stops_a_running_process():
+    errors = []
+
+    def build():
+        try:
+            run_process([sys.executable, "-c", "import time; time.sleep(30)"])
+        except subprocess.CalledProcessError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=build)
+    start = time.monotonic()
+    thread.start()
+    time.sleep(0.5)
+    terminate_children(thread)
+    thread.join(10)
+    assert not thread.is_alive()
+    assert time.monotonic() - start < 10
+    assert len(errors) == 1
+
+
+def test_run_process_output():
+    process = run_process([sys.executable, "-c", "print('out')"], get_output=True)
+    assert process.returncode == 0
+    assert process.stdout.strip() == "out"
+
+
+def test_run_process_failure():
+    with pytest.raises(subprocess.CalledProcessError):
+        run_process([sys.executable, "-c", "raise SystemExit(3)"])
+
+
+def test_watch_rejects_several_documents(tmp_path, monkeypatch):
+    for name in ["a.md", "b.md"]:
+        (tmp_path / name).write_text("# text\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        sys, "argv", ["pandoc_styles", "a.md", "b.md", "--individual", "--watch"]
+    )
+    with pytest.raises(SystemExit) as e:
+        main_module.main()
+    assert e.value.code == 1